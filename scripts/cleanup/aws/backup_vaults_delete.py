@@ -1,43 +1,213 @@
+import argparse
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from scripts.common.retries import backoff_delay, error_code
 
+# vaults emptied at the same time
+VAULT_WORKERS = 4
+# delete_recovery_point calls in flight across every vault
+DELETE_WORKERS = 16
+# recovery points listed ahead of the deletes per deleting thread
+POINTS_AHEAD = 4
 
-def delete_vaults_with_prefix(prefix):
-    # Create a Backup service client
-    client = boto3.client("backup")
+MAX_RETRIES = 8
+BASE_DELAY = 0.2
+MAX_DELAY = 20.0
+# errors worth sending again, the service is shedding load
+RETRYABLE_ERRORS = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceUnavailableException",
+}
 
-    # List all backup vaults
-    vaults = client.list_backup_vaults()["BackupVaultList"]
+# recovery points are deleted in the background. Vaults are polled from
+# POLL_DELAY seconds apart, doubling up to MAX_POLL_DELAY, until they are
+# empty and can be deleted or EMPTY_TIMEOUT seconds have passed.
+POLL_DELAY = 1.0
+MAX_POLL_DELAY = 30.0
+EMPTY_TIMEOUT = 900.0
 
-    # Filter vaults that start with the specified prefix
-    filtered_vaults = [
-        vault for vault in vaults if vault["BackupVaultName"].startswith(prefix)
-    ]
 
-    for vault in filtered_vaults:
-        vault_name = vault["BackupVaultName"]
-        print(f"Processing vault: {vault_name}")
+def new_client(workers=VAULT_WORKERS + DELETE_WORKERS):
+    # one client is shared by every thread, its connection pool has to be
+    # as large as the number of requests in flight
+    return boto3.client(
+        "backup",
+        config=Config(max_pool_connections=workers, retries={"mode": "adaptive"}),
+    )
+
+
+def list_vaults_with_prefix(client, prefix):
+    paginator = client.get_paginator("list_backup_vaults")
+    for page in paginator.paginate():
+        for vault in page["BackupVaultList"]:
+            if vault["BackupVaultName"].startswith(prefix):
+                yield vault["BackupVaultName"]
+
+
+def iter_recovery_points(client, vault_name):
+    paginator = client.get_paginator("list_recovery_points_by_backup_vault")
+    for page in paginator.paginate(BackupVaultName=vault_name):
+        yield from page["RecoveryPoints"]
+
+
+def delete_recovery_point(client, vault_name, arn, sleep=time.sleep, max_retries=MAX_RETRIES):
+    # start deleting one recovery point, retrying throttles with backoff.
+    # Returns None once the delete has started, or the error code if the
+    # point cannot be deleted. A point already gone counts as started.
+    for attempt in range(max_retries + 1):
+        try:
+            client.delete_recovery_point(BackupVaultName=vault_name, RecoveryPointArn=arn)
+            return None
+        except ClientError as error:
+            code = error_code(error)
+            if code == "ResourceNotFoundException":
+                return None
+            if code not in RETRYABLE_ERRORS or attempt == max_retries:
+                return code
+            sleep(backoff_delay(attempt, BASE_DELAY, MAX_DELAY))
 
-        # List all recovery points in the vault
-        recovery_points = client.list_recovery_points_by_backup_vault(
-            BackupVaultName=vault_name
-        )["RecoveryPoints"]
 
-        # Delete each recovery point
-        for point in recovery_points:
-            recovery_point_arn = point["RecoveryPointArn"]
-            print(f"Deleting recovery point: {recovery_point_arn}")
-            client.delete_recovery_point(
-                BackupVaultName=vault_name, RecoveryPointArn=recovery_point_arn
-            )
+def delete_recovery_points(client, vault_name, executor, in_flight, sleep=time.sleep):
+    # hand every recovery point of the vault not already being deleted to
+    # executor, never more than in_flight at once. Returns (started, arn ->
+    # error code of the points that could not be deleted, points listed).
+    started = 0
+    listed = 0
+    errors = {}
+    pending = {}
 
-        # Give time for the delete to finish
-        time.sleep(5)
+    def collect(future):
+        nonlocal started
+        code = future.result()
+        if code is None:
+            started += 1
+        else:
+            errors[pending[future]] = code
+        del pending[future]
+
+    for point in iter_recovery_points(client, vault_name):
+        listed += 1
+        if point.get("Status") == "DELETING":
+            continue
+        arn = point["RecoveryPointArn"]
+        pending[executor.submit(delete_recovery_point, client, vault_name, arn, sleep)] = arn
+        if len(pending) >= in_flight:
+            collect(next(as_completed(pending)))
+    for future in as_completed(list(pending)):
+        collect(future)
+    return started, errors, listed
+
+
+def wait_and_delete_vault(
+    client,
+    vault_name,
+    executor,
+    in_flight=DELETE_WORKERS * POINTS_AHEAD,
+    timeout=EMPTY_TIMEOUT,
+    sleep=time.sleep,
+    clock=time.monotonic,
+):
+    # delete the recovery points of the vault, polling it with backoff
+    # until they are gone, then delete the vault. Every poll deletes the
+    # points not DELETING yet, a listing can miss points that show up in
+    # a later one. The vault is retried for a while after its listing
+    # comes back empty, deletes take a moment to reach it. Returns
+    # (recovery points deleted, None or why the vault was left behind).
+    deadline = clock() + timeout
+    delay = POLL_DELAY
+    deleted = 0
+    while True:
+        started, errors, remaining = delete_recovery_points(
+            client, vault_name, executor, in_flight, sleep
+        )
+        deleted += started
+        if errors:
+            codes = sorted(set(errors.values()))
+            print(f"Keeping vault {vault_name}, {len(errors)} recovery points refused: {codes}")
+            return deleted, f"{len(errors)} recovery points could not be deleted: {codes}"
+        if started:
+            print(f"Deleting {started} recovery points of vault: {vault_name}")
+        if not remaining:
+            try:
+                client.delete_backup_vault(BackupVaultName=vault_name)
+                return deleted, None
+            except ClientError as error:
+                if error_code(error) not in RETRYABLE_ERRORS | {"InvalidRequestException"}:
+                    raise
+        if clock() + delay > deadline:
+            print(f"Gave up waiting for {vault_name}, {remaining} recovery points left")
+            return deleted, "recovery points still present after the timeout"
+        print(f"Waiting {delay:0.0f}s for {remaining} recovery points to leave {vault_name}")
+        sleep(delay)
+        delay = min(delay * 2, MAX_POLL_DELAY)
+
+
+def delete_vaults_with_prefix(
+    prefix,
+    vault_workers=VAULT_WORKERS,
+    delete_workers=DELETE_WORKERS,
+    client_factory=new_client,
+    timeout=EMPTY_TIMEOUT,
+    sleep=time.sleep,
+    clock=time.monotonic,
+    vault_names=None,
+):
+    # delete every backup vault whose name starts with prefix and its
+    # recovery points, or only vault_names when they were listed already,
+    # vault_workers vaults at a time sharing delete_workers deleting
+    # threads. A vault that cannot be emptied is reported and the others
+    # carry on. Returns vault name -> reason of the vaults left behind.
+    client = client_factory(vault_workers + delete_workers)
+    if vault_names is None:
+        vault_names = list(list_vaults_with_prefix(client, prefix))
+    lock = threading.Lock()
+    totals = {"deleted": 0}
+
+    def teardown(vault_name):
+        print(f"Processing vault: {vault_name}")
+        started = time.perf_counter()
+        deleted, reason = wait_and_delete_vault(
+            client, vault_name, deleter, delete_workers * POINTS_AHEAD, timeout, sleep, clock
+        )
+        with lock:
+            totals["deleted"] += deleted
+        if reason:
+            return reason
+        seconds = time.perf_counter() - started
+        print(f"Vault {vault_name} deleted in {seconds:0.1f} seconds")
+        return None
 
-        # Delete the backup vault
-        print(f"Deleting vault: {vault_name}")
-        client.delete_backup_vault(BackupVaultName=vault_name)
+    failures = {}
+    with ThreadPoolExecutor(delete_workers) as deleter, ThreadPoolExecutor(
+        vault_workers
+    ) as vaults:
+        futures = {
+            vaults.submit(teardown, vault_name): vault_name
+            for vault_name in vault_names
+        }
+        for future in as_completed(futures):
+            vault_name = futures[future]
+            try:
+                reason = future.result()
+            except ClientError as error:
+                print(f"Deleting vault {vault_name} failed: {error}")
+                reason = str(error)
+            if reason:
+                failures[vault_name] = reason
+    print(
+        f"{len(futures) - len(failures)} of {len(futures)} vaults deleted, "
+        f"{totals['deleted']} recovery points deleted"
+    )
+    return failures
 
 
-# Usage
-delete_vaults_with_prefix("dev-9")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Delete backup vaults named with a prefix")
+    parser.add_argument("--prefix", required=True, help="e.g. dev-9")
+    args = parser.parse_args()
+    raise SystemExit(1 if delete_vaults_with_prefix(args.prefix) else 0)
@@ -0,0 +1,213 @@
+import argparse
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from scripts.cleanup.aws import (
+    backup_vaults_delete,
+    cloudwatch_loggroup_delete,
+    eks_delete,
+    iam_policy_delete,
+    s3_bucket_delete,
+)
+from scripts.common.dag import FAILED, SKIPPED, dependency_order, run_graph
+
+# outcomes of a cleanup, besides FAILED and SKIPPED
+DELETED = "deleted"
+NOTHING = "nothing to delete"
+
+
+class Cleanup:
+    # one kind of resource. `inventory(prefix)` lists what would be
+    # deleted, `delete(prefix, items)` deletes exactly those items and
+    # returns the ones it had to leave, and `estimate(items)` guesses the
+    # seconds that takes. A cleanup starts once every cleanup in depends_on
+    # has finished without failing.
+    def __init__(self, name, inventory, delete, estimate, depends_on=(), describe=str):
+        self.name = name
+        self.inventory = inventory
+        self.delete = delete
+        self.estimate = estimate
+        self.depends_on = tuple(depends_on)
+        self.describe = describe
+
+
+def waves(items, workers, seconds):
+    # seconds for items handled workers at a time, each taking seconds
+    return math.ceil(len(items) / workers) * seconds
+
+
+def build_cleanups():
+    # EKS goes first: its node roles hold the IAM policies, and its control
+    # plane writes log groups until the cluster is gone. The estimates are
+    # rough timings from tearing down dev environments.
+    return [
+        Cleanup(
+            "eks",
+            lambda prefix: list(
+                eks_delete.list_clusters_with_prefix(eks_delete.new_client(), prefix)
+            ),
+            lambda prefix, items: eks_delete.delete_eks_clusters_with_prefix(
+                prefix, cluster_names=items
+            ),
+            # node groups and then the cluster take around ten minutes each,
+            # every cluster is torn down at once
+            lambda items: 1200 if items else 0,
+        ),
+        Cleanup(
+            "iam",
+            lambda prefix: list(
+                iam_policy_delete.list_policies_with_prefix(
+                    iam_policy_delete.IamApi(iam_policy_delete.new_client()), prefix
+                )
+            ),
+            lambda prefix, items: iam_policy_delete.delete_iam_policies_with_prefix(
+                prefix, policies=items
+            ),
+            lambda items: waves(items, iam_policy_delete.WORKERS, 2),
+            depends_on=["eks"],
+            describe=lambda policy: policy["PolicyName"],
+        ),
+        Cleanup(
+            "logs",
+            lambda prefix: list(
+                cloudwatch_loggroup_delete.list_log_groups_with_keyword(
+                    cloudwatch_loggroup_delete.new_client(), prefix
+                )
+            ),
+            lambda prefix, items: cloudwatch_loggroup_delete.delete_log_groups_with_keyword(
+                prefix, log_group_names=items
+            ),
+            lambda items: waves(items, cloudwatch_loggroup_delete.WORKERS, 0.5),
+            depends_on=["eks"],
+        ),
+        Cleanup(
+            "s3",
+            lambda prefix: list(
+                s3_bucket_delete.list_buckets_with_prefix(s3_bucket_delete.new_client(), prefix)
+            ),
+            lambda prefix, items: s3_bucket_delete.delete_buckets_with_prefix(
+                prefix, bucket_names=items
+            ),
+            # object counts are not listed, this is an environment's worth
+            # of logs and state per bucket
+            lambda items: waves(items, s3_bucket_delete.BUCKET_WORKERS, 60),
+        ),
+        Cleanup(
+            "backup",
+            lambda prefix: list(
+                backup_vaults_delete.list_vaults_with_prefix(
+                    backup_vaults_delete.new_client(), prefix
+                )
+            ),
+            lambda prefix, items: backup_vaults_delete.delete_vaults_with_prefix(
+                prefix, vault_names=items
+            ),
+            # recovery points take a minute or two to go after their delete
+            lambda items: waves(items, backup_vaults_delete.VAULT_WORKERS, 120),
+        ),
+    ]
+
+
+def check_dependencies(cleanups):
+    # the cleanups in an order that runs every one after its dependencies
+    return dependency_order(cleanups, kind="cleanup")
+
+
+def take_inventory(cleanups, prefix):
+    # list every kind of resource at once. Returns name -> items, the one
+    # snapshot every later step works from.
+    with ThreadPoolExecutor(len(cleanups) or 1) as executor:
+        futures = {
+            cleanup.name: executor.submit(cleanup.inventory, prefix) for cleanup in cleanups
+        }
+    return {name: future.result() for name, future in futures.items()}
+
+
+def estimate_duration(cleanups, inventory):
+    # the longest chain of dependent cleanups, the others run alongside it.
+    # Returns (total seconds, name -> seconds until that cleanup finishes).
+    finishes = {}
+    for cleanup in check_dependencies(cleanups):
+        starts = max((finishes[name] for name in cleanup.depends_on), default=0)
+        finishes[cleanup.name] = starts + cleanup.estimate(inventory[cleanup.name])
+    return max(finishes.values(), default=0), finishes
+
+
+def print_plan(cleanups, inventory, prefix):
+    total, finishes = estimate_duration(cleanups, inventory)
+    print(f"Cleanup plan for prefix '{prefix}':")
+    for cleanup in check_dependencies(cleanups):
+        items = inventory[cleanup.name]
+        after = f", after {', '.join(cleanup.depends_on)}" if cleanup.depends_on else ""
+        print(
+            f"  {cleanup.name}: {len(items)} to delete{after}, "
+            f"done after about {finishes[cleanup.name] / 60:0.0f} minutes"
+        )
+        for item in items:
+            print(f"    {cleanup.describe(item)}")
+    print(f"Estimated duration: about {total / 60:0.0f} minutes")
+    return total
+
+
+def run_cleanup(cleanup, prefix, items):
+    if not items:
+        print(f"{cleanup.name}: nothing to delete")
+        return NOTHING
+    print(f"{cleanup.name}: deleting {len(items)}")
+    failures = cleanup.delete(prefix, items)
+    return FAILED if failures else DELETED
+
+
+def run_cleanups(cleanups, inventory, prefix, run=run_cleanup, max_workers=None):
+    # run every cleanup as soon as the cleanups it depends on have
+    # finished, independent ones in parallel. A failed cleanup skips its
+    # dependents without stopping the others. Returns name -> (outcome,
+    # seconds).
+    return run_graph(
+        cleanups,
+        lambda cleanup: run(cleanup, prefix, inventory[cleanup.name]),
+        max_workers,
+        kind="cleanup",
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Delete the AWS resources of an environment named with a prefix"
+    )
+    parser.add_argument("--prefix", required=True, help="e.g. dev-9")
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="list what would be deleted and how long it should take, deleting nothing",
+    )
+    parser.add_argument(
+        "--only",
+        nargs="+",
+        help="clean up only these, e.g. --only s3 backup",
+    )
+    args = parser.parse_args()
+
+    cleanups = build_cleanups()
+    if args.only:
+        # dependencies outside the selection are assumed to be gone already
+        cleanups = [cleanup for cleanup in cleanups if cleanup.name in args.only]
+        for cleanup in cleanups:
+            cleanup.depends_on = tuple(name for name in cleanup.depends_on if name in args.only)
+
+    started = time.perf_counter()
+    inventory = take_inventory(cleanups, args.prefix)
+    print(f"Inventory taken in {time.perf_counter() - started:0.1f} seconds")
+    print_plan(cleanups, inventory, args.prefix)
+    if args.dry_run:
+        return 0
+
+    outcomes = run_cleanups(cleanups, inventory, args.prefix)
+    for name, (outcome, seconds) in outcomes.items():
+        print(f"{name}: {outcome} in {seconds:0.1f} seconds")
+    print(f"Cleaned up '{args.prefix}' in {time.perf_counter() - started:0.1f} seconds")
+    return 1 if any(outcome in (FAILED, SKIPPED) for outcome, _ in outcomes.values()) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
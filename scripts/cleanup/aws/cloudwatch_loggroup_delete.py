@@ -1,21 +1,77 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from scripts.common.retries import backoff_delay, error_code
 
+# delete_log_group calls in flight. CloudWatch Logs allows about ten
+# control plane requests a second per account.
+WORKERS = 8
+
+MAX_RETRIES = 8
+BASE_DELAY = 0.2
+MAX_DELAY = 10.0
+THROTTLING_ERRORS = {"ThrottlingException", "LimitExceededException", "ServiceUnavailableException"}
+
+
+def new_client(workers=WORKERS):
+    return boto3.client(
+        "logs",
+        config=Config(max_pool_connections=workers, retries={"mode": "adaptive"}),
+    )
 
-def delete_log_groups_with_keyword(keyword):
-    client = boto3.client("logs")
-    paginator = client.get_paginator("describe_log_groups")
 
-    # Use paginator to get all log groups
+def list_log_groups_with_keyword(client, keyword):
+    paginator = client.get_paginator("describe_log_groups")
     for page in paginator.paginate():
-        log_groups = page["logGroups"]
+        for log_group in page["logGroups"]:
+            if keyword in log_group["logGroupName"]:
+                yield log_group["logGroupName"]
+
+
+def delete_log_group(client, log_group_name, sleep=time.sleep, max_retries=MAX_RETRIES):
+    print(f"Deleting log group: {log_group_name}")
+    for attempt in range(max_retries + 1):
+        try:
+            client.delete_log_group(logGroupName=log_group_name)
+            return
+        except ClientError as error:
+            if error_code(error) == "ResourceNotFoundException":
+                return
+            if error_code(error) not in THROTTLING_ERRORS or attempt == max_retries:
+                raise
+            sleep(backoff_delay(attempt, BASE_DELAY, MAX_DELAY))
+
 
-        # Iterate through log groups to find matches
-        for log_group in log_groups:
-            log_group_name = log_group["logGroupName"]
-            if keyword in log_group_name:
-                print(f"Deleting log group: {log_group_name}")
-                client.delete_log_group(logGroupName=log_group_name)
+def delete_log_groups_with_keyword(
+    keyword, workers=WORKERS, client_factory=new_client, log_group_names=None, sleep=time.sleep
+):
+    # delete every log group with keyword in its name, workers at a time,
+    # or only log_group_names when they were listed already. Returns log
+    # group name -> error of the log groups left.
+    client = client_factory(workers)
+    if log_group_names is None:
+        log_group_names = list(list_log_groups_with_keyword(client, keyword))
+    failures = {}
+    with ThreadPoolExecutor(workers) as executor:
+        futures = {
+            executor.submit(delete_log_group, client, name, sleep): name
+            for name in log_group_names
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except ClientError as error:
+                print(f"Deleting log group {futures[future]} failed: {error}")
+                failures[futures[future]] = str(error)
+    print(f"{len(futures) - len(failures)} of {len(futures)} log groups deleted")
+    return failures
 
 
 if __name__ == "__main__":
-    delete_log_groups_with_keyword("dev-9")
+    parser = argparse.ArgumentParser(description="Delete CloudWatch log groups naming a keyword")
+    parser.add_argument("--keyword", required=True, help="e.g. dev-9")
+    args = parser.parse_args()
+    raise SystemExit(1 if delete_log_groups_with_keyword(args.keyword) else 0)
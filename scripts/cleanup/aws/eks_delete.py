@@ -1,81 +1,237 @@
-import boto3
+import argparse
 import time
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from scripts.common.retries import error_code
+
+# clusters checked at the same time on every poll
+WORKERS = 8
+# seconds between polls, doubling while nothing changes and starting
+# again from POLL_DELAY whenever a cluster moves on
+POLL_DELAY = 5.0
+MAX_POLL_DELAY = 30.0
+# seconds the whole teardown may take before the clusters left are reported
+DEADLINE = 3600.0
+# times a node group whose delete failed is deleted again before its
+# cluster is reported as failed
+NODE_GROUP_RETRIES = 2
+
+# where a cluster's teardown is
+NODE_GROUPS = "deleting node groups"
+CLUSTER = "deleting cluster"
+DELETED = "deleted"
+FAILED = "failed"
+TIMED_OUT = "timed out"
+
+
+def new_client(workers=WORKERS):
+    return boto3.client(
+        "eks",
+        config=Config(max_pool_connections=workers, retries={"mode": "adaptive"}),
+    )
 
 
-def delete_node_groups(cluster_name, prefix):
-    client = boto3.client("eks")
-
-    # List node groups
-    response = client.list_nodegroups(clusterName=cluster_name)
-    node_groups = response["nodegroups"]
-
-    # Filter node groups with the specified prefix
-    filtered_node_groups = [ng for ng in node_groups if ng.startswith(prefix)]
-
-    # Delete each filtered node group
-    for node_group in filtered_node_groups:
-        print(f"Deleting node group: {node_group}")
-        client.delete_nodegroup(clusterName=cluster_name, nodegroupName=node_group)
-
-    # Wait for each filtered node group to be deleted
-    for node_group in filtered_node_groups:
-        print(f"Waiting for node group: {node_group} to be deleted")
-        waiter = client.get_waiter("nodegroup_deleted")
-        waiter.wait(clusterName=cluster_name, nodegroupName=node_group)
-
-        # Adding a sleep time to ensure the node group deletion is propagated
-        time.sleep(10)
-
-
-def wait_for_node_groups_deletion(cluster_name):
-    client = boto3.client("eks")
-    count = 10
-
-    while True:
-        response = client.list_nodegroups(clusterName=cluster_name)
-        node_groups = response["nodegroups"]
-
-        if not node_groups:
-            break
+def list_clusters_with_prefix(client, prefix):
+    paginator = client.get_paginator("list_clusters")
+    for page in paginator.paginate():
+        for cluster_name in page["clusters"]:
+            if cluster_name.startswith(prefix):
+                yield cluster_name
 
-        print(f"Node groups {node_groups} still exist. Waiting for {count} seconds...")
-        count += 10
-        time.sleep(10)
 
+def list_node_groups(client, cluster_name):
+    paginator = client.get_paginator("list_nodegroups")
+    return [
+        node_group
+        for page in paginator.paginate(clusterName=cluster_name)
+        for node_group in page["nodegroups"]
+    ]
 
-def delete_cluster(cluster_name):
-    client = boto3.client("eks")
 
-    # Delete the EKS cluster
+def delete_node_groups(client, cluster_name, prefix):
+    # start deleting the cluster's node groups named with prefix, without
+    # waiting for them. Node groups already being deleted or already gone
+    # are left alone. Returns the node groups being deleted.
+    node_groups = [ng for ng in list_node_groups(client, cluster_name) if ng.startswith(prefix)]
+    for node_group in node_groups:
+        print(f"Deleting node group: {node_group}")
+        try:
+            client.delete_nodegroup(clusterName=cluster_name, nodegroupName=node_group)
+        except ClientError as error:
+            if error_code(error) not in ("ResourceInUseException", "ResourceNotFoundException"):
+                raise
+    return node_groups
+
+
+def retry_failed_node_groups(client, teardown, max_retries=NODE_GROUP_RETRIES):
+    # delete the cluster's node groups in DELETE_FAILED again, each up to
+    # max_retries times. Returns why the cluster has to be given up on once
+    # a node group runs out of retries, with the reasons eks reported.
+    for node_group in teardown.node_groups:
+        try:
+            details = client.describe_nodegroup(
+                clusterName=teardown.name, nodegroupName=node_group
+            )["nodegroup"]
+        except ClientError as error:
+            if error_code(error) == "ResourceNotFoundException":
+                continue
+            raise
+        if details["status"] != "DELETE_FAILED":
+            continue
+        issues = details.get("health", {}).get("issues", [])
+        reasons = "; ".join(issue.get("message", issue.get("code", "")) for issue in issues)
+        attempts = teardown.retries.get(node_group, 0)
+        if attempts >= max_retries:
+            return (
+                f"node group {node_group} failed to delete {attempts + 1} times: "
+                f"{reasons or 'no reason given'}"
+            )
+        teardown.retries[node_group] = attempts + 1
+        print(f"Deleting node group {node_group} again, its delete failed: {reasons}")
+        try:
+            client.delete_nodegroup(clusterName=teardown.name, nodegroupName=node_group)
+        except ClientError as error:
+            if error_code(error) not in ("ResourceInUseException", "ResourceNotFoundException"):
+                raise
+    return None
+
+
+def delete_cluster(client, cluster_name):
+    # start deleting the cluster, returning False while node groups still
+    # being deleted hold it up
     print(f"Deleting EKS cluster: {cluster_name}")
-    client.delete_cluster(name=cluster_name)
-
-    # Wait for the cluster to be deleted
-    print(f"Waiting for EKS cluster: {cluster_name} to be deleted")
-    waiter = client.get_waiter("cluster_deleted")
-    waiter.wait(name=cluster_name)
-
-
-def delete_eks_clusters_with_prefix(prefix):
-    client = boto3.client("eks")
-
-    # List clusters
-    response = client.list_clusters()
-    clusters = response["clusters"]
-
-    # Filter clusters with the specified prefix
-    filtered_clusters = [cluster for cluster in clusters if cluster.startswith(prefix)]
-
-    # Delete each filtered cluster and its node groups
-    for cluster in filtered_clusters:
-        delete_node_groups(cluster, prefix)
-        wait_for_node_groups_deletion(cluster)
-        delete_cluster(cluster)
-
+    try:
+        client.delete_cluster(name=cluster_name)
+    except ClientError as error:
+        if error_code(error) == "ResourceInUseException":
+            return False
+        if error_code(error) != "ResourceNotFoundException":
+            raise
+    return True
+
+
+def cluster_exists(client, cluster_name):
+    try:
+        client.describe_cluster(name=cluster_name)
+    except ClientError as error:
+        if error_code(error) == "ResourceNotFoundException":
+            return False
+        raise
+    return True
+
+
+class ClusterTeardown:
+    # one cluster on its way from NODE_GROUPS through CLUSTER to DELETED
+    def __init__(self, name):
+        self.name = name
+        self.phase = NODE_GROUPS
+        self.node_groups = []
+        # node group -> times its failed delete was started again
+        self.retries = {}
+        self.error = None
+        self.reported = None
+
+    @property
+    def done(self):
+        return self.phase in (DELETED, FAILED, TIMED_OUT)
+
+    def status(self):
+        if self.phase == NODE_GROUPS and self.node_groups:
+            return f"waiting on node groups {', '.join(self.node_groups)}"
+        if self.phase == FAILED:
+            return f"failed: {self.error}"
+        return self.phase
+
+
+def advance(client, teardown):
+    # move a cluster on as far as it can go without waiting, returning
+    # whether its phase changed
+    phase = teardown.phase
+    try:
+        if teardown.phase == NODE_GROUPS:
+            teardown.node_groups = list_node_groups(client, teardown.name)
+            failure = retry_failed_node_groups(client, teardown)
+            if failure:
+                teardown.phase = FAILED
+                teardown.error = failure
+            elif not teardown.node_groups and delete_cluster(client, teardown.name):
+                teardown.phase = CLUSTER
+        elif teardown.phase == CLUSTER and not cluster_exists(client, teardown.name):
+            teardown.phase = DELETED
+    except ClientError as error:
+        teardown.phase = FAILED
+        teardown.error = str(error)
+    return teardown.phase != phase
+
+
+def delete_eks_clusters_with_prefix(
+    prefix,
+    deadline=DEADLINE,
+    workers=WORKERS,
+    client_factory=new_client,
+    sleep=time.sleep,
+    clock=time.monotonic,
+    cluster_names=None,
+):
+    # tear down every cluster named with prefix, or only cluster_names when
+    # they were listed already, all at once: every node group
+    # is deleted up front, then all clusters are polled together, each one
+    # deleted as soon as its node groups are gone. Each cluster's progress
+    # is printed as it changes. Clusters not gone by the deadline are
+    # reported. Returns cluster name -> reason of the clusters left behind.
+    client = client_factory(workers)
+    started = clock()
+    if cluster_names is None:
+        cluster_names = list(list_clusters_with_prefix(client, prefix))
+    teardowns = [ClusterTeardown(name) for name in cluster_names]
+    # the first quiet poll doubles this to POLL_DELAY
+    delay = POLL_DELAY / 2
+    with ThreadPoolExecutor(workers) as executor:
+
+        def start(teardown):
+            try:
+                teardown.node_groups = delete_node_groups(client, teardown.name, prefix)
+            except ClientError as error:
+                teardown.phase = FAILED
+                teardown.error = str(error)
+
+        list(executor.map(start, teardowns))
+        while True:
+            waiting = [teardown for teardown in teardowns if not teardown.done]
+            changed = any(list(executor.map(lambda teardown: advance(client, teardown), waiting)))
+            elapsed = clock() - started
+            for teardown in teardowns:
+                status = teardown.status()
+                if status != teardown.reported:
+                    teardown.reported = status
+                    print(f"{teardown.name}: {status} after {elapsed:0.0f}s")
+            if all(teardown.done for teardown in teardowns):
+                break
+            delay = POLL_DELAY if changed else min(delay * 2, MAX_POLL_DELAY)
+            if elapsed + delay > deadline:
+                for teardown in teardowns:
+                    if not teardown.done:
+                        print(f"{teardown.name}: timed out {teardown.status()}")
+                        teardown.phase = TIMED_OUT
+                break
+            sleep(delay)
+
+    failures = {
+        teardown.name: teardown.error or teardown.phase
+        for teardown in teardowns
+        if teardown.phase != DELETED
+    }
     print(
-        f"EKS clusters and associated node groups with prefix '{prefix}' have been deleted."
+        f"{len(teardowns) - len(failures)} of {len(teardowns)} EKS clusters with prefix "
+        f"'{prefix}' deleted in {clock() - started:0.0f} seconds"
     )
+    return failures
 
 
 if __name__ == "__main__":
-    delete_eks_clusters_with_prefix("dev-9")
+    parser = argparse.ArgumentParser(description="Delete EKS clusters named with a prefix")
+    parser.add_argument("--prefix", required=True, help="e.g. dev-9")
+    args = parser.parse_args()
+    raise SystemExit(1 if delete_eks_clusters_with_prefix(args.prefix) else 0)
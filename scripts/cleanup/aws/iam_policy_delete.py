@@ -1,55 +1,186 @@
+import argparse
+import collections
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError, HTTPClientError
+from botocore.exceptions import ConnectionError as BotoConnectionError
+from scripts.common.retries import backoff_delay, error_code
 
+# policies deleted at the same time. IAM allows only a handful of write
+# requests a second per account, more workers only get throttled.
+WORKERS = 4
 
-def delete_iam_policies_with_prefix(prefix):
-    client = boto3.client("iam")
+# IAM throttles early and recovers slowly, retries start at half a second
+MAX_RETRIES = 10
+BASE_DELAY = 0.5
+MAX_DELAY = 30.0
+THROTTLING_ERRORS = {"Throttling", "ThrottlingException", "RequestLimitExceeded"}
+# errors of IAM itself or of the connection to it, the request is sent
+# again after a backoff without holding back the other workers
+TRANSIENT_ERRORS = {"ServiceFailure", "ServiceUnavailable", "InternalFailure", "InternalError"}
+CONNECTION_ERRORS = (BotoConnectionError, HTTPClientError)
 
-    # Use paginator to get all policies
-    paginator = client.get_paginator("list_policies")
-    for page in paginator.paginate(Scope="Local"):
-        policies = page["Policies"]
 
-        # Iterate through policies to find matches
-        for policy in policies:
-            policy_name = policy["PolicyName"]
-            policy_arn = policy["Arn"]
-            if policy_name.startswith(prefix):
-                print(f"Deleting policy: {policy_name} with ARN: {policy_arn}")
-                # Detach policy from all entities before deleting
-                detach_policy_from_entities(client, policy_arn)
-                # Delete all non-default policy versions
-                delete_policy_versions(client, policy_arn)
-                # Finally delete the policy
-                client.delete_policy(PolicyArn=policy_arn)
+def new_client(workers=WORKERS):
+    # botocore's own retries are turned off, IamApi retries instead so that
+    # every request is counted and throttling slows down every worker.
+    # It retries server and connection errors too, as botocore would.
+    return boto3.client(
+        "iam",
+        config=Config(max_pool_connections=workers, retries={"total_max_attempts": 1}),
+    )
 
 
-def detach_policy_from_entities(client, policy_arn):
-    # Detach policy from all users
-    for user in client.list_entities_for_policy(PolicyArn=policy_arn)["PolicyUsers"]:
-        client.detach_user_policy(UserName=user["UserName"], PolicyArn=policy_arn)
+class IamApi:
+    # every IAM request goes through call, which counts it by operation and
+    # retries it with backoff while IAM throttles or fails transiently. A
+    # throttled request also holds back every other worker until its
+    # backoff is over, the limit is per account so they would only be
+    # throttled too.
+    def __init__(
+        self, client, max_retries=MAX_RETRIES, sleep=time.sleep, clock=time.monotonic
+    ):
+        self.client = client
+        self.max_retries = max_retries
+        self.sleep = sleep
+        self.clock = clock
+        self.calls = collections.Counter()
+        self.throttled = 0
+        # requests sent again after a server or connection error
+        self.retried = 0
+        self._resume_at = 0.0
+        self._lock = threading.Lock()
 
-    # Detach policy from all roles
-    for role in client.list_entities_for_policy(PolicyArn=policy_arn)["PolicyRoles"]:
-        client.detach_role_policy(RoleName=role["RoleName"], PolicyArn=policy_arn)
+    def _wait_for_throttling(self):
+        while True:
+            with self._lock:
+                delay = self._resume_at - self.clock()
+            if delay <= 0:
+                return
+            self.sleep(delay)
 
-    # Detach policy from all groups
-    for group in client.list_entities_for_policy(PolicyArn=policy_arn)["PolicyGroups"]:
-        client.detach_group_policy(GroupName=group["GroupName"], PolicyArn=policy_arn)
+    def call(self, operation, **kwargs):
+        failed = False
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_throttling()
+            with self._lock:
+                self.calls[operation] += 1
+            try:
+                return getattr(self.client, operation)(**kwargs)
+            except CONNECTION_ERRORS + (ClientError,) as error:
+                code = error_code(error)
+                # a delete that failed on the way back may have gone through
+                if failed and code == "NoSuchEntity" and operation.startswith(("delete", "detach")):
+                    return {}
+                throttled = code in THROTTLING_ERRORS
+                transient = code in TRANSIENT_ERRORS or isinstance(error, CONNECTION_ERRORS)
+                if not (throttled or transient) or attempt == self.max_retries:
+                    raise
+                delay = backoff_delay(attempt, BASE_DELAY, MAX_DELAY)
+                if transient:
+                    failed = True
+                    with self._lock:
+                        self.retried += 1
+                    self.sleep(delay)
+                    continue
+                with self._lock:
+                    self.throttled += 1
+                    self._resume_at = max(self._resume_at, self.clock() + delay)
 
+    def pages(self, operation, **kwargs):
+        # the pages of a list operation, following IsTruncated and Marker
+        while True:
+            page = self.call(operation, **kwargs)
+            yield page
+            if not page.get("IsTruncated"):
+                return
+            kwargs["Marker"] = page["Marker"]
 
-def delete_policy_versions(client, policy_arn):
-    versions = client.list_policy_versions(PolicyArn=policy_arn)["Versions"]
+    def summary(self):
+        calls = ", ".join(f"{name} {count}" for name, count in sorted(self.calls.items()))
+        return (
+            f"{sum(self.calls.values())} IAM API calls ({calls}), {self.throttled} throttled, "
+            f"{self.retried} retried after errors"
+        )
 
+
+def list_policies_with_prefix(api, prefix):
+    for page in api.pages("list_policies", Scope="Local"):
+        for policy in page["Policies"]:
+            if policy["PolicyName"].startswith(prefix):
+                yield policy
+
+
+def detach_policy_from_entities(api, policy_arn):
+    # one listing returns the users, roles and groups the policy is on. It
+    # is read in full first, detaching while paging could skip entities.
+    pages = list(api.pages("list_entities_for_policy", PolicyArn=policy_arn))
+    for page in pages:
+        for user in page["PolicyUsers"]:
+            api.call("detach_user_policy", UserName=user["UserName"], PolicyArn=policy_arn)
+        for role in page["PolicyRoles"]:
+            api.call("detach_role_policy", RoleName=role["RoleName"], PolicyArn=policy_arn)
+        for group in page["PolicyGroups"]:
+            api.call("detach_group_policy", GroupName=group["GroupName"], PolicyArn=policy_arn)
+
+
+def delete_policy_versions(api, policy_arn):
     # Delete all non-default versions
-    for version in versions:
-        if not version["IsDefaultVersion"]:
-            print(
-                f"Deleting policy version: {version['VersionId']} for policy: {policy_arn}"
-            )
-            client.delete_policy_version(
-                PolicyArn=policy_arn, VersionId=version["VersionId"]
-            )
+    pages = list(api.pages("list_policy_versions", PolicyArn=policy_arn))
+    for page in pages:
+        for version in page["Versions"]:
+            if not version["IsDefaultVersion"]:
+                print(f"Deleting policy version: {version['VersionId']} for policy: {policy_arn}")
+                api.call(
+                    "delete_policy_version", PolicyArn=policy_arn, VersionId=version["VersionId"]
+                )
+
+
+def delete_policy(api, policy):
+    print(f"Deleting policy: {policy['PolicyName']} with ARN: {policy['Arn']}")
+    # Detach policy from all entities before deleting
+    detach_policy_from_entities(api, policy["Arn"])
+    delete_policy_versions(api, policy["Arn"])
+    api.call("delete_policy", PolicyArn=policy["Arn"])
+
+
+def delete_iam_policies_with_prefix(
+    prefix,
+    workers=WORKERS,
+    client_factory=new_client,
+    sleep=time.sleep,
+    clock=time.monotonic,
+    policies=None,
+):
+    # delete every customer managed policy named with prefix, or only
+    # policies when they were listed already, workers policies at a time.
+    # A policy that cannot be deleted is reported and the others carry on.
+    # Returns policy name -> error of the policies left.
+    api = IamApi(client_factory(workers), sleep=sleep, clock=clock)
+    if policies is None:
+        # listed in full before deleting, like the entities of each policy
+        policies = list(list_policies_with_prefix(api, prefix))
+    failures = {}
+    with ThreadPoolExecutor(workers) as executor:
+        futures = {
+            executor.submit(delete_policy, api, policy): policy["PolicyName"]
+            for policy in policies
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except CONNECTION_ERRORS + (ClientError,) as error:
+                print(f"Deleting policy {futures[future]} failed: {error}")
+                failures[futures[future]] = str(error)
+    print(f"{len(futures) - len(failures)} of {len(futures)} policies deleted, {api.summary()}")
+    return failures
 
 
 if __name__ == "__main__":
-    delete_iam_policies_with_prefix("dev-9")
+    parser = argparse.ArgumentParser(description="Delete IAM policies named with a prefix")
+    parser.add_argument("--prefix", required=True, help="e.g. dev-9")
+    args = parser.parse_args()
+    raise SystemExit(1 if delete_iam_policies_with_prefix(args.prefix) else 0)
@@ -1,31 +1,224 @@
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import islice
 import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from scripts.common.retries import backoff_delay, error_code
 
+# delete_objects accepts at most 1000 keys per request
+DELETE_BATCH_SIZE = 1000
+# buckets emptied at the same time
+BUCKET_WORKERS = 4
+# delete_objects requests in flight across every bucket
+DELETE_WORKERS = 16
+# batches listed ahead of the deletes per deleting thread, this bounds
+# memory however many versions a bucket holds
+BATCHES_AHEAD = 2
 
-def delete_all_objects(bucket_name):
-    s3 = boto3.resource("s3")
-    bucket = s3.Bucket(bucket_name)
-    bucket.object_versions.delete()
-    bucket.objects.delete()
+MAX_RETRIES = 8
+BASE_DELAY = 0.1
+MAX_DELAY = 10.0
+# key errors worth sending again, s3 is shedding load rather than refusing
+RETRYABLE_ERRORS = {"SlowDown", "InternalError", "ServiceUnavailable", "RequestTimeout"}
 
+# seconds between progress lines
+PROGRESS_INTERVAL = 10.0
 
-def delete_bucket(bucket_name):
-    s3 = boto3.client("s3")
+
+def new_client(workers=BUCKET_WORKERS + DELETE_WORKERS):
+    # one client is shared by every thread, its connection pool has to be
+    # as large as the number of requests in flight
+    return boto3.client(
+        "s3",
+        config=Config(max_pool_connections=workers, retries={"mode": "adaptive"}),
+    )
+
+
+class Progress:
+    # objects deleted across every bucket, printed as objects/s every
+    # `interval` seconds by whichever thread deletes past it
+    def __init__(self, interval=PROGRESS_INTERVAL, clock=time.monotonic):
+        self.interval = interval
+        self.clock = clock
+        self.deleted = 0
+        self.failed = 0
+        self.started = clock()
+        self._reported = self.started
+        self._lock = threading.Lock()
+
+    def add(self, deleted, failed=0):
+        with self._lock:
+            self.deleted += deleted
+            self.failed += failed
+            now = self.clock()
+            if now - self._reported < self.interval:
+                return
+            self._reported = now
+        print(self.summary())
+
+    def rate(self):
+        elapsed = self.clock() - self.started
+        return self.deleted / elapsed if elapsed > 0 else 0.0
+
+    def summary(self):
+        return (
+            f"{self.deleted} objects deleted, {self.rate():0.0f} objects/s, "
+            f"{self.failed} failed"
+        )
+
+
+def list_buckets_with_prefix(client, prefix):
+    paginator = client.get_paginator("list_buckets")
+    for page in paginator.paginate(Prefix=prefix):
+        for bucket in page.get("Buckets", []):
+            if bucket["Name"].startswith(prefix):
+                yield bucket["Name"]
+
+
+def iter_object_versions(client, bucket_name):
+    # every version and delete marker of the bucket. Buckets that were never
+    # versioned list their objects with the version id "null", which
+    # delete_objects accepts, so one listing covers both kinds of bucket.
+    paginator = client.get_paginator("list_object_versions")
+    for page in paginator.paginate(Bucket=bucket_name, MaxKeys=DELETE_BATCH_SIZE):
+        for version in page.get("Versions", []) + page.get("DeleteMarkers", []):
+            yield {"Key": version["Key"], "VersionId": version["VersionId"]}
+
+
+def iter_batches(objects, batch_size=DELETE_BATCH_SIZE):
+    objects = iter(objects)
+    batch = list(islice(objects, batch_size))
+    while batch:
+        yield batch
+        batch = list(islice(objects, batch_size))
+
+
+def delete_batch(client, bucket_name, objects, sleep=time.sleep, max_retries=MAX_RETRIES):
+    # delete up to 1000 versions in one request. Keys s3 was too busy to
+    # delete are sent again with backoff. Returns (deleted, errors), the
+    # errors being the key errors of the versions left behind.
+    deleted = 0
+    failed = []
+    for attempt in range(max_retries + 1):
+        try:
+            response = client.delete_objects(
+                Bucket=bucket_name, Delete={"Objects": objects, "Quiet": True}
+            )
+        except ClientError as error:
+            if error_code(error) not in RETRYABLE_ERRORS or attempt == max_retries:
+                raise
+            sleep(backoff_delay(attempt, BASE_DELAY, MAX_DELAY))
+            continue
+        errors = response.get("Errors", [])
+        deleted += len(objects) - len(errors)
+        retry = [error for error in errors if error.get("Code") in RETRYABLE_ERRORS]
+        failed.extend(error for error in errors if error.get("Code") not in RETRYABLE_ERRORS)
+        if not retry:
+            break
+        if attempt == max_retries:
+            failed.extend(retry)
+            break
+        objects = [{"Key": error["Key"], "VersionId": error["VersionId"]} for error in retry]
+        sleep(backoff_delay(attempt, BASE_DELAY, MAX_DELAY))
+    return deleted, failed
+
+
+def empty_bucket(
+    client, bucket_name, executor, progress, in_flight=DELETE_WORKERS * BATCHES_AHEAD
+):
+    # list the bucket's versions and hand them to executor in full batches,
+    # never more than in_flight batches at once. Returns the key errors of
+    # versions that could not be deleted.
+    errors = []
+    pending = set()
+
+    def collect(future):
+        deleted, failed = future.result()
+        progress.add(deleted, len(failed))
+        errors.extend(failed)
+
+    for batch in iter_batches(iter_object_versions(client, bucket_name)):
+        pending.add(executor.submit(delete_batch, client, bucket_name, batch))
+        if len(pending) >= in_flight:
+            future = next(as_completed(pending))
+            pending.discard(future)
+            collect(future)
+    for future in as_completed(pending):
+        collect(future)
+    return errors
+
+
+def delete_all_objects(bucket_name, client=None, workers=DELETE_WORKERS):
+    client = client or new_client(workers)
+    progress = Progress()
+    with ThreadPoolExecutor(workers) as executor:
+        errors = empty_bucket(client, bucket_name, executor, progress, workers * BATCHES_AHEAD)
+    print(progress.summary())
+    return errors
+
+
+def delete_bucket(bucket_name, client=None):
+    s3 = client or boto3.client("s3")
     s3.delete_bucket(Bucket=bucket_name)
 
 
-def delete_buckets_with_prefix(prefix):
-    s3 = boto3.client("s3")
-    response = s3.list_buckets()
+def delete_buckets_with_prefix(
+    prefix,
+    bucket_workers=BUCKET_WORKERS,
+    delete_workers=DELETE_WORKERS,
+    client_factory=new_client,
+    progress=None,
+    bucket_names=None,
+):
+    # empty and delete every bucket whose name starts with prefix, or only
+    # bucket_names when they were listed already, bucket_workers buckets at
+    # a time sharing delete_workers deleting threads. A bucket left with
+    # versions is kept and reported, the others carry on. Returns bucket
+    # name -> key errors of the buckets kept.
+    client = client_factory(bucket_workers + delete_workers)
+    if bucket_names is None:
+        bucket_names = list(list_buckets_with_prefix(client, prefix))
+    progress = progress or Progress()
+    failures = {}
+
+    def teardown(bucket_name):
+        print(f"Deleting all objects from bucket: {bucket_name}")
+        errors = empty_bucket(
+            client, bucket_name, deleter, progress, delete_workers * BATCHES_AHEAD
+        )
+        if errors:
+            print(f"Keeping bucket {bucket_name}, {len(errors)} versions could not be deleted")
+            return errors
+        print(f"Deleting bucket: {bucket_name}")
+        delete_bucket(bucket_name, client)
+        print(f"Bucket {bucket_name} deleted successfully")
+        return []
 
-    for bucket in response["Buckets"]:
-        bucket_name = bucket["Name"]
-        if bucket_name.startswith(prefix):
-            print(f"Deleting all objects from bucket: {bucket_name}")
-            delete_all_objects(bucket_name)
-            print(f"Deleting bucket: {bucket_name}")
-            delete_bucket(bucket_name)
-            print(f"Bucket {bucket_name} deleted successfully")
+    with ThreadPoolExecutor(delete_workers) as deleter, ThreadPoolExecutor(
+        bucket_workers
+    ) as buckets:
+        futures = {
+            buckets.submit(teardown, bucket_name): bucket_name
+            for bucket_name in bucket_names
+        }
+        for future in as_completed(futures):
+            bucket_name = futures[future]
+            try:
+                errors = future.result()
+            except ClientError as error:
+                print(f"Deleting bucket {bucket_name} failed: {error}")
+                errors = [{"Code": error_code(error), "Message": str(error)}]
+            if errors:
+                failures[bucket_name] = errors
+    print(f"{len(futures) - len(failures)} of {len(futures)} buckets deleted, {progress.summary()}")
+    return failures
 
 
 if __name__ == "__main__":
-    delete_buckets_with_prefix("dev-9")
+    parser = argparse.ArgumentParser(description="Empty and delete S3 buckets named with a prefix")
+    parser.add_argument("--prefix", required=True, help="e.g. dev-9")
+    args = parser.parse_args()
+    raise SystemExit(1 if delete_buckets_with_prefix(args.prefix) else 0)
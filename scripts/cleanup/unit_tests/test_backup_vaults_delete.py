@@ -0,0 +1,210 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from scripts.cleanup.aws.backup_vaults_delete import (
+    delete_recovery_point,
+    delete_vaults_with_prefix,
+    list_vaults_with_prefix,
+    wait_and_delete_vault,
+)
+
+
+def client_error(code, operation):
+    return ClientError({"Error": {"Code": code, "Message": code}}, operation)
+
+
+class FakePaginator:
+    def __init__(self, operation):
+        self.operation = operation
+
+    def paginate(self, **kwargs):
+        token = 0
+        while token is not None:
+            page, token = self.operation(token, **kwargs)
+            yield page
+
+
+class FakeBackupClient:
+    # recovery points are deleted in the background like in aws backup:
+    # a deleted point shows as DELETING for `linger` more listings, points
+    # in `late` are missing from the first listing of their vault
+    def __init__(self, vaults, page_size=3, linger=2):
+        self.vaults = {name: {arn: "COMPLETED" for arn in arns} for name, arns in vaults.items()}
+        self.page_size = page_size
+        self.linger = linger
+        self.lock = threading.Lock()
+        self.listings = {}
+        self.deleting = {}
+        self.deleted_vaults = []
+        self.delete_calls = 0
+        self.throttles = 0
+        self.refused = set()
+        self.late = set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def get_paginator(self, name):
+        return FakePaginator(getattr(self, f"_{name}_page"))
+
+    def _list_backup_vaults_page(self, token):
+        names = sorted(self.vaults)
+        end = token + self.page_size
+        page = {"BackupVaultList": [{"BackupVaultName": name} for name in names[token:end]]}
+        return page, end if end < len(names) else None
+
+    def _list_recovery_points_by_backup_vault_page(self, token, BackupVaultName):
+        with self.lock:
+            points = self.vaults[BackupVaultName]
+            if token == 0:
+                self.listings[BackupVaultName] = self.listings.get(BackupVaultName, 0) + 1
+                # deletes move on once per full listing
+                for arn in [arn for arn, status in points.items() if status == "DELETING"]:
+                    self.deleting[arn] -= 1
+                    if self.deleting[arn] < 0:
+                        del points[arn]
+            arns = sorted(points)
+            if self.listings[BackupVaultName] == 1:
+                arns = [arn for arn in arns if arn not in self.late]
+            end = token + self.page_size
+            page = {
+                "RecoveryPoints": [
+                    {"RecoveryPointArn": arn, "Status": points[arn]} for arn in arns[token:end]
+                ]
+            }
+        return page, end if end < len(arns) else None
+
+    def delete_recovery_point(self, BackupVaultName, RecoveryPointArn):
+        with self.lock:
+            self.delete_calls += 1
+            if self.throttles:
+                self.throttles -= 1
+                raise client_error("ThrottlingException", "DeleteRecoveryPoint")
+            if RecoveryPointArn in self.refused:
+                raise client_error("InvalidRequestException", "DeleteRecoveryPoint")
+            points = self.vaults[BackupVaultName]
+            if RecoveryPointArn not in points:
+                raise client_error("ResourceNotFoundException", "DeleteRecoveryPoint")
+            points[RecoveryPointArn] = "DELETING"
+            self.deleting[RecoveryPointArn] = self.linger
+
+    def delete_backup_vault(self, BackupVaultName):
+        with self.lock:
+            if self.vaults[BackupVaultName]:
+                raise client_error("InvalidRequestException", "DeleteBackupVault")
+            del self.vaults[BackupVaultName]
+            self.deleted_vaults.append(BackupVaultName)
+
+
+class FakeClock:
+    # sleeping moves the clock on instead of waiting
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        with self.lock:
+            self.sleeps.append(seconds)
+            self.now += seconds
+
+
+def points(vault, count):
+    return [f"arn:aws:backup:{vault}:{i:04d}" for i in range(count)]
+
+
+def test_vaults_are_listed_a_page_at_a_time():
+    client = FakeBackupClient({name: [] for name in ["dev-9-a", "dev-9-b", "dev-90", "main"]})
+    assert list(list_vaults_with_prefix(client, "dev-9")) == ["dev-9-a", "dev-9-b", "dev-90"]
+
+
+def test_every_recovery_point_and_vault_is_deleted():
+    vaults = {name: points(name, 50) for name in ["dev-9-a", "dev-9-b", "dev-9-c", "main"]}
+    client = FakeBackupClient(vaults)
+    clock = FakeClock()
+
+    failures = delete_vaults_with_prefix(
+        "dev-9",
+        vault_workers=3,
+        delete_workers=4,
+        client_factory=lambda workers: client,
+        sleep=clock.sleep,
+        clock=clock,
+    )
+
+    assert failures == {}
+    assert sorted(client.deleted_vaults) == ["dev-9-a", "dev-9-b", "dev-9-c"]
+    assert list(client.vaults) == ["main"]
+    assert client.delete_calls == 150
+
+
+def test_vaults_are_polled_with_backoff_until_empty():
+    client = FakeBackupClient({"dev-9": points("dev-9", 2)}, linger=3)
+    for arn in points("dev-9", 2):
+        client.delete_recovery_point(BackupVaultName="dev-9", RecoveryPointArn=arn)
+    clock = FakeClock()
+
+    with ThreadPoolExecutor(1) as executor:
+        deleted, reason = wait_and_delete_vault(
+            client, "dev-9", executor, sleep=clock.sleep, clock=clock
+        )
+    assert (deleted, reason) == (0, None)
+    assert clock.sleeps == [1.0, 2.0, 4.0]
+    assert client.deleted_vaults == ["dev-9"]
+
+
+def test_vaults_that_never_empty_time_out():
+    client = FakeBackupClient({"dev-9": points("dev-9", 1)}, linger=1000)
+    client.delete_recovery_point(BackupVaultName="dev-9", RecoveryPointArn=points("dev-9", 1)[0])
+    clock = FakeClock()
+
+    with ThreadPoolExecutor(1) as executor:
+        _, reason = wait_and_delete_vault(
+            client, "dev-9", executor, timeout=60, sleep=clock.sleep, clock=clock
+        )
+    assert reason == "recovery points still present after the timeout"
+    assert clock.sleeps == [1.0, 2.0, 4.0, 8.0, 16.0]
+    assert "dev-9" in client.vaults
+
+
+def test_recovery_points_missed_by_the_first_listing_are_deleted():
+    client = FakeBackupClient({"dev-9": points("dev-9", 10)})
+    client.late.add(points("dev-9", 10)[4])
+    clock = FakeClock()
+
+    failures = delete_vaults_with_prefix(
+        "dev-9", client_factory=lambda workers: client, sleep=clock.sleep, clock=clock
+    )
+
+    assert failures == {}
+    assert client.deleted_vaults == ["dev-9"]
+    assert client.delete_calls == 10
+
+
+def test_throttled_deletes_are_retried():
+    client = FakeBackupClient({"dev-9": points("dev-9", 1)})
+    client.throttles = 2
+    arn = points("dev-9", 1)[0]
+    assert delete_recovery_point(client, "dev-9", arn, sleep=lambda delay: None) is None
+    assert client.delete_calls == 3
+    # deleting it again finds it gone, which is just as good
+    client.vaults["dev-9"].clear()
+    assert delete_recovery_point(client, "dev-9", arn, sleep=lambda delay: None) is None
+
+
+def test_refused_recovery_points_keep_their_vault():
+    client = FakeBackupClient({"dev-9-a": points("a", 3), "dev-9-b": points("b", 3)})
+    client.refused.add(points("a", 3)[1])
+    clock = FakeClock()
+
+    failures = delete_vaults_with_prefix(
+        "dev-9", client_factory=lambda workers: client, sleep=clock.sleep, clock=clock
+    )
+
+    assert list(failures) == ["dev-9-a"]
+    assert "InvalidRequestException" in failures["dev-9-a"]
+    assert client.deleted_vaults == ["dev-9-b"]
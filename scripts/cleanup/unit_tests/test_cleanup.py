@@ -0,0 +1,141 @@
+import threading
+
+import pytest
+
+from scripts.cleanup.aws.cleanup import (
+    DELETED,
+    FAILED,
+    NOTHING,
+    SKIPPED,
+    Cleanup,
+    build_cleanups,
+    estimate_duration,
+    print_plan,
+    run_cleanup,
+    run_cleanups,
+    take_inventory,
+    waves,
+)
+
+
+def cleanup(name, depends_on=(), items=(), seconds=0, deleted=None):
+    def delete(prefix, items):
+        if deleted is not None:
+            deleted.append((name, prefix, list(items)))
+        return {}
+
+    return Cleanup(
+        name,
+        lambda prefix: [f"{prefix}-{item}" for item in items],
+        delete,
+        lambda items: seconds if items else 0,
+        depends_on=depends_on,
+    )
+
+
+def test_inventory_is_taken_for_every_kind_at_once():
+    # the listings can only all finish if they run at the same time
+    barrier = threading.Barrier(3, timeout=5)
+
+    def listing(name):
+        def inventory(prefix):
+            barrier.wait()
+            return [f"{prefix}-{name}"]
+
+        return Cleanup(name, inventory, None, None)
+
+    inventory = take_inventory([listing("s3"), listing("eks"), listing("iam")], "dev-9")
+    assert inventory == {"s3": ["dev-9-s3"], "eks": ["dev-9-eks"], "iam": ["dev-9-iam"]}
+
+
+def test_the_estimate_is_the_longest_chain_of_dependencies():
+    cleanups = [
+        cleanup("eks", items=["a"], seconds=1200),
+        cleanup("iam", ["eks"], items=["a"], seconds=60),
+        cleanup("logs", ["eks"], items=["a"], seconds=30),
+        cleanup("s3", items=["a"], seconds=600),
+        cleanup("backup", items=[], seconds=600),
+    ]
+    inventory = take_inventory(cleanups, "dev-9")
+    total, finishes = estimate_duration(cleanups, inventory)
+    assert total == 1260
+    assert finishes == {"eks": 1200, "iam": 1260, "logs": 1230, "s3": 600, "backup": 0}
+    assert waves(range(9), 4, 60) == 180
+
+
+def test_dry_run_plan_lists_everything_that_would_be_deleted(capsys):
+    cleanups = [
+        cleanup("eks", items=["cluster"], seconds=1200),
+        cleanup("iam", ["eks"], items=["policy-a", "policy-b"], seconds=120),
+    ]
+    assert print_plan(cleanups, take_inventory(cleanups, "dev-9"), "dev-9") == 1320
+    assert capsys.readouterr().out == (
+        "Cleanup plan for prefix 'dev-9':\n"
+        "  eks: 1 to delete, done after about 20 minutes\n"
+        "    dev-9-cluster\n"
+        "  iam: 2 to delete, after eks, done after about 22 minutes\n"
+        "    dev-9-policy-a\n"
+        "    dev-9-policy-b\n"
+        "Estimated duration: about 22 minutes\n"
+    )
+
+
+def test_cleanups_run_after_their_dependencies_and_alongside_the_rest():
+    # eks and s3 can only both finish if they run at the same time
+    barrier = threading.Barrier(2, timeout=5)
+    order = []
+
+    def run(cleanup, prefix, items):
+        if cleanup.name in ("eks", "s3"):
+            barrier.wait()
+        order.append(cleanup.name)
+        return DELETED
+
+    cleanups = [cleanup("iam", ["eks"]), cleanup("eks"), cleanup("s3")]
+    outcomes = run_cleanups(cleanups, {"iam": [], "eks": [], "s3": []}, "dev-9", run)
+    assert {name: outcome for name, (outcome, _) in outcomes.items()} == {
+        "eks": DELETED,
+        "s3": DELETED,
+        "iam": DELETED,
+    }
+    assert order.index("eks") < order.index("iam")
+
+
+def test_a_failed_cleanup_skips_its_dependents_only():
+    def run(cleanup, prefix, items):
+        if cleanup.name == "eks":
+            raise RuntimeError("cluster still has node groups")
+        return DELETED
+
+    cleanups = [cleanup("eks"), cleanup("iam", ["eks"]), cleanup("s3")]
+    outcomes = run_cleanups(cleanups, {"eks": [], "iam": [], "s3": []}, "dev-9", run)
+    assert {name: outcome for name, (outcome, _) in outcomes.items()} == {
+        "eks": FAILED,
+        "iam": SKIPPED,
+        "s3": DELETED,
+    }
+
+
+def test_only_the_inventory_is_deleted():
+    deleted = []
+    policies = cleanup("iam", items=["a", "b"], deleted=deleted)
+    assert run_cleanup(policies, "dev-9", ["dev-9-a"]) == DELETED
+    assert run_cleanup(policies, "dev-9", []) == NOTHING
+    assert deleted == [("iam", "dev-9", ["dev-9-a"])]
+
+    refused = Cleanup("s3", None, lambda prefix, items: {"dev-9-a": "AccessDenied"}, None)
+    assert run_cleanup(refused, "dev-9", ["dev-9-a"]) == FAILED
+
+
+def test_dependency_problems_are_rejected():
+    with pytest.raises(ValueError):
+        run_cleanups([cleanup("iam", ["eks"])], {"iam": []}, "dev-9")
+    with pytest.raises(ValueError):
+        estimate_duration([cleanup("a", ["b"]), cleanup("b", ["a"])], {"a": [], "b": []})
+
+
+def test_eks_is_cleaned_up_before_iam_and_logs():
+    cleanups = {cleanup.name: cleanup for cleanup in build_cleanups()}
+    assert set(cleanups) == {"eks", "iam", "logs", "s3", "backup"}
+    assert cleanups["iam"].depends_on == ("eks",)
+    assert cleanups["logs"].depends_on == ("eks",)
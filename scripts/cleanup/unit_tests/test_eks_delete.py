@@ -0,0 +1,211 @@
+import threading
+
+from botocore.exceptions import ClientError
+
+from scripts.cleanup.aws.eks_delete import (
+    DELETED,
+    TIMED_OUT,
+    delete_eks_clusters_with_prefix,
+    list_clusters_with_prefix,
+)
+
+
+def client_error(code, operation):
+    return ClientError({"Error": {"Code": code, "Message": code}}, operation)
+
+
+class FakeClock:
+    # sleeping moves the clock on instead of waiting
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakePaginator:
+    def __init__(self, operation):
+        self.operation = operation
+
+    def paginate(self, **kwargs):
+        token = 0
+        while token is not None:
+            page, token = self.operation(token, **kwargs)
+            yield page
+
+
+class FakeEKSClient:
+    # clusters and node groups that take a while to delete on the fake
+    # clock, like eks. A cluster refuses to be deleted while it still has
+    # node groups. The first `failing` deletes of a node group end in
+    # DELETE_FAILED instead.
+    def __init__(self, clock, clusters, node_group_seconds=300, cluster_seconds=600):
+        self.clock = clock
+        # cluster -> node group -> time its delete finishes, None while it runs
+        self.clusters = {name: dict.fromkeys(groups) for name, groups in clusters.items()}
+        self.cluster_deletes = {}
+        self.node_group_seconds = node_group_seconds
+        self.cluster_seconds = cluster_seconds
+        # node group -> seconds its delete takes, if not node_group_seconds
+        self.slow_node_groups = {}
+        self.failing = {}
+        self.delete_failed = set()
+        self.page_size = 2
+        self.lock = threading.Lock()
+        self.calls = []
+
+    def _expire(self):
+        now = self.clock()
+        for groups in self.clusters.values():
+            for group, finish in list(groups.items()):
+                if finish is not None and finish <= now:
+                    if self.failing.get(group):
+                        self.failing[group] -= 1
+                        self.delete_failed.add(group)
+                        groups[group] = None
+                    else:
+                        del groups[group]
+        for name in [n for n, finish in self.cluster_deletes.items() if finish <= now]:
+            self.clusters.pop(name, None)
+
+    def get_paginator(self, name):
+        return FakePaginator(getattr(self, f"_{name}_page"))
+
+    def _page(self, key, names, token):
+        end = token + self.page_size
+        return {key: names[token:end]}, end if end < len(names) else None
+
+    def _list_clusters_page(self, token):
+        with self.lock:
+            self._expire()
+            return self._page("clusters", sorted(self.clusters), token)
+
+    def _list_nodegroups_page(self, token, clusterName):
+        with self.lock:
+            self._expire()
+            return self._page("nodegroups", sorted(self.clusters[clusterName]), token)
+
+    def delete_nodegroup(self, clusterName, nodegroupName):
+        with self.lock:
+            self.calls.append(("delete_nodegroup", nodegroupName, self.clock()))
+            groups = self.clusters[clusterName]
+            if groups[nodegroupName] is not None:
+                raise client_error("ResourceInUseException", "DeleteNodegroup")
+            self.delete_failed.discard(nodegroupName)
+            seconds = self.slow_node_groups.get(nodegroupName, self.node_group_seconds)
+            groups[nodegroupName] = self.clock() + seconds
+
+    def describe_nodegroup(self, clusterName, nodegroupName):
+        with self.lock:
+            self._expire()
+            groups = self.clusters[clusterName]
+            if nodegroupName not in groups:
+                raise client_error("ResourceNotFoundException", "DescribeNodegroup")
+            if nodegroupName in self.delete_failed:
+                issue = {"code": "Ec2SecurityGroupDeletionFailure", "message": "in use"}
+                return {"nodegroup": {"status": "DELETE_FAILED", "health": {"issues": [issue]}}}
+            status = "ACTIVE" if groups[nodegroupName] is None else "DELETING"
+            return {"nodegroup": {"status": status, "health": {"issues": []}}}
+
+    def delete_cluster(self, name):
+        with self.lock:
+            self._expire()
+            self.calls.append(("delete_cluster", name, self.clock()))
+            if self.clusters[name]:
+                raise client_error("ResourceInUseException", "DeleteCluster")
+            self.cluster_deletes.setdefault(name, self.clock() + self.cluster_seconds)
+
+    def describe_cluster(self, name):
+        with self.lock:
+            self._expire()
+            if name not in self.clusters:
+                raise client_error("ResourceNotFoundException", "DescribeCluster")
+            return {"cluster": {"name": name}}
+
+
+def clusters(*names, groups=2):
+    return {name: [f"{name}-ng-{i}" for i in range(groups)] for name in names}
+
+
+def test_clusters_are_listed_a_page_at_a_time():
+    client = FakeEKSClient(FakeClock(), clusters("dev-9-a", "dev-9-b", "dev-9-c", "main"))
+    assert list(list_clusters_with_prefix(client, "dev-9")) == ["dev-9-a", "dev-9-b", "dev-9-c"]
+
+
+def test_clusters_are_torn_down_together():
+    clock = FakeClock()
+    client = FakeEKSClient(clock, clusters("dev-9-a", "dev-9-b", "dev-9-c", "main"))
+
+    failures = delete_eks_clusters_with_prefix(
+        "dev-9", client_factory=lambda workers: client, sleep=clock.sleep, clock=clock
+    )
+
+    assert failures == {}
+    assert list(client.clusters) == ["main"]
+    # every node group is deleted at once, before any waiting
+    node_group_deletes = [call for call in client.calls if call[0] == "delete_nodegroup"]
+    assert len(node_group_deletes) == 6
+    assert {call[2] for call in node_group_deletes} == {0.0}
+    # one node group wait and one cluster wait, plus at most a poll each,
+    # instead of a wait per node group and cluster one after the other
+    assert clock.now <= 300 + 600 + 2 * 30
+    assert max(clock.sleeps) <= 30
+
+
+def test_a_cluster_is_deleted_as_soon_as_its_own_node_groups_are_gone():
+    clock = FakeClock()
+    client = FakeEKSClient(clock, clusters("dev-9-a", "dev-9-b"))
+    client.clusters["dev-9-b"]["dev-9-b-slow"] = None
+    client.slow_node_groups["dev-9-b-slow"] = 1300
+
+    failures = delete_eks_clusters_with_prefix(
+        "dev-9", client_factory=lambda workers: client, sleep=clock.sleep, clock=clock
+    )
+
+    assert failures == {}
+    started = {call[1]: call[2] for call in client.calls if call[0] == "delete_cluster"}
+    assert 300 <= started["dev-9-a"] <= 330
+    assert started["dev-9-b"] >= 1300
+
+
+def test_clusters_left_at_the_deadline_are_reported(capsys):
+    clock = FakeClock()
+    client = FakeEKSClient(clock, clusters("dev-9-a"), node_group_seconds=10000)
+
+    failures = delete_eks_clusters_with_prefix(
+        "dev-9",
+        deadline=600,
+        client_factory=lambda workers: client,
+        sleep=clock.sleep,
+        clock=clock,
+    )
+
+    assert failures == {"dev-9-a": TIMED_OUT}
+    assert clock.now <= 600
+    output = capsys.readouterr().out
+    assert "dev-9-a: waiting on node groups dev-9-a-ng-0, dev-9-a-ng-1 after 0s" in output
+    assert "dev-9-a: timed out waiting on node groups" in output
+    assert DELETED not in failures.values()
+
+
+def test_failed_node_group_deletes_are_retried_then_reported():
+    clock = FakeClock()
+    client = FakeEKSClient(clock, clusters("dev-9-a", "dev-9-b"))
+    client.failing["dev-9-a-ng-0"] = 1
+    client.failing["dev-9-b-ng-1"] = 10
+
+    failures = delete_eks_clusters_with_prefix(
+        "dev-9", client_factory=lambda workers: client, sleep=clock.sleep, clock=clock
+    )
+
+    assert list(failures) == ["dev-9-b"]
+    assert failures["dev-9-b"] == "node group dev-9-b-ng-1 failed to delete 3 times: in use"
+    deletes = [call[1] for call in client.calls if call[0] == "delete_nodegroup"]
+    assert deletes.count("dev-9-a-ng-0") == 2
+    assert deletes.count("dev-9-b-ng-1") == 3
+    assert "dev-9-a" not in client.clusters
@@ -0,0 +1,221 @@
+import threading
+
+from botocore.exceptions import ClientError, ConnectionClosedError, EndpointConnectionError
+
+from scripts.cleanup.aws.iam_policy_delete import (
+    IamApi,
+    delete_iam_policies_with_prefix,
+    delete_policy,
+)
+
+
+def client_error(code, operation):
+    return ClientError({"Error": {"Code": code, "Message": code}}, operation)
+
+
+class FakeClock:
+    # sleeping moves the clock on instead of waiting
+    def __init__(self):
+        self.now = 0.0
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        with self.lock:
+            self.now += seconds
+
+
+class FakeIamClient:
+    # customer managed policies attached to users, roles and groups, listed
+    # a page at a time with Marker like IAM. `throttles` requests are
+    # refused with Throttling before any succeeds.
+    def __init__(self, policies, page_size=2):
+        self.policies = policies
+        self.page_size = page_size
+        self.throttles = 0
+        self.lock = threading.Lock()
+        self.deleted = []
+        self.detached = []
+
+    def _throttle(self, operation):
+        with self.lock:
+            if self.throttles:
+                self.throttles -= 1
+                raise client_error("Throttling", operation)
+
+    def _page(self, items, Marker=None, **fields):
+        start = int(Marker or 0)
+        end = start + self.page_size
+        page = {name: [item for item in items[start:end] if item[0] == name] for name in fields}
+        page = {name: [item[1] for item in values] for name, values in page.items()}
+        if end < len(items):
+            page.update(IsTruncated=True, Marker=str(end))
+        return page
+
+    def list_policies(self, Scope, Marker=None):
+        assert Scope == "Local"
+        self._throttle("ListPolicies")
+        items = [
+            ("Policies", {"PolicyName": name, "Arn": f"arn:aws:iam::1:policy/{name}"})
+            for name in sorted(self.policies)
+        ]
+        return self._page(items, Marker, Policies=True)
+
+    def list_entities_for_policy(self, PolicyArn, Marker=None):
+        self._throttle("ListEntitiesForPolicy")
+        policy = self.policies[PolicyArn.rsplit("/", 1)[1]]
+        items = [
+            (f"Policy{kind}s", {f"{kind}Name": name})
+            for kind in ("User", "Role", "Group")
+            for name in policy[kind]
+        ]
+        return self._page(items, Marker, PolicyUsers=True, PolicyRoles=True, PolicyGroups=True)
+
+    def list_policy_versions(self, PolicyArn, Marker=None):
+        self._throttle("ListPolicyVersions")
+        versions = self.policies[PolicyArn.rsplit("/", 1)[1]]["Versions"]
+        items = [
+            ("Versions", {"VersionId": version, "IsDefaultVersion": version == "v1"})
+            for version in versions
+        ]
+        return self._page(items, Marker, Versions=True)
+
+    def _detach(self, kind, name, PolicyArn):
+        self._throttle(f"Detach{kind}Policy")
+        with self.lock:
+            self.policies[PolicyArn.rsplit("/", 1)[1]][kind].remove(name)
+            self.detached.append(name)
+
+    def detach_user_policy(self, UserName, PolicyArn):
+        self._detach("User", UserName, PolicyArn)
+
+    def detach_role_policy(self, RoleName, PolicyArn):
+        self._detach("Role", RoleName, PolicyArn)
+
+    def detach_group_policy(self, GroupName, PolicyArn):
+        self._detach("Group", GroupName, PolicyArn)
+
+    def delete_policy_version(self, PolicyArn, VersionId):
+        self._throttle("DeletePolicyVersion")
+        with self.lock:
+            self.policies[PolicyArn.rsplit("/", 1)[1]]["Versions"].remove(VersionId)
+
+    def delete_policy(self, PolicyArn):
+        self._throttle("DeletePolicy")
+        name = PolicyArn.rsplit("/", 1)[1]
+        with self.lock:
+            policy = self.policies[name]
+            if policy["User"] or policy["Role"] or policy["Group"] or len(policy["Versions"]) > 1:
+                raise client_error("DeleteConflict", "DeletePolicy")
+            del self.policies[name]
+            self.deleted.append(name)
+
+
+def policy(users=(), roles=(), groups=(), versions=("v1",)):
+    return {
+        "User": list(users),
+        "Role": list(roles),
+        "Group": list(groups),
+        "Versions": list(versions),
+    }
+
+
+def test_policies_are_detached_and_deleted_with_one_entity_listing_each():
+    client = FakeIamClient(
+        {
+            "dev-9-a": policy(users=["alice"], roles=["lambda", "ecs"], groups=["admins"]),
+            "dev-9-b": policy(roles=["lambda"], versions=["v1", "v2", "v3"]),
+            "dev-9-c": policy(),
+            "main-a": policy(roles=["lambda"]),
+        }
+    )
+    clock = FakeClock()
+
+    failures = delete_iam_policies_with_prefix(
+        "dev-9", client_factory=lambda workers: client, sleep=clock.sleep, clock=clock
+    )
+
+    assert failures == {}
+    assert sorted(client.deleted) == ["dev-9-a", "dev-9-b", "dev-9-c"]
+    assert list(client.policies) == ["main-a"]
+    assert sorted(client.detached) == ["admins", "alice", "ecs", "lambda", "lambda"]
+
+
+def test_api_calls_are_counted():
+    client = FakeIamClient({"dev-9-a": policy(users=["alice"], roles=["lambda", "ecs"])})
+    api = IamApi(client)
+    delete_policy(api, {"PolicyName": "dev-9-a", "Arn": "arn:aws:iam::1:policy/dev-9-a"})
+
+    # two pages of entities instead of three listings, one per kind
+    assert api.calls == {
+        "list_entities_for_policy": 2,
+        "detach_user_policy": 1,
+        "detach_role_policy": 2,
+        "list_policy_versions": 1,
+        "delete_policy": 1,
+    }
+    assert api.summary().startswith("7 IAM API calls (delete_policy 1, detach_role_policy 2")
+
+
+def test_throttled_calls_are_retried_and_hold_back_other_workers():
+    client = FakeIamClient({"dev-9-a": policy()})
+    client.throttles = 3
+    clock = FakeClock()
+    api = IamApi(client, sleep=clock.sleep, clock=clock)
+
+    (page,) = api.pages("list_policies", Scope="Local")
+    assert page["Policies"][0]["PolicyName"] == "dev-9-a"
+    assert api.throttled == 3
+    assert api.calls["list_policies"] == 4
+    assert clock.now > 0
+
+
+def test_server_and_connection_errors_are_retried():
+    client = FakeIamClient({"dev-9-a": policy(), "dev-9-b": policy()})
+    errors = [
+        client_error("ServiceFailure", "DeletePolicy"),
+        EndpointConnectionError(endpoint_url="https://iam.amazonaws.com"),
+    ]
+    delete = client.delete_policy
+
+    def flaky_delete(PolicyArn):
+        if errors:
+            raise errors.pop(0)
+        if PolicyArn.rsplit("/", 1)[1] not in client.policies:
+            raise client_error("NoSuchEntity", "DeletePolicy")
+        delete(PolicyArn)
+        if PolicyArn.endswith("dev-9-b"):
+            # deleted, but the response never arrives
+            raise ConnectionClosedError(endpoint_url="https://iam.amazonaws.com")
+
+    client.delete_policy = flaky_delete
+    clock = FakeClock()
+    api = IamApi(client, sleep=clock.sleep, clock=clock)
+    for name in ["dev-9-a", "dev-9-b"]:
+        delete_policy(api, {"PolicyName": name, "Arn": f"arn:aws:iam::1:policy/{name}"})
+
+    assert client.deleted == ["dev-9-a", "dev-9-b"]
+    assert (api.retried, api.throttled) == (3, 0)
+    assert api.calls["delete_policy"] == 5
+
+
+def test_policies_that_cannot_be_deleted_are_reported():
+    client = FakeIamClient({"dev-9-a": policy(), "dev-9-b": policy()})
+
+    def refuse(PolicyArn):
+        raise client_error("AccessDenied", "DeletePolicy")
+
+    clock = FakeClock()
+    delete_policy = client.delete_policy
+    client.delete_policy = lambda PolicyArn: (
+        refuse(PolicyArn) if PolicyArn.endswith("dev-9-a") else delete_policy(PolicyArn)
+    )
+
+    failures = delete_iam_policies_with_prefix(
+        "dev-9", client_factory=lambda workers: client, sleep=clock.sleep, clock=clock
+    )
+
+    assert list(failures) == ["dev-9-a"]
+    assert client.deleted == ["dev-9-b"]
@@ -0,0 +1,194 @@
+import collections
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from scripts.cleanup.aws.s3_bucket_delete import (
+    Progress,
+    delete_batch,
+    delete_buckets_with_prefix,
+    list_buckets_with_prefix,
+)
+
+
+class FakePaginator:
+    def __init__(self, operation):
+        self.operation = operation
+
+    def paginate(self, **kwargs):
+        token = None
+        while True:
+            page, token = self.operation(token, **kwargs)
+            yield page
+            if token is None:
+                return
+
+
+class FakeS3Client:
+    # a local stand-in for s3: buckets of versions and delete markers,
+    # listed a page at a time, with delete_objects refusing keys on demand
+    def __init__(self, buckets, page_size=2, delay=0.0):
+        self.buckets = {
+            name: sorted(versions, key=lambda v: (v["Key"], v["VersionId"]))
+            for name, versions in buckets.items()
+        }
+        self.page_size = page_size
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.batch_sizes = []
+        self.deleted_buckets = []
+        self.list_bucket_pages = 0
+        # key -> error codes returned for it, one per delete attempt
+        self.key_errors = {}
+        # delete_objects calls and buckets being deleted from at once
+        self.in_flight = 0
+        self.max_in_flight = 0
+        # bucket -> delete_objects calls in flight on it
+        self.buckets_in_flight = collections.Counter()
+        self.max_buckets_in_flight = 0
+
+    def get_paginator(self, name):
+        return FakePaginator(getattr(self, f"_{name}_page"))
+
+    def _list_buckets_page(self, token, Prefix=""):
+        with self.lock:
+            self.list_bucket_pages += 1
+            names = sorted(name for name in self.buckets if name.startswith(Prefix))
+        start = token or 0
+        end = start + self.page_size
+        page = {"Buckets": [{"Name": name} for name in names[start:end]]}
+        return page, end if end < len(names) else None
+
+    def _list_object_versions_page(self, token, Bucket, MaxKeys=1000):
+        # like s3, a page starts after the last key and version listed, so
+        # versions deleted meanwhile do not shift the listing
+        with self.lock:
+            after = [
+                v
+                for v in self.buckets[Bucket]
+                if token is None or (v["Key"], v["VersionId"]) > token
+            ]
+        versions = after[:MaxKeys]
+        page = {
+            "Versions": [v for v in versions if not v.get("DeleteMarker")],
+            "DeleteMarkers": [v for v in versions if v.get("DeleteMarker")],
+        }
+        last = versions[-1] if versions else None
+        return page, (last["Key"], last["VersionId"]) if len(after) > MaxKeys else None
+
+    def delete_objects(self, Bucket, Delete):
+        assert Delete["Quiet"] is True
+        assert len(Delete["Objects"]) <= 1000
+        with self.lock:
+            self.batch_sizes.append(len(Delete["Objects"]))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            self.buckets_in_flight[Bucket] += 1
+            self.max_buckets_in_flight = max(
+                self.max_buckets_in_flight, len(self.buckets_in_flight)
+            )
+        time.sleep(self.delay)
+        errors = []
+        with self.lock:
+            for target in Delete["Objects"]:
+                codes = self.key_errors.get(target["Key"])
+                if codes:
+                    errors.append(dict(target, Code=codes.pop(0), Message="refused"))
+                    continue
+                self.buckets[Bucket] = [
+                    v
+                    for v in self.buckets[Bucket]
+                    if (v["Key"], v["VersionId"]) != (target["Key"], target["VersionId"])
+                ]
+            self.in_flight -= 1
+            self.buckets_in_flight[Bucket] -= 1
+            if not self.buckets_in_flight[Bucket]:
+                del self.buckets_in_flight[Bucket]
+        return {"Errors": errors} if errors else {}
+
+    def delete_bucket(self, Bucket):
+        with self.lock:
+            if self.buckets[Bucket]:
+                raise ClientError({"Error": {"Code": "BucketNotEmpty"}}, "DeleteBucket")
+            del self.buckets[Bucket]
+            self.deleted_buckets.append(Bucket)
+
+
+def versions(count, prefix="logs"):
+    # objects with two versions each, every tenth hidden by a delete marker
+    listing = []
+    for i in range(count):
+        key = f"{prefix}/{i:06d}.json"
+        listing.append({"Key": key, "VersionId": f"{i}-1"})
+        listing.append({"Key": key, "VersionId": f"{i}-2"})
+        if i % 10 == 0:
+            listing.append({"Key": key, "VersionId": f"{i}-3", "DeleteMarker": True})
+    return listing
+
+
+def test_buckets_are_listed_a_page_at_a_time():
+    client = FakeS3Client({f"dev-9-{i}": [] for i in range(5)} | {"prod-logs": []})
+    assert list(list_buckets_with_prefix(client, "dev-9")) == [f"dev-9-{i}" for i in range(5)]
+    assert client.list_bucket_pages == 3
+
+
+def test_buckets_are_emptied_in_parallel_with_full_batches():
+    buckets = {f"dev-9-{i}": versions(1200, f"bucket{i}") for i in range(3)}
+    buckets["prod-logs"] = versions(5)
+    client = FakeS3Client(buckets, delay=0.02)
+    progress = Progress()
+
+    failures = delete_buckets_with_prefix(
+        "dev-9", bucket_workers=3, delete_workers=4, client_factory=lambda workers: client,
+        progress=progress,
+    )
+
+    assert failures == {}
+    assert sorted(client.deleted_buckets) == ["dev-9-0", "dev-9-1", "dev-9-2"]
+    assert list(client.buckets) == ["prod-logs"]
+    # 2520 versions and markers per bucket, sent as 1000 + 1000 + 520
+    assert sorted(client.batch_sizes) == [520] * 3 + [1000] * 6
+    assert progress.deleted == 3 * 2520
+    assert client.max_in_flight > 1
+    assert client.max_buckets_in_flight > 1
+
+
+def test_busy_keys_are_retried_and_refused_keys_keep_the_bucket():
+    buckets = {"dev-9-busy": versions(3, "busy"), "dev-9-locked": versions(3, "locked")}
+    client = FakeS3Client(buckets)
+    client.key_errors["busy/000001.json"] = ["SlowDown", "InternalError"]
+    client.key_errors["locked/000002.json"] = ["AccessDenied"]
+
+    deleted, errors = delete_batch(
+        client, "dev-9-busy", list(buckets["dev-9-busy"]), sleep=lambda delay: None
+    )
+    assert deleted == 7 and errors == []
+    assert client.buckets["dev-9-busy"] == []
+
+    failures = delete_buckets_with_prefix(
+        "dev-9-locked", bucket_workers=1, delete_workers=1, client_factory=lambda workers: client
+    )
+    assert [error["Code"] for error in failures["dev-9-locked"]] == ["AccessDenied"]
+    assert "dev-9-locked" in client.buckets
+
+
+def test_retries_give_up_after_max_retries():
+    client = FakeS3Client({"dev-9": versions(1)})
+    client.key_errors["logs/000000.json"] = ["SlowDown"] * 10
+    deleted, errors = delete_batch(
+        client, "dev-9", list(client.buckets["dev-9"]), sleep=lambda delay: None, max_retries=2
+    )
+    assert deleted == 0
+    assert [error["Code"] for error in errors] == ["SlowDown"] * 3
+
+
+def test_progress_reports_objects_per_second(capsys):
+    now = [100.0]
+    progress = Progress(interval=5, clock=lambda: now[0])
+    now[0] += 2
+    progress.add(1000)
+    assert capsys.readouterr().out == ""
+    now[0] += 3
+    progress.add(1500, failed=2)
+    assert capsys.readouterr().out == "2500 objects deleted, 500 objects/s, 2 failed\n"
@@ -0,0 +1,72 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# outcomes of a task that did not finish
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+def dependency_order(tasks, kind="task"):
+    # the tasks in an order that runs every one after its dependencies.
+    # Tasks have a name and the names of the tasks they depend_on.
+    by_name = {task.name: task for task in tasks}
+    ordered = []
+    visiting = set()
+
+    def visit(task):
+        if task in ordered:
+            return
+        if task.name in visiting:
+            raise ValueError(f"{kind.capitalize()}s depend on each other through {task.name}")
+        visiting.add(task.name)
+        for dependency in task.depends_on:
+            if dependency not in by_name:
+                raise ValueError(f"{task.name} depends on unknown {kind} {dependency}")
+            visit(by_name[dependency])
+        visiting.discard(task.name)
+        ordered.append(task)
+
+    for task in tasks:
+        visit(task)
+    return ordered
+
+
+def run_graph(tasks, run, max_workers=None, kind="task"):
+    # run(task) every task as soon as the tasks it depends on have
+    # finished, independent ones in parallel. A task raising counts as
+    # FAILED, and a FAILED or SKIPPED task skips its dependents without
+    # stopping the others. Returns name -> (outcome, seconds).
+    dependency_order(tasks, kind)
+    outcomes = {}
+    lock = threading.Lock()
+
+    def timed(task):
+        started = time.perf_counter()
+        try:
+            outcome = run(task)
+        except Exception as error:
+            print(f"{kind.capitalize()} {task.name} failed: {error!r}")
+            outcome = FAILED
+        with lock:
+            outcomes[task.name] = (outcome, time.perf_counter() - started)
+
+    waiting = list(tasks)
+    running = {}
+    with ThreadPoolExecutor(max_workers or len(tasks) or 1) as executor:
+        while waiting or running:
+            for task in list(waiting):
+                states = [outcomes.get(dependency) for dependency in task.depends_on]
+                if any(state and state[0] in (FAILED, SKIPPED) for state in states):
+                    print(f"Skipping {task.name}, a {kind} it depends on did not finish")
+                    outcomes[task.name] = (SKIPPED, 0.0)
+                    waiting.remove(task)
+                elif all(states):
+                    running[executor.submit(timed, task)] = task
+                    waiting.remove(task)
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                del running[future]
+    return outcomes
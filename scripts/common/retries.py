@@ -0,0 +1,15 @@
+import random
+from botocore.exceptions import ClientError
+
+
+def error_code(error):
+    # the aws error code of a ClientError, None for any other error
+    if isinstance(error, ClientError):
+        return error.response.get("Error", {}).get("Code")
+    return None
+
+
+def backoff_delay(attempt, base_delay, max_delay):
+    # exponential backoff with full jitter, so retrying workers do not all
+    # come back at the same moment
+    return random.uniform(0, min(max_delay, base_delay * 2**attempt))
@@ -0,0 +1,57 @@
+import gc
+import tracemalloc
+from scripts.pipeline.benchmarks.benchmark_converters import postcode_rows
+from scripts.pipeline.nonprod_population_load.nonprod_population_load import (
+    SCHEMA as POPULATION_SCHEMA,
+)
+from scripts.pipeline.nonprod_postcode_load.nonprod_postcode_load import (
+    SCHEMA as POSTCODE_SCHEMA,
+)
+
+# Compares the memory held per row by items in dynamodb json with the
+# compact records the loaders now pass down the pipeline, for synthetic
+# postcode and population rows. Values shared with the csv rows are not
+# counted, what is left is the cost of the item around them.
+#
+# Usage:
+#   $ python -m scripts.pipeline.benchmarks.benchmark_record_memory
+
+ROWS = 50000
+
+
+def population_rows(count):
+    return [
+        [str(9000000000 + i), "", "A81001", "MR", f"Given{i}", "", f"Family{i}", "1960-01-01",
+         str(i % 2 + 1), "1 Road", "", "", "", "Town", f"AB{i % 99} {i % 9}CD", "", "", "",
+         "", "", "", "English", "false", "ADD", "true", "E01011949"]
+        for i in range(count)
+    ]
+
+
+def held_per_row(convert, rows):
+    # bytes of memory the converted items keep alive, per row
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    items = list(convert(rows))
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(items) == len(rows)
+    return (after - before) / len(rows)
+
+
+def compare(name, schema, rows):
+    as_json = held_per_row(schema.converter("Table"), rows)
+    as_records = held_per_row(schema.converter("Table", request="Record"), rows)
+    print(f"{name} dynamodb json: {as_json:,.0f} bytes per row")
+    print(f"{name} records:       {as_records:,.0f} bytes per row")
+    print(f"{name} saving:        {1 - as_records / as_json:.0%}")
+
+
+def main():
+    compare("postcode", POSTCODE_SCHEMA, postcode_rows(ROWS))
+    compare("population", POPULATION_SCHEMA, population_rows(ROWS))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,463 @@
+import queue
+import threading
+import time
+from itertools import islice
+import boto3
+from botocore.exceptions import ClientError
+from scripts.common.retries import backoff_delay, error_code
+from scripts.pipeline.common.metrics import METRICS
+from scripts.pipeline.common.rate_limiter import THROTTLING_CANCELLATIONS, is_throttling_error
+from scripts.pipeline.common.records import Record, to_transact_item
+
+# batch_write_item accepts at most 25 items per request
+BATCH_SIZE = 25
+# transact_write_items accepts at most 100 items per request
+TRANSACTION_SIZE = 100
+# number of chunks allowed to wait for the writer, this bounds
+# peak memory regardless of the size of the input
+QUEUE_DEPTH = 8
+
+# number of writer threads, each with its own client
+WORKERS = 1
+
+MAX_RETRIES = 8
+BASE_DELAY = 0.05
+MAX_DELAY = 5.0
+
+# errors caused by what is in the items rather than by the request,
+# resending the same items can never succeed
+ITEM_ERRORS = {"ValidationException", "TransactionCanceledException"}
+# cancellation reasons that do not point at a bad item. Items throttled
+# alongside a bad one are written again with the rest of the chunk.
+HARMLESS_CANCELLATIONS = {"None", "TransactionConflict"} | THROTTLING_CANCELLATIONS
+
+# the wait_for_queued_batches of the concurrent write a thread is feeding
+_FEEDING = threading.local()
+
+
+class WriteResult:
+    def __init__(self):
+        self.succeeded = 0
+        self.failed = 0
+        # write requests still unprocessed once the retries ran out
+        self.unprocessed = []
+        # (item, error) for every item dynamodb refused, counted in failed
+        self.rejected = []
+
+    @property
+    def complete(self):
+        # every item was written, apart from those refused for their content
+        return self.failed == len(self.rejected)
+
+    def merge(self, other):
+        self.succeeded += other.succeeded
+        self.failed += other.failed
+        self.unprocessed.extend(other.unprocessed)
+        self.rejected.extend(other.rejected)
+
+    def __repr__(self):
+        return (
+            f"WriteResult(succeeded={self.succeeded}, failed={self.failed}, "
+            f"rejected={len(self.rejected)})"
+        )
+
+
+def prefetch_chunks(items, chunk_size=BATCH_SIZE, queue_depth=QUEUE_DEPTH):
+    # consume items on a background thread and hand them over in chunks
+    # through a bounded queue, so reading and formatting rows overlaps
+    # with the writes made by the caller
+    chunks = queue.Queue(maxsize=queue_depth)
+    done = object()
+    stop = threading.Event()
+    errors = []
+
+    def put(value):
+        while not stop.is_set():
+            try:
+                chunks.put(value, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            iterator = iter(items)
+            chunk = list(islice(iterator, chunk_size))
+            while chunk and put(chunk):
+                chunk = list(islice(iterator, chunk_size))
+        except Exception as error:
+            errors.append(error)
+        finally:
+            put(done)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is done:
+                break
+            yield chunk
+    finally:
+        stop.set()
+        producer.join()
+    if errors:
+        raise errors[0]
+
+
+def to_write_request(item):
+    # convert a transact write item or a record into a batch write
+    # request, returning the table the request belongs to
+    if isinstance(item, Record):
+        return item.table_name, {"PutRequest": {"Item": item.attributes()}}
+    if "Put" in item:
+        put = item["Put"]
+        return put["TableName"], {"PutRequest": {"Item": put["Item"]}}
+    if "Delete" in item:
+        delete = item["Delete"]
+        return delete["TableName"], {"DeleteRequest": {"Key": delete["Key"]}}
+    raise ValueError(f"Unsupported write item: {list(item)}")
+
+
+def group_by_table(items):
+    request_items = {}
+    for item in items:
+        table_name, request = to_write_request(item)
+        request_items.setdefault(table_name, []).append(request)
+    return request_items
+
+
+def count_requests(request_items):
+    return sum(len(requests) for requests in request_items.values())
+
+
+def write_batch(
+    client,
+    items,
+    max_retries=MAX_RETRIES,
+    base_delay=BASE_DELAY,
+    max_delay=MAX_DELAY,
+    sleep=time.sleep,
+    rate_limiter=None,
+):
+    # send up to 25 items with batch_write_item, resubmitting
+    # UnprocessedItems and throttled requests until they are written
+    # or the retries run out
+    result = WriteResult()
+    request_items = group_by_table(items)
+    table_name = next(iter(request_items), "")
+    pending = count_requests(request_items)
+    attempt = 0
+    while pending:
+        if rate_limiter is not None:
+            rate_limiter.acquire(pending)
+        started = time.perf_counter()
+        try:
+            response = client.batch_write_item(
+                RequestItems=request_items, ReturnConsumedCapacity="TOTAL"
+            )
+        except Exception as error:
+            if not is_throttling_error(error) or attempt >= max_retries:
+                raise
+            METRICS.count("throttles", table=table_name)
+            METRICS.count("retries", table=table_name)
+            if rate_limiter is not None:
+                rate_limiter.on_throttle()
+            sleep(backoff_delay(attempt, base_delay, max_delay))
+            attempt += 1
+            continue
+        METRICS.observe("batch_write_item", time.perf_counter() - started, table_name)
+        METRICS.consumed(response)
+        request_items = response.get("UnprocessedItems") or {}
+        remaining = count_requests(request_items)
+        result.succeeded += pending - remaining
+        METRICS.count("items_written", pending - remaining, table_name)
+        pending = remaining
+        if rate_limiter is not None:
+            # unprocessed items are dynamodb's way of throttling a batch
+            if pending:
+                rate_limiter.on_throttle()
+            else:
+                rate_limiter.on_success()
+        if not pending:
+            break
+        METRICS.count("unprocessed_items", pending, table_name)
+        if attempt >= max_retries:
+            result.failed += pending
+            result.unprocessed.append(request_items)
+            break
+        METRICS.count("retries", table=table_name)
+        sleep(backoff_delay(attempt, base_delay, max_delay))
+        attempt += 1
+    return result
+
+
+def write_transaction(
+    client,
+    items,
+    max_retries=MAX_RETRIES,
+    base_delay=BASE_DELAY,
+    max_delay=MAX_DELAY,
+    sleep=time.sleep,
+    rate_limiter=None,
+):
+    # send up to 100 items with transact_write_items, retrying the
+    # whole transaction while it is being throttled
+    transact_items = [to_transact_item(item) for item in items]
+    table_name = to_write_request(transact_items[0])[0] if items else ""
+    attempt = 0
+    while True:
+        if rate_limiter is not None:
+            # transactional writes consume twice the capacity
+            rate_limiter.acquire(2 * len(items))
+        started = time.perf_counter()
+        try:
+            response = client.transact_write_items(
+                TransactItems=transact_items, ReturnConsumedCapacity="TOTAL"
+            )
+            break
+        except Exception as error:
+            if not is_throttling_error(error) or attempt >= max_retries:
+                raise
+            METRICS.count("throttles", table=table_name)
+            METRICS.count("retries", table=table_name)
+            if rate_limiter is not None:
+                rate_limiter.on_throttle()
+            sleep(backoff_delay(attempt, base_delay, max_delay))
+            attempt += 1
+    METRICS.observe("transact_write_items", time.perf_counter() - started, table_name)
+    METRICS.consumed(response or {})
+    METRICS.count("items_written", len(items), table_name)
+    if rate_limiter is not None:
+        rate_limiter.on_success()
+    result = WriteResult()
+    result.succeeded = len(items)
+    return result
+
+
+def describe_error(error):
+    if isinstance(error, ClientError):
+        details = error.response.get("Error", {})
+        return f"{details.get('Code')}: {details.get('Message', '')}"
+    return repr(error)
+
+
+def write_chunk(client, chunk, transactional=False, **retry_options):
+    # a chunk refused for the items in it is split up, so only the
+    # offending items are left out
+    try:
+        if transactional:
+            return write_transaction(client, chunk, **retry_options)
+        return write_batch(client, chunk, **retry_options)
+    except Exception as error:
+        if error_code(error) not in ITEM_ERRORS:
+            raise
+        return write_around(client, chunk, transactional, error, **retry_options)
+
+
+def write_around(client, chunk, transactional, error, **retry_options):
+    # write every item of a refused chunk except the offending ones,
+    # which are recorded in result.rejected with the error dynamodb gave.
+    # A cancelled transaction names its offending items, anything else is
+    # halved and each half written again, so a single bad item costs
+    # about 2 * log2(len(chunk)) extra requests.
+    result = WriteResult()
+    reasons = error.response.get("CancellationReasons") or []
+    if len(reasons) == len(chunk) > 1:
+        offending = [
+            index
+            for index, reason in enumerate(reasons)
+            if reason.get("Code") not in HARMLESS_CANCELLATIONS
+        ]
+        if offending:
+            METRICS.count("items_rejected", len(offending))
+            for index in offending:
+                reason = reasons[index]
+                result.failed += 1
+                result.rejected.append(
+                    (chunk[index], f"{reason.get('Code')}: {reason.get('Message', '')}")
+                )
+            rest = [item for index, item in enumerate(chunk) if index not in offending]
+            if rest:
+                result.merge(write_chunk(client, rest, transactional, **retry_options))
+            return result
+    if len(chunk) == 1:
+        METRICS.count("items_rejected")
+        result.failed += 1
+        result.rejected.append((chunk[0], describe_error(error)))
+        return result
+    middle = len(chunk) // 2
+    for half in (chunk[:middle], chunk[middle:]):
+        result.merge(write_chunk(client, half, transactional, **retry_options))
+    return result
+
+
+def serial_write(
+    client,
+    items,
+    transactional=False,
+    batch_size=None,
+    on_batch_written=None,
+    **retry_options,
+):
+    # on_batch_written(sequence, size) is called for every batch written
+    # in full, or with only refused items left out. Batches are numbered
+    # in the order they were read.
+    if batch_size is None:
+        batch_size = TRANSACTION_SIZE if transactional else BATCH_SIZE
+    result = WriteResult()
+    chunks = METRICS.timed("queue_wait", prefetch_chunks(items, batch_size))
+    for sequence, chunk in enumerate(chunks):
+        with METRICS.timer("write"):
+            chunk_result = write_chunk(client, chunk, transactional, **retry_options)
+        result.merge(chunk_result)
+        if on_batch_written is not None and chunk_result.complete:
+            on_batch_written(sequence, len(chunk))
+    return result
+
+
+def batch_write(client, items, batch_size=BATCH_SIZE, **options):
+    return serial_write(client, items, batch_size=batch_size, **options)
+
+
+def transact_write(client, items, batch_size=TRANSACTION_SIZE, **options):
+    # all or nothing per request, at twice the write capacity cost
+    return serial_write(
+        client, items, transactional=True, batch_size=batch_size, **options
+    )
+
+
+def new_client():
+    # sessions are not thread safe, so every worker creates its own
+    return boto3.session.Session().client("dynamodb")
+
+
+def wait_for_queued_batches():
+    # block the thread reading items for a concurrent write until every
+    # batch it has queued so far is written, for an item that has to land
+    # after an earlier write of its key. Concurrent workers can otherwise
+    # write batches out of order, any other writer already writes them in
+    # the order they were read.
+    wait = getattr(_FEEDING, "wait", None)
+    if wait is not None:
+        wait()
+
+
+def concurrent_write(
+    items,
+    workers=WORKERS,
+    transactional=False,
+    batch_size=None,
+    queue_depth=None,
+    client_factory=new_client,
+    on_batch_written=None,
+    **retry_options,
+):
+    # the calling thread reads and formats items into batches and puts them
+    # on a bounded queue, drained by a pool of writer threads. The first
+    # worker error stops the reader, the remaining batches are discarded
+    # and the error is raised once every worker has finished.
+    if batch_size is None:
+        batch_size = TRANSACTION_SIZE if transactional else BATCH_SIZE
+    batches = queue.Queue(maxsize=queue_depth or workers * 2)
+    done = object()
+    stop = threading.Event()
+    errors = []
+    results = [WriteResult() for _ in range(workers)]
+    # batches queued and not yet written or discarded
+    queued = [0]
+    written = threading.Condition()
+
+    def finished():
+        with written:
+            queued[0] -= 1
+            written.notify_all()
+
+    def wait_for_queued():
+        with written:
+            written.wait_for(lambda: not queued[0] or stop.is_set())
+
+    def work(index):
+        try:
+            client = client_factory()
+        except Exception as error:
+            errors.append(error)
+            stop.set()
+            client = None
+        while True:
+            with METRICS.timer("queue_wait"):
+                batch = batches.get()
+            if batch is done:
+                break
+            try:
+                if stop.is_set():
+                    continue
+                sequence, chunk = batch
+                with METRICS.timer("write"):
+                    chunk_result = write_chunk(client, chunk, transactional, **retry_options)
+                results[index].merge(chunk_result)
+                if on_batch_written is not None and chunk_result.complete:
+                    on_batch_written(sequence, len(chunk))
+            except Exception as error:
+                errors.append(error)
+                stop.set()
+            finally:
+                finished()
+
+    def put(value):
+        with written:
+            queued[0] += 1
+        while not stop.is_set():
+            try:
+                batches.put(value, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    threads = [
+        threading.Thread(target=work, args=(index,), daemon=True)
+        for index in range(workers)
+    ]
+    for thread in threads:
+        thread.start()
+    feeding = getattr(_FEEDING, "wait", None)
+    _FEEDING.wait = wait_for_queued
+    try:
+        iterator = iter(items)
+        sequence = 0
+        chunk = list(islice(iterator, batch_size))
+        while chunk and put((sequence, chunk)):
+            sequence += 1
+            chunk = list(islice(iterator, batch_size))
+    except Exception as error:
+        errors.append(error)
+        stop.set()
+    finally:
+        _FEEDING.wait = feeding
+        # workers keep draining after a failure, so these never block for long
+        for _ in threads:
+            batches.put(done)
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+
+    result = WriteResult()
+    for worker_result in results:
+        result.merge(worker_result)
+    return result
+
+
+def write_items(items, transactional=False, client=None, workers=WORKERS, **options):
+    # write a stream of transact style items ({"Put": {...}}) to dynamodb,
+    # with batch_write_item unless the transactional path is requested.
+    # More than one worker writes batches concurrently, one client each.
+    if workers > 1:
+        return concurrent_write(
+            items, workers=workers, transactional=transactional, **options
+        )
+    if client is None:
+        client = boto3.client("dynamodb")
+    return serial_write(client, items, transactional=transactional, **options)
@@ -0,0 +1,159 @@
+import collections
+import functools
+import json
+import os
+import threading
+import time
+from itertools import islice
+from scripts.pipeline.common.metrics import METRICS
+from scripts.pipeline.common.parallel import format_in_parallel, format_with_offsets
+from scripts.pipeline.common.source import file_hash, split_source
+
+# how often the journal is rewritten while batches are being committed
+SAVE_INTERVAL = 1.0
+
+
+class CheckpointJournal:
+    # records how far a load has got through its source file, so a rerun
+    # can skip every row that is already in the table. Batches complete
+    # out of order when several workers write, the journal only moves
+    # forward once every earlier batch has been committed as well. A
+    # journal written for another table, or environment as the table
+    # names carry it, is ignored.
+    def __init__(
+        self, path, source_hash, table_name=None, save_interval=SAVE_INTERVAL, clock=time.monotonic
+    ):
+        self.path = path
+        self.source_hash = source_hash
+        self.table_name = table_name
+        self.row_offset = 0
+        self.batch_sequence = 0
+        self._save_interval = save_interval
+        self._clock = clock
+        self._saved = clock()
+        self._lock = threading.Lock()
+        # row offset following each item handed to the writer and not yet committed
+        self._item_offsets = collections.deque()
+        self._completed = {}
+        self._next_sequence = 0
+        self._load()
+
+    @classmethod
+    def for_source(cls, file_path, table_name, **options):
+        # the journal lives next to the file it tracks, one per table the
+        # file is loaded into. For a zip member it is keyed by the member
+        # but hashes the whole archive.
+        archive_path, _ = split_source(file_path)
+        return cls(
+            f"{file_path}.{table_name}.checkpoint.json",
+            file_hash(archive_path),
+            table_name,
+            **options,
+        )
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r") as file:
+            journal = json.load(file)
+        # a changed source file or another table invalidates the journal
+        if journal.get("source_hash") != self.source_hash:
+            return
+        if journal.get("table_name") != self.table_name:
+            return
+        self.row_offset = journal["row_offset"]
+        self.batch_sequence = journal["batch_sequence"]
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        journal = {
+            "source_hash": self.source_hash,
+            "table_name": self.table_name,
+            "row_offset": self.row_offset,
+            "batch_sequence": self.batch_sequence,
+        }
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(journal, file)
+        os.replace(temporary_path, self.path)
+        self._saved = self._clock()
+
+    def skip(self, rows):
+        # skip the rows committed by an earlier run
+        return islice(rows, self.row_offset, None)
+
+    def track(self, formatted):
+        # formatted yields (row_offset, item) pairs, where row_offset is
+        # the number of source rows consumed once the item was produced
+        for row_offset, item in formatted:
+            self._item_offsets.append(row_offset)
+            yield item
+
+    def commit(self, sequence, size):
+        # used as the writer's on_batch_written callback
+        with self._lock:
+            self._completed[sequence] = size
+            while self._next_sequence in self._completed:
+                size = self._completed.pop(self._next_sequence)
+                for _ in range(size):
+                    self.row_offset = self._item_offsets.popleft()
+                self._next_sequence += 1
+                self.batch_sequence += 1
+            if self._clock() - self._saved >= self._save_interval:
+                self._save()
+
+    def complete(self):
+        # the whole file is loaded, a rerun should start from the beginning
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def checkpointed_load(
+    file_path,
+    table_name,
+    rows,
+    format_rows,
+    write,
+    resume=True,
+    executor=None,
+    validate=None,
+    **options,
+):
+    # write(items, **options) the rows of file_path formatted by
+    # format_rows, resuming from the journal of an earlier failed run into
+    # the same table.
+    # Rows are formatted in the executor's worker processes when one is given.
+    # validate(pairs) can drop (row_offset, item) pairs before they are written.
+    if executor is None:
+        formatter = format_with_offsets
+    else:
+        formatter = functools.partial(format_in_parallel, executor=executor)
+    if validate is None:
+        validate = iter
+    if not resume:
+        formatted = validate(METRICS.timed("format", formatter(rows, format_rows)))
+        return write((item for _, item in formatted), **options)
+    journal = CheckpointJournal.for_source(file_path, table_name)
+    if journal.row_offset:
+        print(
+            f"Resuming {file_path} from row {journal.row_offset}, "
+            f"batch {journal.batch_sequence}"
+        )
+    formatted = validate(
+        METRICS.timed(
+            "format", formatter(journal.skip(rows), format_rows, start=journal.row_offset)
+        )
+    )
+    try:
+        result = write(journal.track(formatted), on_batch_written=journal.commit, **options)
+    except BaseException:
+        journal.save()
+        raise
+    if not result.complete:
+        journal.save()
+    else:
+        journal.complete()
+    return result
@@ -0,0 +1,81 @@
+import argparse
+import boto3
+from scripts.pipeline.common.metrics import PROGRESS_INTERVAL
+from scripts.pipeline.common.rate_limiter import AdaptiveRateLimiter
+
+
+def build_parser(description):
+    # arguments shared by every seed loader
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "--transactional",
+        action="store_true",
+        help="write with transact_write_items instead of batch_write_item",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of concurrent writer threads, each with its own client",
+    )
+    parser.add_argument(
+        "--write-rate",
+        type=float,
+        help="starting write rate in items per second, adjusted up and down "
+        "by the adaptive rate limiter as dynamodb throttles",
+    )
+    parser.add_argument(
+        "--rate-from-table",
+        action="store_true",
+        help="start the adaptive rate limiter from the table's provisioned write capacity",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        help="write a metrics report when the load finishes, "
+        "prometheus text for a .prom file and json otherwise",
+    )
+    parser.add_argument(
+        "--progress-interval",
+        type=float,
+        default=PROGRESS_INTERVAL,
+        help="seconds between progress lines, 0 for none",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="DIR",
+        help="write a cpu profile, sampled collapsed stacks and an allocation "
+        "summary of the load to DIR",
+    )
+    return parser
+
+
+def add_checkpoint_arguments(parser):
+    parser.add_argument(
+        "--no-resume",
+        action="store_true",
+        help="ignore the checkpoint journal of an earlier run and load every row",
+    )
+    return parser
+
+
+def add_incremental_arguments(parser):
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only write the rows added, changed or removed since the last "
+        "incremental load, tracked in a manifest kept in SEED_MANIFEST_BUCKET "
+        "or next to the source file",
+    )
+    return parser
+
+
+def writer_options(args, table_name=None):
+    # map parsed arguments onto bulk_writer.write_items keyword arguments
+    options = {"transactional": args.transactional, "workers": args.workers}
+    if args.rate_from_table and table_name:
+        options["rate_limiter"] = AdaptiveRateLimiter.from_table(
+            boto3.client("dynamodb"), table_name
+        )
+    elif args.write_rate:
+        options["rate_limiter"] = AdaptiveRateLimiter(rate=args.write_rate)
+    return options
@@ -0,0 +1,254 @@
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+MAGIC = b"SEEDCOL2"
+CACHE_VERSION = 2
+# rows materialised at a time when reading a cache back
+CHUNK_SIZE = 10000
+# rows encoded in memory before their codes are written out, this bounds
+# the memory a cache build takes however large the source
+BLOCK_ROWS = 65536
+# a column with more distinct values than this share of its rows gains
+# little from a dictionary, later blocks store its values as they are
+DISTINCT_LIMIT = 0.5
+# dictionary entries are stored nul separated, csv values never contain one
+SEPARATOR = "\0"
+
+
+def _code_type(size):
+    # smallest unsigned array type able to hold `size` distinct codes
+    for typecode in "BHI":
+        if size <= 2 ** (8 * array(typecode).itemsize):
+            return typecode
+    raise ValueError(f"{size} distinct values are too many for a column")
+
+
+def _join(values):
+    joined = SEPARATOR.join(values)
+    if joined.count(SEPARATOR) != len(values) - 1:
+        raise ValueError("csv values containing nul characters cannot be cached")
+    return joined.encode("utf-8")
+
+
+class ColumnEncoder:
+    # encodes the rows of a csv file column by column into file, a block of
+    # block_rows rows at a time. Every value becomes an index into the
+    # distinct values of its column, until the column turns out to hold
+    # too many for that to pay, and its later blocks keep the values as
+    # they are. Only the current block and the dictionaries stay in memory.
+    def __init__(self, file, block_rows=BLOCK_ROWS):
+        self.file = file
+        self.block_rows = block_rows
+        self.dictionaries = []
+        # per column, whether it is still dictionary encoded
+        self.encoded = []
+        self.block = []
+        self.widths = array("H")
+        self.rows = 0
+        self.blocks = []
+
+    def add(self, row):
+        width = len(row)
+        while len(self.dictionaries) < width:
+            # rows before the first one this wide are padded with ""
+            self.dictionaries.append({"": 0})
+            self.encoded.append(True)
+            self.block.append(array("I", bytes(array("I").itemsize * len(self.widths))))
+        self.widths.append(width)
+        for dictionary, encoded, column, value in zip(
+            self.dictionaries, self.encoded, self.block, row
+        ):
+            column.append(dictionary.setdefault(value, len(dictionary)) if encoded else value)
+        for dictionary, encoded, column in zip(
+            self.dictionaries[width:], self.encoded[width:], self.block[width:]
+        ):
+            column.append(0 if encoded else "")
+        self.rows += 1
+        if len(self.widths) == self.block_rows:
+            self.flush()
+
+    def _write(self, data):
+        # [offset, length] of data written 8 byte aligned at the end of file
+        offset = self.file.tell()
+        self.file.write(data)
+        self.file.write(bytes(-len(data) % 8))
+        return [offset, len(data)]
+
+    def flush(self):
+        # write out the rows of the current block
+        if not self.widths:
+            return
+        columns = []
+        for position, column in enumerate(self.block):
+            if self.encoded[position]:
+                typecode = _code_type(len(self.dictionaries[position]))
+                data = array(typecode, column).tobytes()
+                columns.append(["codes", *self._write(data), typecode])
+                # dictionaries stop growing once they hold nearly a value a row
+                if len(self.dictionaries[position]) > self.rows * DISTINCT_LIMIT:
+                    self.encoded[position] = False
+            else:
+                columns.append(["values", *self._write(_join(column)), None])
+        widths = None
+        # widths are only needed when rows differ in length
+        if any(width != len(self.block) for width in self.widths):
+            widths = self._write(self.widths.tobytes())
+        self.blocks.append({"rows": len(self.widths), "columns": columns, "widths": widths})
+        self.block = [array("I") if encoded else [] for encoded in self.encoded]
+        self.widths = array("H")
+
+    def finish(self):
+        # flush the last block and write the dictionaries. Returns the
+        # metadata locating every section.
+        self.flush()
+        dictionaries = [self._write(_join(list(dictionary))) for dictionary in self.dictionaries]
+        return {"rows": self.rows, "blocks": self.blocks, "dictionaries": dictionaries}
+
+
+def write_cache(path, source_key, header, rows, block_rows=BLOCK_ROWS):
+    # write rows of a csv file to a columnar cache at path, tagged with
+    # the source_key of the data it was built from. The sections are
+    # streamed out as they are encoded, the metadata locating them follows
+    # and the file ends with its length.
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(MAGIC)
+        encoder = ColumnEncoder(file, block_rows)
+        for row in rows:
+            encoder.add(row)
+        metadata = {
+            "version": CACHE_VERSION,
+            "source": source_key,
+            "byteorder": sys.byteorder,
+            "header": header,
+            **encoder.finish(),
+        }
+        encoded = json.dumps(metadata).encode("utf-8")
+        file.write(encoded)
+        file.write(struct.pack("<Q", len(encoded)))
+    os.replace(temporary_path, path)
+
+
+class ColumnCache:
+    # a columnar cache memory mapped from disk. Codes are read in place
+    # through memoryviews, dictionaries are decoded when rows are read.
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # an empty file cannot be mapped
+            self._file.close()
+            raise
+        self.metadata = self._read_metadata()
+
+    def _read_metadata(self):
+        size = len(self._map)
+        if size < len(MAGIC) + 8 or self._map[: len(MAGIC)] != MAGIC:
+            return None
+        (length,) = struct.unpack("<Q", self._map[size - 8 :])
+        return json.loads(self._map[size - 8 - length : size - 8])
+
+    def valid_for(self, source_key):
+        return (
+            self.metadata is not None
+            and self.metadata["version"] == CACHE_VERSION
+            and self.metadata["byteorder"] == sys.byteorder
+            and self.metadata["source"] == source_key
+        )
+
+    @property
+    def header(self):
+        return self.metadata["header"]
+
+    def __len__(self):
+        return self.metadata["rows"]
+
+    def rows(self, start=0, chunk_size=CHUNK_SIZE):
+        # yield rows as lists of strings, decoding chunk_size rows at a time
+        view = memoryview(self._map)
+        dictionaries = []
+        for offset, length in self.metadata["dictionaries"]:
+            data = view[offset : offset + length]
+            dictionaries.append(str(data, "utf-8").split(SEPARATOR))
+            data.release()
+        block_start = 0
+        try:
+            for block in self.metadata["blocks"]:
+                block_end = block_start + block["rows"]
+                if block_end > start:
+                    yield from self._block_rows(
+                        view, dictionaries, block, max(start - block_start, 0), chunk_size
+                    )
+                block_start = block_end
+        finally:
+            view.release()
+
+    def _block_rows(self, view, dictionaries, block, start, chunk_size):
+        columns = []
+        widths = None
+        try:
+            for dictionary, (kind, offset, length, typecode) in zip(
+                dictionaries, block["columns"]
+            ):
+                data = view[offset : offset + length]
+                if kind == "codes":
+                    columns.append((dictionary, data.cast(typecode)))
+                else:
+                    columns.append((None, str(data, "utf-8").split(SEPARATOR)))
+                    data.release()
+            if block["widths"] is not None:
+                offset, length = block["widths"]
+                widths = view[offset : offset + length].cast("H")
+            for chunk_start in range(start, block["rows"], chunk_size):
+                chunk_end = min(chunk_start + chunk_size, block["rows"])
+                values = [
+                    column[chunk_start:chunk_end]
+                    if dictionary is None
+                    else list(map(dictionary.__getitem__, column[chunk_start:chunk_end]))
+                    for dictionary, column in columns
+                ]
+                if not values:
+                    # a block of empty rows has no columns to zip
+                    yield from ([] for _ in range(chunk_start, chunk_end))
+                elif widths is None:
+                    yield from map(list, zip(*values))
+                else:
+                    for width, row in zip(widths[chunk_start:chunk_end], zip(*values)):
+                        yield list(row[:width])
+        finally:
+            # memoryviews over the mapped file must go before it is closed
+            for dictionary, column in columns:
+                if dictionary is not None:
+                    column.release()
+            if widths is not None:
+                widths.release()
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_cache(path, source_key):
+    # the cache at path if it was built from source_key, otherwise None
+    if not os.path.exists(path):
+        return None
+    try:
+        cache = ColumnCache(path)
+    except (OSError, ValueError):
+        return None
+    if cache.valid_for(source_key):
+        return cache
+    cache.close()
+    return None
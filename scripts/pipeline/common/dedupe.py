@@ -0,0 +1,256 @@
+import collections
+import math
+import operator
+import os
+import sqlite3
+from scripts.pipeline.common.bulk_writer import wait_for_queued_batches
+from scripts.pipeline.common.metrics import METRICS
+from scripts.pipeline.common.records import Record
+
+# what happens to the second item with a key already seen
+KEEP_LAST = "last"
+KEEP_FIRST = "first"
+
+# keys remembered exactly, duplicates closer together than this are always
+# caught. Larger than a transaction, so no request ever holds a key twice.
+WINDOW = 1000
+# bytes an exact set takes per key, measured for single attribute keys.
+# Keys are held exactly whenever the expected items fit the memory budget,
+# only larger loads fall back to a bloom filter.
+BYTES_PER_KEY = 140
+FALSE_POSITIVE_RATE = 0.01
+# keys a SpilledKeys store buffers in memory before inserting them
+SPILL_BATCH = 10000
+
+
+def exact_memory_budget():
+    # a quarter of the machine's memory, the rest is left to the load
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 4
+    except (AttributeError, ValueError, OSError):
+        return 512 * 1024 * 1024
+
+
+class BloomFilter:
+    # a set of hashable keys in about 10 bits per key at a 1% false
+    # positive rate, which may wrongly claim to hold a key but never
+    # misses one it was given. Python's hash is only stable within a
+    # process, which is all a filter living for one load needs.
+    def __init__(self, capacity, false_positive_rate=FALSE_POSITIVE_RATE):
+        capacity = max(capacity, 1)
+        self.size = max(8, math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def add(self, key):
+        # set the bits of key, returning whether they were all set already,
+        # i.e. whether key may have been added before. Double hashing, the
+        # positions come from the two halves of one hash.
+        value = hash(key) & 0xFFFFFFFFFFFFFFFF
+        position, step = value & 0xFFFFFFFF, (value >> 32) | 1
+        bits = self.bits
+        size = self.size
+        present = True
+        for _ in range(self.hashes):
+            position %= size
+            mask = 1 << (position & 7)
+            if not bits[position >> 3] & mask:
+                present = False
+                bits[position >> 3] |= mask
+            position += step
+        return present
+
+    def __contains__(self, key):
+        value = hash(key) & 0xFFFFFFFFFFFFFFFF
+        position, step = value & 0xFFFFFFFF, (value >> 32) | 1
+        bits = self.bits
+        for _ in range(self.hashes):
+            position %= self.size
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+            position += step
+        return True
+
+
+class SpilledKeys:
+    # an exact set of keys in a temporary sqlite database on disk, which
+    # sqlite removes once it is closed. It settles the keys a bloom filter
+    # claims when a false positive cannot be written.
+    def __init__(self, batch_size=SPILL_BATCH):
+        # created by the loader, used by whichever thread reads the items
+        self._database = sqlite3.connect("", check_same_thread=False)
+        self._database.execute("CREATE TABLE keys (key TEXT PRIMARY KEY) WITHOUT ROWID")
+        self._pending = set()
+        self._batch_size = batch_size
+
+    def add(self, key):
+        self._pending.add(repr(key))
+        if len(self._pending) >= self._batch_size:
+            self._flush()
+
+    def _flush(self):
+        with self._database:
+            self._database.executemany(
+                "INSERT OR IGNORE INTO keys VALUES (?)", ((key,) for key in self._pending)
+            )
+        self._pending.clear()
+
+    def __contains__(self, key):
+        key = repr(key)
+        if key in self._pending:
+            return True
+        query = self._database.execute("SELECT 1 FROM keys WHERE key = ?", (key,))
+        return query.fetchone() is not None
+
+
+def item_key(item, key=()):
+    # (table name, key values) of a record, a put or a delete. Records
+    # know their key, dynamodb json items need the key attribute names.
+    if isinstance(item, Record):
+        names = item.attribute_names
+        return item.table_name, tuple(item[names.index(name)] for name in item.key)
+    if "Put" in item:
+        request = item["Put"]
+        attributes = request["Item"]
+    else:
+        request = item["Delete"]
+        attributes = request["Key"]
+    return request["TableName"], tuple(
+        next(iter(attributes[name].values())) for name in key
+    )
+
+
+class Deduplicator:
+    # drops items whose key was already seen, before they are batched.
+    # The last WINDOW keys are held exactly: a duplicate among them is
+    # merged, the later item replacing the earlier one (KEEP_LAST), or
+    # dropped (KEEP_FIRST). Older keys are held in a set sized from
+    # expected_items, or in a bloom filter when a set of that many keys
+    # would not fit memory_budget bytes. A key the set remembers is written
+    # again under KEEP_LAST, which overwrites the earlier write, and dropped
+    # under KEEP_FIRST. Under KEEP_LAST the rewrite waits for the batches a
+    # concurrent write has queued, so it cannot land before the earlier
+    # write. A key only the bloom filter claims is written and passed to
+    # log under KEEP_LAST, which is right either way. KEEP_FIRST also
+    # spills every key to disk and looks the claimed ones up there.
+    def __init__(
+        self,
+        key=(),
+        policy=KEEP_LAST,
+        expected_items=None,
+        window=WINDOW,
+        false_positive_rate=FALSE_POSITIVE_RATE,
+        memory_budget=None,
+        log=print,
+    ):
+        if policy not in (KEEP_LAST, KEEP_FIRST):
+            raise ValueError(f"Unsupported duplicate policy {policy}")
+        self.key = tuple(key)
+        self.policy = policy
+        self.window = window
+        self.log = log
+        if memory_budget is None:
+            memory_budget = exact_memory_budget()
+        self.spilled = None
+        if expected_items is not None and expected_items * BYTES_PER_KEY > memory_budget:
+            self.seen = BloomFilter(expected_items, false_positive_rate)
+            if policy == KEEP_FIRST:
+                self.spilled = SpilledKeys()
+        else:
+            self.seen = set()
+        # duplicates merged or dropped
+        self.duplicates = 0
+        # keys from beyond the window written again under KEEP_LAST
+        self.rewritten = 0
+        # possible duplicates the bloom filter could not verify
+        self.unverified = 0
+        self._record_keys = {}
+
+    def _key(self, item):
+        if not isinstance(item, Record):
+            return item_key(item, self.key)
+        # the key getter is built once per record type
+        getter = self._record_keys.get(type(item))
+        if getter is None:
+            names = item.attribute_names
+            positions = [names.index(name) for name in item.key]
+            if len(positions) == 1:
+                # itemgetter of one position returns the value, not a tuple
+                def getter(item, position=positions[0]):
+                    return (item[position],)
+            else:
+                getter = operator.itemgetter(*positions)
+            self._record_keys[type(item)] = getter
+        return item.table_name, getter(item)
+
+    def _count(self, name, key):
+        setattr(self, name, getattr(self, name) + 1)
+        METRICS.count(f"{name}_keys", table=key[0])
+
+    def filter_pairs(self, pairs):
+        # pass on (row_offset, item) pairs with unique keys. Merged items
+        # move to the offset of the later row and pairs still come out in
+        # row order, so a checkpoint journal resumes in the right place.
+        recent = collections.OrderedDict()
+        # keys in recent whose item rewrites one from beyond the window
+        rewrites = set()
+        hold = self.policy == KEEP_LAST
+        seen = self.seen
+        spilled = self.spilled
+        exact = isinstance(seen, set)
+        for pair in pairs:
+            key = self._key(pair[1])
+            if key in recent:
+                self._count("duplicates", key)
+                if hold:
+                    del recent[key]
+                    recent[key] = pair
+                else:
+                    recent.move_to_end(key)
+                continue
+            if exact:
+                repeated = key in seen
+                seen.add(key)
+            else:
+                repeated = seen.add(key)
+                if spilled is not None:
+                    repeated = repeated and key in spilled
+                    spilled.add(key)
+            if repeated:
+                if not exact and hold:
+                    self._count("unverified", key)
+                    self.log(
+                        f"{key[0]} key {key[1]} may repeat an earlier item, written unverified"
+                    )
+                    rewrites.add(key)
+                elif hold:
+                    self._count("rewritten", key)
+                    rewrites.add(key)
+                else:
+                    self._count("duplicates", key)
+                    continue
+            recent[key] = pair if hold else None
+            if len(recent) > self.window:
+                oldest_key, oldest = recent.popitem(last=False)
+                if hold:
+                    if oldest_key in rewrites:
+                        rewrites.discard(oldest_key)
+                        wait_for_queued_batches()
+                    yield oldest
+            if not hold:
+                yield pair
+        if hold:
+            for key, pair in recent.items():
+                if key in rewrites:
+                    wait_for_queued_batches()
+                yield pair
+
+    def filter(self, items):
+        for _, item in self.filter_pairs(enumerate(items, 1)):
+            yield item
+
+    def __repr__(self):
+        return (
+            f"Deduplicator(duplicates={self.duplicates}, rewritten={self.rewritten}, "
+            f"unverified={self.unverified})"
+        )
@@ -0,0 +1,89 @@
+import math
+import random
+import string
+
+DIGITS = string.digits
+LETTERS = string.ascii_uppercase
+# letters used in NHS participant ids, I and O are left out
+NHS_LETTERS = "ABCDEFGHJKLMNPQRSTUVWXYZ"
+
+# in templates "A" stands for a letter and "9" for a digit,
+# any other character is copied as it is
+PARTICIPANT_ID_TEMPLATE = "NHS-AA99-AA99"
+CLINIC_ID_TEMPLATE = "AA99A999"
+ODS_CODE_TEMPLATE = "A99999"
+
+
+class IdGenerator:
+    # maps every index in range(size) onto a distinct id matching the
+    # template. Indexes are shuffled by an affine permutation chosen from
+    # the seed, so ids look random, the same seed always gives the same
+    # ids, and disjoint index ranges can never produce the same id.
+    def __init__(self, template, letters=LETTERS, seed=None):
+        self.template = template
+        alphabets = [
+            letters if character == "A" else DIGITS if character == "9" else character
+            for character in template
+        ]
+        self.size = math.prod(len(alphabet) for alphabet in alphabets)
+
+        rng = random.Random(seed)
+        self._offset = rng.randrange(self.size)
+        self._multiplier = rng.randrange(1, self.size)
+        while math.gcd(self._multiplier, self.size) != 1:
+            self._multiplier = rng.randrange(1, self.size)
+
+        # split the template so each half has few enough combinations to
+        # precompute every string, an id is then two lookups and a concat
+        split = len(alphabets)
+        low_size = 1
+        while split > 0 and low_size * len(alphabets[split - 1]) <= math.isqrt(self.size) + 1:
+            split -= 1
+            low_size *= len(alphabets[split])
+        self._low_size = low_size
+        self._high = self._combinations(alphabets[:split])
+        self._low = self._combinations(alphabets[split:])
+
+    @staticmethod
+    def _combinations(alphabets):
+        combinations = [""]
+        for alphabet in alphabets:
+            combinations = [prefix + character for prefix in combinations for character in alphabet]
+        return combinations
+
+    def id_at(self, index):
+        if not 0 <= index < self.size:
+            raise IndexError(f"{index} is outside the {self.size} ids of {self.template}")
+        high, low = divmod((index * self._multiplier + self._offset) % self.size, self._low_size)
+        return self._high[high] + self._low[low]
+
+    def generate(self, start, count):
+        # ids for indexes start to start + count, in one batch
+        if start < 0 or start + count > self.size:
+            raise IndexError(f"{start}:{start + count} is outside the {self.size} ids of {self.template}")
+        multiplier, offset, size = self._multiplier, self._offset, self.size
+        low_size, high_ids, low_ids = self._low_size, self._high, self._low
+        ids = []
+        append = ids.append
+        for index in range(start, start + count):
+            high, low = divmod((index * multiplier + offset) % size, low_size)
+            append(high_ids[high] + low_ids[low])
+        return ids
+
+    def iter_ids(self, start, count, batch_size=1000):
+        # stream ids for indexes start to start + count, a batch at a time
+        end = start + count
+        for batch_start in range(start, end, batch_size):
+            yield from self.generate(batch_start, min(batch_size, end - batch_start))
+
+    def partition(self, count, parts):
+        # split the first `count` indexes into `parts` disjoint ranges, one
+        # per parallel worker, as (start, count) pairs
+        size, remainder = divmod(count, parts)
+        ranges = []
+        start = 0
+        for part in range(parts):
+            part_size = size + (1 if part < remainder else 0)
+            ranges.append((start, part_size))
+            start += part_size
+        return ranges
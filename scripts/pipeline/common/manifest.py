@@ -0,0 +1,233 @@
+import gzip
+import hashlib
+import json
+import os
+import boto3
+from botocore.exceptions import ClientError
+from scripts.pipeline.common.records import put_attributes
+
+MANIFEST_VERSION = 2
+# bytes of blake2b digest kept per item, plenty to tell rows apart
+DIGEST_SIZE = 8
+
+# manifests are kept in this s3 bucket when it is set, keyed by table, so
+# they outlive the checkout that ran the load. Otherwise they are written
+# next to the source file.
+MANIFEST_BUCKET = os.getenv("SEED_MANIFEST_BUCKET")
+MANIFEST_PREFIX = os.getenv("SEED_MANIFEST_PREFIX", "seed-manifests/")
+
+
+def content_hash(attributes):
+    # converters build attributes in schema order, so the same row
+    # always gives the same repr
+    return hashlib.blake2b(repr(attributes).encode(), digest_size=DIGEST_SIZE).digest()
+
+
+def table_identity(client, table_name):
+    # tells the table apart from an earlier one of the same name, which
+    # has the same arn but was created at another time
+    table = client.describe_table(TableName=table_name)["Table"]
+    return {"TableArn": table["TableArn"], "CreationDateTime": str(table["CreationDateTime"])}
+
+
+class FileStore:
+    def __init__(self, path):
+        self.path = path
+
+    def read(self):
+        # the stored bytes, or None when nothing was stored yet
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, "rb") as file:
+            return file.read()
+
+    def write(self, data):
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "wb") as file:
+            file.write(data)
+        os.replace(temporary_path, self.path)
+
+    def __repr__(self):
+        return self.path
+
+
+class S3Store:
+    def __init__(self, client, bucket, key):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+
+    def read(self):
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.key)
+        except ClientError as error:
+            if error.response.get("Error", {}).get("Code") == "NoSuchKey":
+                return None
+            raise
+        return response["Body"].read()
+
+    def write(self, data):
+        self.client.put_object(Bucket=self.bucket, Key=self.key, Body=data)
+
+    def __repr__(self):
+        return f"s3://{self.bucket}/{self.key}"
+
+
+class Manifest:
+    # maps the primary key of every item last written to a table onto a
+    # hash of its content, stored gzipped in store as one "<key>\t<hash>"
+    # line per item. Key attributes are written as their dynamodb type
+    # letter followed by the value, tab separated. The manifest records
+    # the identity of the table it describes, a manifest of another table
+    # is ignored and every item is written again.
+    def __init__(self, store, key, table=None):
+        self.store = store
+        self.key = tuple(key)
+        self.table = table
+        self.hashes = {}
+        self._load()
+
+    @classmethod
+    def for_table(cls, file_path, table_name, key, client):
+        # one manifest per table, the same source can seed several
+        # environments. client is a dynamodb client to describe the table.
+        if MANIFEST_BUCKET:
+            store = S3Store(
+                boto3.client("s3"), MANIFEST_BUCKET, f"{MANIFEST_PREFIX}{table_name}.manifest.gz"
+            )
+        else:
+            store = FileStore(f"{file_path}.{table_name}.manifest.gz")
+        return cls(store, key, table_identity(client, table_name))
+
+    def _header(self):
+        return {"version": MANIFEST_VERSION, "key": list(self.key), "table": self.table}
+
+    def _load(self):
+        data = self.store.read()
+        if data is None:
+            return
+        # split on newlines only, keys may hold other line breaks
+        lines = gzip.decompress(data).decode("utf-8").split("\n")[:-1]
+        # a manifest for another table, key or format is ignored, everything is rewritten
+        if not lines or json.loads(lines[0]) != self._header():
+            print(f"Manifest {self.store} does not describe this table, writing every item")
+            return
+        hashes = self.hashes
+        for line in lines[1:]:
+            key, _, digest = line.rpartition("\t")
+            hashes[key] = bytes.fromhex(digest)
+
+    def save(self, hashes):
+        lines = [json.dumps(self._header())]
+        lines.extend(f"{key}\t{digest.hex()}" for key, digest in hashes.items())
+        self.store.write(gzip.compress(("\n".join(lines) + "\n").encode("utf-8"), compresslevel=6))
+        self.hashes = hashes
+
+    def encode_key(self, attributes):
+        parts = []
+        for name in self.key:
+            ((type, value),) = attributes[name].items()
+            if "\t" in value or "\n" in value:
+                raise ValueError(f"{name} {value!r} cannot be stored in a manifest")
+            parts.append(type + value)
+        return "\t".join(parts)
+
+    def decode_key(self, key):
+        return {name: {part[0]: part[1:]} for name, part in zip(self.key, key.split("\t"))}
+
+
+class ManifestChanges:
+    # iterating yields a Put for every item added or changed since the
+    # manifest was saved, then a Delete for every key no longer present.
+    # A key whose item was held back, rejected by validation, keeps its old
+    # hash and is not deleted. The new hashes are kept until commit() once
+    # the writes succeed.
+    def __init__(self, manifest, items, table_name):
+        self.manifest = manifest
+        self.items = items
+        self.table_name = table_name
+        self.added = 0
+        self.changed = 0
+        self.unchanged = 0
+        self.removed = 0
+        self._held = set()
+        self._hashes = None
+
+    def hold(self, item):
+        # item is not written, whatever the table holds for its key stays
+        try:
+            self._held.add(self.manifest.encode_key(put_attributes(item)))
+        except (KeyError, ValueError):
+            # without a valid key it cannot be an item written before
+            pass
+
+    def __iter__(self):
+        previous = self.manifest.hashes
+        hashes = {}
+        encode_key = self.manifest.encode_key
+        for item in self.items:
+            attributes = put_attributes(item)
+            key = encode_key(attributes)
+            digest = content_hash(attributes)
+            hashes[key] = digest
+            old_digest = previous.get(key)
+            if old_digest is None:
+                self.added += 1
+                yield item
+            elif old_digest != digest:
+                self.changed += 1
+                yield item
+            else:
+                self.unchanged += 1
+        for key in self._held - hashes.keys():
+            if key in previous:
+                hashes[key] = previous[key]
+        for key in previous.keys() - hashes.keys():
+            self.removed += 1
+            yield {
+                "Delete": {
+                    "Key": self.manifest.decode_key(key),
+                    "TableName": self.table_name,
+                }
+            }
+        self._hashes = hashes
+
+    def commit(self, rejected=()):
+        # rejected (item, error) pairs keep their old hash, so they are
+        # sent again by the next incremental load
+        if self._hashes is None:
+            raise RuntimeError("changes must be written before they are committed")
+        hashes = self._hashes
+        previous = self.manifest.hashes
+        for item, _ in rejected:
+            if "Delete" in item:
+                attributes = item["Delete"]["Key"]
+            else:
+                attributes = put_attributes(item)
+            key = self.manifest.encode_key(attributes)
+            if key in previous:
+                hashes[key] = previous[key]
+            else:
+                hashes.pop(key, None)
+        self.manifest.save(hashes)
+
+    def __repr__(self):
+        return (
+            f"ManifestChanges(added={self.added}, changed={self.changed}, "
+            f"removed={self.removed}, unchanged={self.unchanged})"
+        )
+
+
+def incremental_write(manifest, items, table_name, write, rejects=None, **options):
+    # write(items, **options) only the difference between items and the
+    # manifest, which is updated once every write has succeeded or been
+    # refused. After a failure the next run sends the same difference again.
+    # Items logged to rejects while items is read are held, not deleted.
+    changes = ManifestChanges(manifest, items, table_name)
+    if rejects is not None:
+        rejects.listeners.append(changes.hold)
+    result = write(changes, **options)
+    print(changes)
+    if result.complete:
+        changes.commit(result.rejected)
+    return result
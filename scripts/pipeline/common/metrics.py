@@ -0,0 +1,293 @@
+import collections
+import contextlib
+import json
+import math
+import threading
+import time
+
+# seconds between live progress lines, 0 turns them off
+PROGRESS_INTERVAL = 10.0
+PERCENTILES = (50, 95, 99)
+
+
+class _Frame:
+    __slots__ = ("key", "seconds", "resumed")
+
+    def __init__(self, key, now):
+        self.key = key
+        self.seconds = 0.0
+        self.resumed = now
+
+
+def percentile(ordered, rank):
+    # nearest rank percentile of an already sorted list
+    if not ordered:
+        return None
+    return ordered[max(0, math.ceil(rank / 100 * len(ordered)) - 1)]
+
+
+class Metrics:
+    # stage timings, counters and request latencies of a seed run, shared
+    # by every thread. Stage times are exclusive: while a lazily chained
+    # stage pulls from the stage before it, the time goes to the inner one,
+    # so the stages of a pipeline add up to its wall time.
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = self.clock()
+            # one (stage, table) -> [seconds, calls] dict per thread, so
+            # timing a stage takes no lock
+            self._thread_stages = []
+            self._local = threading.local()
+            # thread id -> stage stack, read by the stack sampling profiler
+            self._active = {}
+            # (name, table) -> value
+            self.counters = collections.defaultdict(float)
+            # (operation, table) -> request latencies in seconds
+            self.latencies = collections.defaultdict(list)
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+            with self._lock:
+                self._active[threading.get_ident()] = stack
+        return stack
+
+    def current_stages(self):
+        # thread id -> innermost stage that thread is timing right now
+        with self._lock:
+            active = list(self._active.items())
+        stages = {}
+        for thread_id, stack in active:
+            try:
+                stages[thread_id] = stack[-1].key[0]
+            except IndexError:
+                # the thread is between stages, or left the last one as we looked
+                pass
+        return stages
+
+    def _stages(self):
+        stages = getattr(self._local, "stages", None)
+        if stages is None:
+            stages = self._local.stages = collections.defaultdict(lambda: [0.0, 0])
+            with self._lock:
+                self._thread_stages.append(stages)
+        return stages
+
+    @property
+    def stages(self):
+        # (stage, table) -> [seconds, calls] summed over every thread
+        with self._lock:
+            thread_stages = [dict(stages) for stages in self._thread_stages]
+        totals = collections.defaultdict(lambda: [0.0, 0])
+        for stages in thread_stages:
+            for key, (seconds, calls) in stages.items():
+                totals[key][0] += seconds
+                totals[key][1] += calls
+        return totals
+
+    def _enter(self, stage, table):
+        stack = self._stack()
+        now = self.clock()
+        if stack:
+            parent = stack[-1]
+            parent.seconds += now - parent.resumed
+        frame = _Frame((stage, table), now)
+        stack.append(frame)
+        return stack, frame
+
+    def _exit(self, stack, frame):
+        now = self.clock()
+        frame.seconds += now - frame.resumed
+        stack.pop()
+        if stack:
+            stack[-1].resumed = now
+        stage, table = frame.key
+        self.add_time(stage, frame.seconds, table)
+
+    @contextlib.contextmanager
+    def timer(self, stage, table=""):
+        stack, frame = self._enter(stage, table)
+        try:
+            yield
+        finally:
+            self._exit(stack, frame)
+
+    def timed(self, stage, iterable, table=""):
+        # time spent producing every item of iterable
+        iterator = iter(iterable)
+        while True:
+            stack, frame = self._enter(stage, table)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self._exit(stack, frame)
+            yield item
+
+    def add_time(self, stage, seconds, table="", calls=1):
+        totals = self._stages()[(stage, table)]
+        totals[0] += seconds
+        totals[1] += calls
+
+    def count(self, name, value=1, table=""):
+        with self._lock:
+            self.counters[(name, table)] += value
+
+    def observe(self, operation, seconds, table=""):
+        with self._lock:
+            self.latencies[(operation, table)].append(seconds)
+
+    def consumed(self, response):
+        # response of a write made with ReturnConsumedCapacity="TOTAL"
+        for capacity in response.get("ConsumedCapacity") or []:
+            self.count("consumed_capacity_units", capacity.get("CapacityUnits", 0), capacity.get("TableName", ""))
+
+    def calls(self, stage):
+        return sum(calls for (name, _), (_, calls) in self.stages.items() if name == stage)
+
+    def total(self, name):
+        with self._lock:
+            return sum(value for (counter, _), value in self.counters.items() if counter == name)
+
+    def report(self):
+        stages = [
+            {"stage": stage, "table": table, "seconds": round(seconds, 6), "calls": calls}
+            for (stage, table), (seconds, calls) in sorted(self.stages.items())
+        ]
+        with self._lock:
+            elapsed = self.clock() - self.started
+            counters = [
+                {"name": name, "table": table, "value": value}
+                for (name, table), value in sorted(self.counters.items())
+            ]
+            latencies = []
+            for (operation, table), samples in sorted(self.latencies.items()):
+                ordered = sorted(samples)
+                latency = {"operation": operation, "table": table, "count": len(ordered)}
+                for rank in PERCENTILES:
+                    latency[f"p{rank}"] = percentile(ordered, rank)
+                latencies.append(latency)
+        written = sum(c["value"] for c in counters if c["name"] == "items_written")
+        return {
+            "elapsed_seconds": round(elapsed, 6),
+            "items_per_second": round(written / elapsed, 3) if elapsed else None,
+            "stages": stages,
+            "counters": counters,
+            "latencies": latencies,
+        }
+
+    def to_json(self):
+        return json.dumps(self.report(), indent=2)
+
+    def to_prometheus(self, prefix="seed_"):
+        report = self.report()
+        lines = [
+            f"# TYPE {prefix}elapsed_seconds gauge",
+            f"{prefix}elapsed_seconds {report['elapsed_seconds']}",
+            f"# TYPE {prefix}stage_seconds counter",
+        ]
+        for stage in report["stages"]:
+            labels = _labels(stage=stage["stage"], table=stage["table"])
+            lines.append(f"{prefix}stage_seconds{labels} {stage['seconds']}")
+        names = sorted({counter["name"] for counter in report["counters"]})
+        for name in names:
+            lines.append(f"# TYPE {prefix}{name} counter")
+            for counter in report["counters"]:
+                if counter["name"] == name:
+                    lines.append(f"{prefix}{name}{_labels(table=counter['table'])} {counter['value']}")
+        lines.append(f"# TYPE {prefix}request_seconds summary")
+        for latency in report["latencies"]:
+            for rank in PERCENTILES:
+                labels = _labels(
+                    operation=latency["operation"],
+                    table=latency["table"],
+                    quantile=str(rank / 100),
+                )
+                lines.append(f"{prefix}request_seconds{labels} {latency[f'p{rank}']}")
+            labels = _labels(operation=latency["operation"], table=latency["table"])
+            lines.append(f"{prefix}request_seconds_count{labels} {latency['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, path):
+        # prometheus text for .prom files, json otherwise
+        text = self.to_prometheus() if path.endswith(".prom") else self.to_json()
+        with open(path, "w") as file:
+            file.write(text)
+
+
+def _labels(**labels):
+    pairs = ",".join(
+        f'{name}="{value}"' for name, value in labels.items() if value != ""
+    )
+    return "{" + pairs + "}" if pairs else ""
+
+
+# the metrics of this process, recorded by the common modules
+METRICS = Metrics()
+
+
+class Progress:
+    # prints items written per second, and an ETA once the sources have
+    # said how many rows they hold, every `interval` seconds
+    def __init__(self, metrics=METRICS, interval=PROGRESS_INTERVAL, clock=time.monotonic):
+        self.metrics = metrics
+        self.interval = interval
+        self.clock = clock
+        self._stop = threading.Event()
+        self._thread = None
+        self._last = (clock(), 0)
+
+    def line(self):
+        now = self.clock()
+        written = self.metrics.total("items_written")
+        last_time, last_written = self._last
+        self._last = (now, written)
+        rate = (written - last_written) / (now - last_time) if now > last_time else 0.0
+        line = f"{int(written)} items written, {rate:0.0f} items/s"
+        expected = self.metrics.total("rows_expected")
+        # every row read from a source is decoded once
+        read = self.metrics.calls("decode")
+        if expected and rate:
+            remaining = max(expected - read, 0) * (written / read if read else 1)
+            line += f", ETA {time.strftime('%H:%M:%S', time.gmtime(remaining / rate))}"
+        return line
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            print(self.line(), flush=True)
+
+    def start(self):
+        if self.interval > 0:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+@contextlib.contextmanager
+def reporting(path=None, interval=PROGRESS_INTERVAL, metrics=METRICS):
+    # live progress while the block runs, then a report to path
+    progress = Progress(metrics, interval).start()
+    try:
+        yield metrics
+    finally:
+        progress.stop()
+        report = metrics.report()
+        print(
+            f"{int(metrics.total('items_written'))} items written in "
+            f"{report['elapsed_seconds']:0.1f} seconds"
+        )
+        if path:
+            metrics.write_report(path)
+            print(f"Metrics written to {path}")
@@ -0,0 +1,56 @@
+import collections
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+# rows sent to a worker process at a time
+CHUNK_SIZE = 2000
+# worker processes formatting rows by default. A converter formats around
+# a million rows a second, a few processes outpace any table's writes and
+# more only take cores from the writer threads.
+MAX_PROCESSES = 4
+DEFAULT_PROCESSES = min(os.cpu_count() or 1, MAX_PROCESSES)
+
+
+def new_process_pool(processes):
+    # the workers are started from a forkserver rather than forked from the
+    # loader, which by then runs writer, reader and metrics threads. A fork
+    # copies their locks in whatever state they are in, along with the
+    # loader's boto3 clients, and can leave a worker hung on a lock no
+    # thread will release.
+    return ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("forkserver"))
+
+
+def format_chunk(format_rows, start, rows):
+    return list(format_with_offsets(rows, format_rows, start))
+
+
+def format_with_offsets(rows, format_rows, start=0):
+    # lazily yield (row_offset, item) pairs, row_offset being the number of
+    # source rows consumed once the item was produced, which is what the
+    # checkpoint journal needs to resume from the right place. All the rows
+    # go to one format_rows(rows, start=start, offsets=True) call, which
+    # yields the pairs itself, e.g. from a converter compiled with offsets.
+    return format_rows(rows, start=start, offsets=True)
+
+
+def format_in_parallel(rows, format_rows, executor, start=0, chunk_size=CHUNK_SIZE, window=None):
+    # split rows into ranges formatted by a process pool and yield the
+    # (row_offset, item) pairs in their original order. At most `window`
+    # ranges are in flight, so memory stays bounded however long the input.
+    # format_rows must be picklable, e.g. a functools.partial of a module
+    # level function.
+    if window is None:
+        window = 2 * getattr(executor, "_max_workers", 1)
+    pending = collections.deque()
+    rows = iter(rows)
+    chunk = list(islice(rows, chunk_size))
+    while chunk:
+        pending.append(executor.submit(format_chunk, format_rows, start, chunk))
+        start += len(chunk)
+        if len(pending) >= window:
+            yield from pending.popleft().result()
+        chunk = list(islice(rows, chunk_size))
+    while pending:
+        yield from pending.popleft().result()
@@ -0,0 +1,203 @@
+import cProfile
+import collections
+import contextlib
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+from scripts.pipeline.common.metrics import METRICS
+
+# seconds between stack samples
+SAMPLE_INTERVAL = 0.005
+# frames kept for every traced allocation
+TRACEMALLOC_FRAMES = 16
+# allocation sites and functions listed in the text summaries
+TOP_ENTRIES = 25
+# a new peak snapshot is taken once traced memory grows this much past
+# the last one, snapshots are slow with millions of live blocks
+PEAK_GROWTH = 1.25
+
+PSTATS_FILE = "profile.pstats"
+PROFILE_SUMMARY_FILE = "profile.txt"
+COLLAPSED_STACKS_FILE = "stacks.collapsed"
+ALLOCATIONS_FILE = "allocations.txt"
+
+# allocations made by the profiler itself are left out of the summaries.
+# Statistics are dropped after grouping, Snapshot.filter_traces goes
+# through every block in python and takes minutes on a large load.
+_IGNORED_FILES = {tracemalloc.__file__, __file__, "<frozen importlib._bootstrap>", "<unknown>"}
+
+
+def _frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _mib(size):
+    return f"{size / 1024 / 1024:0.1f} MiB"
+
+
+class Sampler:
+    # every `interval` seconds counts the stack of every other thread as a
+    # collapsed stack rooted at the pipeline stage the thread was timing,
+    # "-" outside any stage, ready for flamegraph.pl or speedscope. While
+    # tracemalloc is on it also snapshots traced memory as it peaks.
+    def __init__(self, interval=SAMPLE_INTERVAL, metrics=METRICS):
+        self.interval = interval
+        self.metrics = metrics
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.peak_snapshot = None
+        self._snapshot_size = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        own = threading.get_ident()
+        stages = self.metrics.current_stages()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own:
+                continue
+            frames = []
+            while frame is not None:
+                frames.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            frames.append(stages.get(thread_id, "-"))
+            self.stacks[";".join(reversed(frames))] += 1
+        self.samples += 1
+        if tracemalloc.is_tracing():
+            self._check_memory()
+
+    def _check_memory(self):
+        current, _ = tracemalloc.get_traced_memory()
+        if current > self._snapshot_size * PEAK_GROWTH:
+            self.peak_snapshot = tracemalloc.take_snapshot()
+            self._snapshot_size = current
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def write_collapsed(self, path):
+        with open(path, "w") as file:
+            file.writelines(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+
+class ThreadProfiles:
+    # a cProfile profile for the calling thread and for every thread
+    # started while it is enabled. A cProfile profile only sees the thread
+    # that enabled it, so each new thread enables one of its own.
+    def __init__(self):
+        self.profiles = []
+        self._lock = threading.Lock()
+
+    def _new_profile(self):
+        profile = cProfile.Profile()
+        with self._lock:
+            self.profiles.append(profile)
+        profile.enable()
+
+    def _start_thread(self, frame, event, argument):
+        # threading calls this once as each new thread starts, enabling
+        # the profile replaces it for the rest of that thread
+        self._new_profile()
+
+    def enable(self):
+        self._new_profile()
+        threading.setprofile(self._start_thread)
+
+    def disable(self):
+        threading.setprofile(None)
+        # the calling thread's profile, threads still running are cut off
+        # when their stats are read
+        self.profiles[0].disable()
+
+    def stats(self):
+        stats = pstats.Stats(self.profiles[0])
+        for profile in self.profiles[1:]:
+            stats.add(profile)
+        return stats
+
+
+def write_profile(profiles, directory):
+    stats = profiles.stats()
+    stats.dump_stats(os.path.join(directory, PSTATS_FILE))
+    with open(os.path.join(directory, PROFILE_SUMMARY_FILE), "w") as file:
+        stats.stream = file
+        stats.sort_stats("cumulative").print_stats(TOP_ENTRIES)
+        stats.sort_stats("tottime").print_stats(TOP_ENTRIES)
+
+
+def _statistics(snapshot, key_type):
+    return [
+        statistic
+        for statistic in snapshot.statistics(key_type)
+        if statistic.traceback[0].filename not in _IGNORED_FILES
+    ]
+
+
+def _write_statistics(file, title, snapshot):
+    statistics = _statistics(snapshot, "lineno")
+    total = sum(statistic.size for statistic in statistics)
+    file.write(f"\n{title}, {_mib(total)} traced\n")
+    for statistic in statistics[:TOP_ENTRIES]:
+        frame = statistic.traceback[0]
+        file.write(
+            f"{_mib(statistic.size):>12} {statistic.count:>10} blocks  "
+            f"{frame.filename}:{frame.lineno}\n"
+        )
+    file.write(f"\nlargest allocation tracebacks, {title}\n")
+    for statistic in _statistics(snapshot, "traceback")[:5]:
+        file.write(f"\n{_mib(statistic.size)} in {statistic.count} blocks\n")
+        file.writelines(f"  {line}\n" for line in statistic.traceback.format(most_recent_first=True))
+
+
+def write_allocations(path, peak_snapshot, final_snapshot):
+    current, peak = tracemalloc.get_traced_memory()
+    with open(path, "w") as file:
+        file.write(f"traced memory: {_mib(current)} at the end, {_mib(peak)} at the peak\n")
+        if peak_snapshot is not None:
+            _write_statistics(file, "top allocation sites near the peak", peak_snapshot)
+        _write_statistics(file, "top allocation sites at the end", final_snapshot)
+
+
+@contextlib.contextmanager
+def profiling(directory=None, interval=SAMPLE_INTERVAL, metrics=METRICS):
+    # profile the block into directory: cProfile stats of every thread
+    # started inside it, collapsed stacks sampled from every thread, and a
+    # summary of the largest allocations. Does nothing without a directory.
+    # Worker processes formatting rows are not profiled.
+    if not directory:
+        yield None
+        return
+    os.makedirs(directory, exist_ok=True)
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    sampler = Sampler(interval, metrics).start()
+    profiles = ThreadProfiles()
+    profiles.enable()
+    try:
+        yield sampler
+    finally:
+        profiles.disable()
+        sampler.stop()
+        final_snapshot = tracemalloc.take_snapshot()
+        write_allocations(
+            os.path.join(directory, ALLOCATIONS_FILE), sampler.peak_snapshot, final_snapshot
+        )
+        if started_tracing:
+            tracemalloc.stop()
+        write_profile(profiles, directory)
+        sampler.write_collapsed(os.path.join(directory, COLLAPSED_STACKS_FILE))
+        print(f"Profile written to {directory}")
@@ -0,0 +1,112 @@
+import threading
+import time
+from botocore.exceptions import ClientError
+
+THROTTLING_ERRORS = {
+    "ProvisionedThroughputExceededException",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+}
+# cancellation reasons of a transaction refused for capacity, not content
+THROTTLING_CANCELLATIONS = {"ThrottlingError", "ProvisionedThroughputExceeded"}
+# cancellation reasons given to the other items of such a transaction
+_UNAFFECTED_CANCELLATIONS = {"None", "TransactionConflict"}
+
+# starting rate in items per second for on-demand tables, which have no
+# provisioned capacity to start from
+DEFAULT_RATE = 500.0
+MIN_RATE = 1.0
+# fraction of the rate kept after a throttle
+DECREASE_FACTOR = 0.5
+# fraction of the starting rate added per second while requests succeed
+INCREASE_FRACTION = 0.05
+# longest gap between successes that still counts towards the increase
+MAX_INCREASE_INTERVAL = 1.0
+
+
+def is_throttling_error(error):
+    # a throttled transaction is cancelled rather than refused outright,
+    # it counts as throttled when throttling is all its reasons name
+    if not isinstance(error, ClientError):
+        return False
+    code = error.response.get("Error", {}).get("Code")
+    if code == "TransactionCanceledException":
+        codes = {reason.get("Code") for reason in error.response.get("CancellationReasons") or []}
+        return bool(codes & THROTTLING_CANCELLATIONS) and codes <= (
+            THROTTLING_CANCELLATIONS | _UNAFFECTED_CANCELLATIONS
+        )
+    return code in THROTTLING_ERRORS
+
+
+class AdaptiveRateLimiter:
+    # token bucket shared by every writer thread. The refill rate follows
+    # additive increase / multiplicative decrease: it is halved whenever
+    # dynamodb throttles and creeps back up by `increase` a second while
+    # writes succeed. The increase follows the time between successes, not
+    # their number, so more writer threads do not ramp up any faster.
+    def __init__(
+        self,
+        rate=DEFAULT_RATE,
+        min_rate=MIN_RATE,
+        max_rate=None,
+        increase=None,
+        decrease_factor=DECREASE_FACTOR,
+        clock=time.monotonic,
+        sleep=time.sleep,
+    ):
+        self.rate = float(rate)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase if increase is not None else max(1.0, rate * INCREASE_FRACTION)
+        self.decrease_factor = decrease_factor
+        self.throttles = 0
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        # allow at most one second worth of burst
+        self._tokens = self.rate
+        self._updated = clock()
+        self._increased = self._updated
+
+    @classmethod
+    def from_table(cls, client, table_name, **options):
+        # start from the provisioned write capacity of the table,
+        # on-demand tables report zero and use the default rate
+        table = client.describe_table(TableName=table_name)["Table"]
+        capacity = table.get("ProvisionedThroughput", {}).get("WriteCapacityUnits", 0)
+        if capacity:
+            options.setdefault("rate", capacity)
+            options.setdefault("max_rate", capacity * 2)
+        return cls(**options)
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, units=1):
+        # reserve the units straight away and sleep off any debt, so
+        # concurrent callers queue up behind each other fairly
+        with self._lock:
+            self._refill()
+            self._tokens -= units
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            self._sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            now = self._clock()
+            elapsed = min(now - self._increased, MAX_INCREASE_INTERVAL)
+            self._increased = now
+            self.rate += self.increase * elapsed
+            if self.max_rate is not None:
+                self.rate = min(self.rate, self.max_rate)
+
+    def on_throttle(self):
+        with self._lock:
+            self.throttles += 1
+            self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            self._increased = self._clock()
+            # drop any burst allowance so the lower rate applies immediately
+            self._tokens = min(self._tokens, 0)
@@ -0,0 +1,99 @@
+import glob
+import json
+import os
+from itertools import islice
+from scripts.pipeline.common.bulk_writer import BATCH_SIZE, write_items
+
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 1
+REQUEST_FILE = "requests-{:05d}.json"
+REQUEST_FILE_PATTERN = "requests-*.json"
+
+
+def _write_json(path, value):
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w") as file:
+        json.dump(value, file, separators=(",", ":"))
+    os.replace(temporary_path, path)
+
+
+def write_request_files(requests, directory, table_name, batch_size=BATCH_SIZE):
+    # stream batch write requests ({"PutRequest": ...}) into a directory of
+    # compact request files of batch_size requests each, every one ready
+    # for `aws dynamodb batch-write-item --request-items file://...`, and
+    # list them in a manifest. The manifest is written last, a directory
+    # without one was not finished. Returns the manifest.
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    for path in glob.glob(os.path.join(directory, REQUEST_FILE_PATTERN)):
+        os.remove(path)
+
+    files = []
+    requests = iter(requests)
+    chunk = list(islice(requests, batch_size))
+    while chunk:
+        name = REQUEST_FILE.format(len(files) + 1)
+        _write_json(os.path.join(directory, name), {table_name: chunk})
+        files.append({"name": name, "items": len(chunk)})
+        chunk = list(islice(requests, batch_size))
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "table_name": table_name,
+        "batch_size": batch_size,
+        "items": sum(file["items"] for file in files),
+        "files": files,
+    }
+    _write_json(manifest_path, manifest)
+    return manifest
+
+
+def read_manifest(directory):
+    manifest_path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        raise ValueError(f"{directory} has no {MANIFEST_FILE}, it was not written in full")
+    with open(manifest_path, "r") as file:
+        manifest = json.load(file)
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError(f"Unsupported request file manifest version {manifest.get('version')}")
+    return manifest
+
+
+def read_request_file(path, environment=None):
+    # yield the requests of a batch write request file as transact style
+    # items. Tables named ENVIRONMENT-<Table> are renamed for environment.
+    with open(path, "r") as file:
+        text = file.read()
+    if environment is not None:
+        text = text.replace("ENVIRONMENT", environment)
+    for table_name, requests in json.loads(text).items():
+        for request in requests:
+            if "PutRequest" in request:
+                yield {"Put": {"Item": request["PutRequest"]["Item"], "TableName": table_name}}
+            else:
+                yield {"Delete": {"Key": request["DeleteRequest"]["Key"], "TableName": table_name}}
+
+
+def iter_request_files(directory, environment=None):
+    # every request of a request file directory, in manifest order
+    manifest = read_manifest(directory)
+    for entry in manifest["files"]:
+        yield from read_request_file(os.path.join(directory, entry["name"]), environment)
+
+
+def upload_request_files(directory, environment=None, workers=8, **options):
+    # send a request file directory with the bulk writer, `workers`
+    # batches at a time, unprocessed items retried with backoff
+    manifest = read_manifest(directory)
+    result = write_items(
+        iter_request_files(directory, environment),
+        workers=workers,
+        batch_size=manifest["batch_size"],
+        **options,
+    )
+    print(
+        f"{result.succeeded} of {manifest['items']} requests from "
+        f"{len(manifest['files'])} files uploaded, {result.failed} failed"
+    )
+    return result
@@ -0,0 +1,120 @@
+import functools
+from scripts.pipeline.common.records import record_type
+
+SUPPORTED_TYPES = ("S", "N", "BOOL")
+
+
+class Column:
+    # one attribute of a dynamodb item, read from csv column `index`,
+    # from a value derived once per row (`derived`), or a constant `value`.
+    # `coerce` turns the raw value into the string sent to dynamodb.
+    def __init__(self, name, type="S", index=None, derived=None, value=None, coerce=str):
+        if type not in SUPPORTED_TYPES:
+            raise ValueError(f"Unsupported dynamodb type {type} for {name}")
+        if (index is None) + (derived is None) + (value is None) != 2:
+            raise ValueError(f"{name} needs exactly one of index, derived or value")
+        self.name = name
+        self.type = type
+        self.index = index
+        self.derived = derived
+        self.value = value
+        self.coerce = coerce
+
+
+class TableSchema:
+    # declarative description of how csv rows map onto the items of a
+    # table, compiled once per table name into a specialised converter
+    def __init__(self, columns, key=(), derived=None, row_filter=None):
+        self.columns = columns
+        # attribute names making up the table's primary key
+        self.key = tuple(key)
+        # name -> function(row, index), evaluated once per row before the
+        # columns, index counts rows from the converter's start argument
+        self.derived = derived or {}
+        # function(row) returning False for rows that should be skipped
+        self.row_filter = row_filter
+
+    def column(self, name):
+        for column in self.columns:
+            if column.name == name:
+                return column
+        raise KeyError(name)
+
+    @functools.lru_cache(maxsize=None)
+    def converter(self, table_name=None, request="Put", offsets=False):
+        # request is "Put" for transact style items, which carry their
+        # table name, "PutRequest" for batch write request files, or
+        # "Record" for compact records the writer expands into put items.
+        # With offsets the converter takes convert(rows, start, offset) and
+        # yields (row_offset, item) pairs, row_offset counting the rows read
+        # from offset up to and including the item's own.
+        return compile_converter(self, table_name, request, offsets)
+
+    def record_type(self, table_name):
+        return record_type(
+            table_name,
+            [column.name for column in self.columns],
+            [column.type for column in self.columns],
+            self.key,
+        )
+
+
+def _value_source(column, position, namespace):
+    if column.value is not None:
+        if column.type == "BOOL":
+            return repr(bool(column.value))
+        return repr(column.coerce(column.value))
+    if column.index is not None:
+        raw = f"row[{column.index}]"
+    else:
+        raw = f"derived_{column.derived}"
+    if column.coerce is str:
+        return f"str({raw})"
+    namespace[f"coerce_{position}"] = column.coerce
+    return f"coerce_{position}({raw})"
+
+
+def compile_converter(schema, table_name=None, request="Put", offsets=False):
+    # generate and compile a function turning an iterable of rows into
+    # items, with every column lookup and type wrapper written out inline,
+    # so there is no per-row interpretation of the schema. End to end this
+    # only matches the old hand-written code, allocating the nested dicts
+    # is the cost whichever side builds them. Records are there for memory
+    # and for crossing process boundaries, where they pickle about twice
+    # as fast as put items, see benchmark_converters.
+    namespace = {"table_name": table_name, "row_filter": schema.row_filter, "str": str}
+    if offsets:
+        lines = ["def convert(rows, start=0, offset=0):", "    shift = offset + 1 - start"]
+        emit = "yield index + shift, "
+    else:
+        lines = ["def convert(rows, start=0):"]
+        emit = "yield "
+    lines.append("    for index, row in enumerate(rows, start):")
+    if schema.row_filter is not None:
+        lines.append("        if not row_filter(row):")
+        lines.append("            continue")
+    for name, function in schema.derived.items():
+        namespace[f"derive_{name}"] = function
+        lines.append(f"        derived_{name} = derive_{name}(row, index)")
+    attributes = ", ".join(
+        f"{column.name!r}: {{{column.type!r}: {_value_source(column, position, namespace)}}}"
+        for position, column in enumerate(schema.columns)
+    )
+    if request == "Put":
+        lines.append(f"        {emit}{{'Put': {{'Item': {{{attributes}}}, 'TableName': table_name}}}}")
+    elif request == "PutRequest":
+        lines.append(f"        {emit}{{'PutRequest': {{'Item': {{{attributes}}}}}}}")
+    elif request == "Record":
+        namespace["record"] = schema.record_type(table_name)
+        values = "".join(
+            f"{_value_source(column, position, namespace)}, "
+            for position, column in enumerate(schema.columns)
+        )
+        lines.append(f"        {emit}record(({values}))")
+    else:
+        raise ValueError(f"Unsupported request type {request}")
+    source = "\n".join(lines)
+    exec(compile(source, f"<converter {table_name}>", "exec"), namespace)
+    convert = namespace["convert"]
+    convert.source = source
+    return convert
@@ -0,0 +1,150 @@
+import contextlib
+import csv
+import hashlib
+import io
+import itertools
+import os
+import zipfile
+from scripts.pipeline.common.bulk_writer import prefetch_chunks
+from scripts.pipeline.common.column_cache import open_cache, write_cache
+from scripts.pipeline.common.metrics import METRICS
+
+# rows parsed ahead of the consumer, a chunk at a time
+READ_AHEAD_CHUNK = 1000
+READ_AHEAD_DEPTH = 16
+READ_BUFFER = 1024 * 1024
+
+# parsed sources are cached in columnar files in SEED_CACHE_DIR, a
+# directory kept between runs. Without it the csv is parsed every time,
+# a cache written to a throwaway checkout only costs its build.
+# SEED_CACHE=1 caches next to the source instead, SEED_CACHE=0 never caches.
+CACHE_DIR = os.getenv("SEED_CACHE_DIR")
+CACHE_ENABLED = os.getenv("SEED_CACHE", "1" if CACHE_DIR else "0") != "0"
+
+
+def file_hash(file_path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def split_source(path):
+    # "archive.zip:member.csv" names a member inside a zip archive,
+    # a plain "archive.zip" means its only csv member
+    if ".zip:" in path:
+        archive, member = path.split(".zip:", 1)
+        return f"{archive}.zip", member
+    return path, None
+
+
+def csv_member(archive):
+    members = [name for name in archive.namelist() if name.endswith(".csv")]
+    if len(members) != 1:
+        raise ValueError(f"Expected one csv file in {archive.filename}, found {members}")
+    return members[0]
+
+
+class TimedReader(io.RawIOBase):
+    # counts the time spent reading the source, and decompressing it for
+    # zip members, as the read stage
+    def __init__(self, raw):
+        self.raw = raw
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        with METRICS.timer("read"):
+            return self.raw.readinto(buffer)
+
+
+def read_ahead(rows, chunk_size=READ_AHEAD_CHUNK, depth=READ_AHEAD_DEPTH):
+    # decompress and parse on a background thread, so the writers are
+    # never left waiting on either
+    for chunk in prefetch_chunks(rows, chunk_size, depth):
+        yield from chunk
+
+
+def cache_path(path):
+    if CACHE_DIR is None:
+        return f"{path}.columns"
+    return os.path.join(CACHE_DIR, os.path.basename(path).replace(":", "_") + ".columns")
+
+
+@contextlib.contextmanager
+def open_csv_source(path, skip_header=True, cache=None):
+    # yield the rows of a csv file, or of a csv member of a zip archive,
+    # from the columnar cache when one was built from the same source
+    if cache is None:
+        cache = CACHE_ENABLED
+    if not cache:
+        with parse_csv_source(path, skip_header) as rows:
+            yield rows
+        return
+    file_path, member = split_source(path)
+    location = cache_path(path)
+    with METRICS.timer("read"):
+        source_key = f"{member or ''}:{file_hash(file_path)}"
+        columns = open_cache(location, source_key)
+    if columns is None:
+        build_cache(path, location, source_key)
+        with METRICS.timer("read"):
+            columns = open_cache(location, source_key)
+    METRICS.count("rows_expected", len(columns))
+    with columns:
+        rows = columns.rows()
+        try:
+            decoded = METRICS.timed("decode", rows)
+            if skip_header:
+                yield decoded
+            else:
+                yield itertools.chain([columns.header], decoded)
+        finally:
+            # memoryviews over the mapped file must go before it is closed
+            rows.close()
+
+
+def build_cache(path, location, source_key):
+    # parse the source once and store it column by column
+    with parse_csv_source(path, skip_header=False) as rows:
+        header = next(rows, [])
+        with METRICS.timer("cache_build"):
+            write_cache(location, source_key, header, rows)
+
+
+@contextlib.contextmanager
+def parse_csv_source(path, skip_header=True):
+    # yield the rows of a csv file, or of a csv member streamed straight
+    # out of a zip archive without extracting it to disk first
+    file_path, member = split_source(path)
+    with contextlib.ExitStack() as stack:
+        if zipfile.is_zipfile(file_path):
+            archive = stack.enter_context(zipfile.ZipFile(file_path))
+            binary = stack.enter_context(archive.open(member or csv_member(archive)))
+        else:
+            binary = stack.enter_context(open(file_path, "rb"))
+        buffered = io.BufferedReader(TimedReader(binary), buffer_size=READ_BUFFER)
+        file = stack.enter_context(io.TextIOWrapper(buffered, encoding="utf-8-sig", newline=""))
+        rows = METRICS.timed("decode", csv.reader(file))
+        if skip_header:
+            next(rows, None)
+        ahead = read_ahead(rows)
+        # stop the reader thread before the file underneath it is closed
+        stack.callback(ahead.close)
+        yield METRICS.timed("source_wait", ahead)
+
+
+def warm_cache(path):
+    # build the columnar cache of a source ahead of the loads that read it
+    with open_csv_source(path, cache=True) as rows:
+        rows.close()
+
+
+if __name__ == "__main__":
+    import sys
+
+    for source in sys.argv[1:]:
+        warm_cache(source)
+        print(f"Cached {source} in {cache_path(source)}")
@@ -0,0 +1,172 @@
+import json
+import operator
+import re
+from itertools import compress, islice
+from scripts.pipeline.common.metrics import METRICS
+from scripts.pipeline.common.records import Record, put_attributes, to_transact_item
+
+# items checked at a time, each check runs over a whole column of a chunk
+CHUNK_SIZE = 1000
+# dynamodb rejects items larger than 400KB, names and values included
+MAX_ITEM_SIZE = 400 * 1024
+
+NUMBER = re.compile(r"[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?")
+# outward code, any spacing, inward code
+POSTCODE = re.compile(r"[A-Z]{1,2}[0-9][A-Z0-9]? *[0-9][A-Z]{2}")
+
+
+def _value_size(kind, data):
+    if kind == "S":
+        return len(data.encode("utf-8"))
+    if kind == "N":
+        return len(data)
+    if kind == "BOOL":
+        return 1
+    # maps and lists, overestimated by their json encoding
+    return len(json.dumps(data))
+
+
+def _columns(items):
+    # name -> (types, values) for the attributes of a chunk of put items,
+    # with None where an item lacks the attribute. Records of one type are
+    # transposed as they are, anything else through its dynamodb json.
+    first = items[0] if items else None
+    if isinstance(first, Record) and all(type(item) is type(first) for item in items):
+        return {
+            name: ([kind] * len(items), values)
+            for name, kind, values in zip(
+                first.attribute_names, first.attribute_types, zip(*items)
+            )
+        }
+    attributes = [put_attributes(item) for item in items]
+    columns = {}
+    for name in set().union(*attributes):
+        types = []
+        values = []
+        for row in attributes:
+            # {type: value}, or an empty or absent attribute
+            ((kind, value),) = (row.get(name) or {None: None}).items()
+            types.append(kind)
+            values.append(value)
+        columns[name] = (types, values)
+    return columns
+
+
+class RejectLog:
+    # items kept out of the write batches, one json object per line with
+    # the source row, the reasons and the item. The file is only created
+    # once something is rejected.
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        # called with every item rejected, e.g. to keep its key in a manifest
+        self.listeners = []
+        self._file = None
+
+    @classmethod
+    def for_source(cls, file_path, table_name):
+        return cls(f"{file_path}.{table_name}.rejects.jsonl")
+
+    def write(self, row, reasons, item):
+        if self._file is None:
+            self._file = open(self.path, "w")
+        record = {"row": row, "reasons": reasons, "item": to_transact_item(item)}
+        self._file.write(json.dumps(record) + "\n")
+        self.count += 1
+        for listener in self.listeners:
+            listener(item)
+
+    def write_rejected(self, rejected):
+        # the (item, error) pairs dynamodb refused during a write
+        for item, error in rejected:
+            self.write(None, [error], item)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.count:
+            print(f"{self.count} items rejected, see {self.path}")
+
+
+class ItemValidator:
+    # checks transact style put items a chunk at a time, one column after
+    # another: key attributes present and not empty, numeric attributes
+    # valid dynamodb numbers, formatted attributes matching their pattern,
+    # and whole items within the dynamodb size limit
+    def __init__(self, key=(), numeric=(), formats=None, max_item_size=MAX_ITEM_SIZE):
+        self.key = tuple(key)
+        self.numeric = tuple(numeric)
+        self.formats = formats or {}
+        self.max_item_size = max_item_size
+
+    @classmethod
+    def for_schema(cls, schema, formats=None, **options):
+        numeric = [column.name for column in schema.columns if column.type == "N"]
+        return cls(schema.key, numeric, formats, **options)
+
+    def check(self, items):
+        # a list of reasons for every item, empty for the valid ones
+        columns = _columns(items)
+        reasons = [[] for _ in items]
+        absent = ([None] * len(items), [None] * len(items))
+
+        def flag(failed, reason):
+            for position in compress(range(len(items)), failed):
+                reasons[position].append(reason)
+
+        for name in self.key:
+            _, values = columns.get(name, absent)
+            flag(map(operator.not_, values), f"key {name} is missing or empty")
+        for name in self.numeric:
+            # absent attributes are left to the key check
+            types, values = columns.get(name, absent)
+            values = [
+                "0" if kind is None else value if kind == "N" else ""
+                for kind, value in zip(types, values)
+            ]
+            flag(
+                (match is None for match in map(NUMBER.fullmatch, values)),
+                f"{name} is not a number",
+            )
+        for name, pattern in self.formats.items():
+            _, values = columns.get(name, absent)
+            values = [value or "" for value in values]
+            flag(
+                (match is None for match in map(pattern.fullmatch, values)),
+                f"{name} does not match {pattern.pattern}",
+            )
+
+        sizes = [0] * len(items)
+        for name, (types, values) in columns.items():
+            name_size = len(name.encode("utf-8"))
+            sizes = [
+                size + name_size + _value_size(kind, value) if kind is not None else size
+                for size, kind, value in zip(sizes, types, values)
+            ]
+        flag(
+            (size > self.max_item_size for size in sizes),
+            f"item is larger than {self.max_item_size} bytes",
+        )
+        return reasons
+
+    def filter_pairs(self, pairs, rejects):
+        # pass on the (row_offset, item) pairs of valid items, logging the
+        # others to rejects. Row offsets are untouched, so a checkpoint
+        # journal still moves past the rejected rows.
+        pairs = iter(pairs)
+        chunk = list(islice(pairs, CHUNK_SIZE))
+        while chunk:
+            with METRICS.timer("validate"):
+                reasons = self.check([item for _, item in chunk])
+            for (row_offset, item), item_reasons in zip(chunk, reasons):
+                if item_reasons:
+                    rejects.write(row_offset, item_reasons, item)
+                else:
+                    yield row_offset, item
+            chunk = list(islice(pairs, CHUNK_SIZE))
+
+    def filter(self, items, rejects):
+        # valid items only, the reject log numbers items from 1
+        for _, item in self.filter_pairs(enumerate(items, 1), rejects):
+            yield item
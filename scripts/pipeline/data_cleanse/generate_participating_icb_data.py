@@ -1,11 +1,25 @@
-import csv
 import json
 import os
+from scripts.pipeline.common.cli import build_parser, writer_options
+from scripts.pipeline.common.metrics import reporting
+from scripts.pipeline.common.profiling import profiling
+from scripts.pipeline.common.request_files import upload_request_files, write_request_files
+from scripts.pipeline.common.schema import Column, TableSchema
+from scripts.pipeline.common.source import open_csv_source
+
+SCHEMA = TableSchema(
+    [
+        Column("Id", "N", index=0),
+        Column("IcbCode", "S", index=1),
+        Column("Board", "S", index=2),
+    ],
+    key=["IcbCode"],
+)
 
 
 def generate_participating_icb_json(file_path, table_name):
-    with open(file_path, "r", encoding="utf-8-sig") as file:
-        csvreader = csv.reader(file)
+    # file_path is read like the --request-dir source, skipping its header row
+    with open_csv_source(file_path) as csvreader:
         dynamodb_json_object = format_dynamodb_json(csvreader)
 
     json_file = {table_name: dynamodb_json_object}
@@ -18,33 +32,53 @@ def generate_participating_icb_json(file_path, table_name):
         outfile.write(json_object)
 
 
-def format_dynamodb_json(csvreader):
-    output = []
+def generate_participating_icb_requests(file_path, directory, table_name):
+    # stream the icbs of file_path into a directory of 25 request batch
+    # write files and their manifest, see common/request_files.py.
+    # file_path is a csv file, a zip archive holding one, or "archive.zip:member.csv".
+    with open_csv_source(file_path) as csvreader:
+        manifest = write_request_files(
+            SCHEMA.converter(request="PutRequest")(csvreader), directory, table_name
+        )
+    print(f"{manifest['items']} requests written to {len(manifest['files'])} files in {directory}")
+    return manifest
 
+
+def format_dynamodb_json(csvreader):
     # extract relevant information from row and format
     # in dynamodb json
-    for row in csvreader:
-        Id = str(row[0])
-        IcbCode = str(row[1])
-        Board = str(row[2])
-        output.append(
-            {
-                "PutRequest": {
-                    "Item": {
-                        "Id": {"N": f"{Id}"},
-                        "IcbCode": {"S": f"{IcbCode}"},
-                        "Board": {"S": f"{Board}"},
-                    }
-                }
-            }
-        )
-    return output
+    return list(SCHEMA.converter(request="PutRequest")(csvreader))
 
 
 ENVIRONMENT = os.getenv("environment")
 
 if __name__ == "__main__":
-    # read in data and generate the json output
-    file_input_path = "/test-data/Participating_ICBs.csv"
-    path_to_file = os.getcwd() + file_input_path
-    generate_participating_icb_json(path_to_file, ENVIRONMENT + "-ParticipatingIcb")
+    parser = build_parser("Generate, or upload, the ParticipatingIcb table's batch write requests")
+    parser.add_argument(
+        "--source",
+        default=os.getcwd() + "/test-data/Participating_ICBs.csv",
+        help="participating icbs csv file, or zip archive containing it",
+    )
+    parser.add_argument(
+        "--request-dir",
+        help="write 25 request batch write files and a manifest to this directory "
+        "instead of one participating_icb.json",
+    )
+    parser.add_argument(
+        "--upload",
+        metavar="DIR",
+        help="upload a directory written by --request-dir, --workers files at a time",
+    )
+    parser.set_defaults(workers=8)
+    args = parser.parse_args()
+    table_name = ENVIRONMENT + "-ParticipatingIcb"
+    if args.upload:
+        with reporting(args.metrics_file, args.progress_interval), profiling(args.profile):
+            upload_request_files(
+                args.upload, environment=ENVIRONMENT, **writer_options(args, table_name)
+            )
+    elif args.request_dir:
+        generate_participating_icb_requests(args.source, args.request_dir, table_name)
+    else:
+        # read in data and generate the json output
+        generate_participating_icb_json(args.source, table_name)
@@ -1,139 +1,224 @@
-import csv
+import functools
 import os
-import boto3
-import uuid
-import rstr
 import random
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from scripts.pipeline.common.bulk_writer import write_items
+from scripts.pipeline.common.checkpoint import checkpointed_load
+from scripts.pipeline.common.cli import (
+    add_checkpoint_arguments,
+    build_parser,
+    writer_options,
+)
+from scripts.pipeline.common.dedupe import Deduplicator
+from scripts.pipeline.common.id_generator import (
+    NHS_LETTERS,
+    PARTICIPANT_ID_TEMPLATE,
+    IdGenerator,
+)
+from scripts.pipeline.common.metrics import reporting
+from scripts.pipeline.common.parallel import DEFAULT_PROCESSES, new_process_pool
+from scripts.pipeline.common.profiling import profiling
+from scripts.pipeline.common.schema import Column, TableSchema
+from scripts.pipeline.common.source import open_csv_source
+from scripts.pipeline.common.validation import ItemValidator, RejectLog
 
 ENVIRONMENT = os.getenv("environment")
 
-def generate_nonprod_population_json(file_path, table_name):
-    with open(file_path, "r", encoding="utf-8-sig") as file:
-        csvreader = csv.reader(file)
-        dynamodb_json_object = format_dynamodb_json(csvreader, table_name)
-
-    batch_write_to_dynamodb(dynamodb_json_object)
-
-
-def format_dynamodb_json(csvreader, table_name):
-    output = []
-    # extract relevant information from row and format
-    # in dynamodb json
-    for row in csvreader:
-        if len(row) == 26:
-            nhs_number = str(row[0])
-            superseded_by_subject_id = str(row[1])
-            primary_care_provider = str(row[2])
-            name_prefix = str(row[3])
-            first_given_name = str(row[4])
-            other_given_names = str(row[5])
-            family_name = str(row[6])
-            date_of_birth = str(row[7])
-            gender_code = str(row[8])
-            address_line_1 = str(row[9])
-            address_line_2 = str(row[10])
-            address_line_3 = str(row[11])
-            address_line_4 = str(row[12])
-            address_line_5 = str(row[13])
-            postcode = str(row[14])
-            removal_reason = str(row[15])
-            removal_date = str(row[16])
-            date_of_death = str(row[17])
-            telephone_number_home = str(row[18])
-            telephone_number_mobile = str(row[19])
-            email_address_home = str(row[20])
-            preferred_language = str(row[21])
-            interpreter_required = str(row[22])
-            sensitivity_indicator_flag = str(row[23])
-            Invited = str(row[24])
-            lsoa_2011 = str(row[25])
-            participant_id_rand_exp = rstr.xeger(r'NHS-[A-HJ-NP-Z][A-HJ-NP-Z][0-9][0-9]-[A-HJ-NP-Z][A-HJ-NP-Z][0-9][0-9]')
-            gp_practice_code = "GP-CODE-" + str(random.randint(1, 5000))
-
-            if nhs_number and lsoa_2011:
-                output.append(
-                    {
-                        "Put": {
-                            "Item": {
-                                "PersonId": { "S": f'{str(participant_id_rand_exp)}' },
-                                "primary_care_provider": { "S": f"{primary_care_provider}"},
-                                "name_prefix": {"S": f"{name_prefix}"},
-                                "given_name": {"S": f"{first_given_name}"},
-                                "other_given_names": {"S": f"{other_given_names}"},
-                                "family_name": {"S": f"{family_name}"},
-                                "date_of_birth": {"S": f"{date_of_birth}"},
-                                "address_line_1": {"S": f"{address_line_1}"},
-                                "address_line_2": {"S": f"{address_line_2}"},
-                                "address_line_3": {"S": f"{address_line_3}"},
-                                "address_line_4": {"S": f"{address_line_4}"},
-                                "address_line_5": {"S": f"{address_line_5}"},
-                                "postcode": {"S": f"{postcode}"},
-                                "nhs_number": {"N": f"{nhs_number}"},
-                                "superseded_by_nhs_number": {"N": "0"},
-                                "preferred_language": {"S": f"{preferred_language}"},
-                                "gender": { 'N': f'{gender_code}'},
-                                'reason_for_removal': { 'S': f'{removal_reason}'},
-                                'reason_for_removal_effective_from_date': {'S': f'{removal_date}'},
-                                'date_of_death': { 'S': f'{date_of_death}'},
-                                'telephone_number': { 'S': f'{telephone_number_home}'},
-                                'mobile_number': { 'S': f'{telephone_number_mobile}'},
-                                'email_address': {'S': f'{email_address_home}'},
-                                'is_interpreter_required': {'S': f'{interpreter_required}'},
-                                'Invited': {
-                                    'S': f'{Invited}'
-                                },
-                                'LsoaCode': {
-                                    'S': f'{lsoa_2011}'
-                                },
-                                'identified_to_be_invited': {
-                                    'BOOL': False
-                                },
-                                'participantId': {
-                                    'S': f'{str(participant_id_rand_exp)}'
-                                },
-                                'gp_connect': {'S': f'{gp_practice_code}'},
-                                'responsible_icb': {'S': f"{postcode}"},
-
-                                'action': {'S': f'{sensitivity_indicator_flag}'},
-                            },
-                            "TableName": table_name,
-                        },
-                    }
-                )
-    return output
-
-
-def batch_write_to_dynamodb(lsoa_data):
-    # splice array 100 records at a time
-    # format and send these to the batch write function
-    # repeat till no records are left
-    dynamodb_client = boto3.client("dynamodb")
-    for i in range(1, 100000, 100):
-        upper_bound_slice = i + 100
-        test_data = lsoa_data[i:upper_bound_slice]
-        dynamodb_client.transact_write_items(TransactItems=test_data)
-        if i%10000 == 0:
-            print(f"{i} records uploaded")
-    return "Finished"
+# number of participants uploaded from each file
+RECORD_LIMIT = 100000
+
+# participant ids are derived from the row index with a fixed seed, so a
+# rerun or a resumed load gives every participant the same id again.
+# Set ID_SEED to generate a different set of ids.
+PARTICIPANT_IDS = IdGenerator(
+    PARTICIPANT_ID_TEMPLATE, letters=NHS_LETTERS, seed=os.getenv("ID_SEED", "population")
+)
+
+
+def generate_participant_id(row, index):
+    return PARTICIPANT_IDS.id_at(index)
+
+
+def generate_gp_practice_code(row, index):
+    return "GP-CODE-" + str(random.randint(1, 5000))
+
+
+def has_nhs_number_and_lsoa(row):
+    return len(row) == 26 and str(row[0]) and str(row[25])
+
+
+# superseded_by_subject_id (column 1) is not loaded. responsible_icb is
+# populated from the postcode column, the source data has no icb column.
+SCHEMA = TableSchema(
+    [
+        Column("PersonId", "S", derived="participant_id"),
+        Column("primary_care_provider", "S", index=2),
+        Column("name_prefix", "S", index=3),
+        Column("given_name", "S", index=4),
+        Column("other_given_names", "S", index=5),
+        Column("family_name", "S", index=6),
+        Column("date_of_birth", "S", index=7),
+        Column("address_line_1", "S", index=9),
+        Column("address_line_2", "S", index=10),
+        Column("address_line_3", "S", index=11),
+        Column("address_line_4", "S", index=12),
+        Column("address_line_5", "S", index=13),
+        Column("postcode", "S", index=14),
+        Column("nhs_number", "N", index=0),
+        Column("superseded_by_nhs_number", "N", value="0"),
+        Column("preferred_language", "S", index=21),
+        Column("gender", "N", index=8),
+        Column("reason_for_removal", "S", index=15),
+        Column("reason_for_removal_effective_from_date", "S", index=16),
+        Column("date_of_death", "S", index=17),
+        Column("telephone_number", "S", index=18),
+        Column("mobile_number", "S", index=19),
+        Column("email_address", "S", index=20),
+        Column("is_interpreter_required", "S", index=22),
+        Column("Invited", "S", index=24),
+        Column("LsoaCode", "S", index=25),
+        Column("identified_to_be_invited", "BOOL", value=False),
+        Column("participantId", "S", derived="participant_id"),
+        Column("gp_connect", "S", derived="gp_practice_code"),
+        Column("responsible_icb", "S", index=14),
+        Column("action", "S", index=23),
+    ],
+    key=["PersonId"],
+    derived={
+        "participant_id": generate_participant_id,
+        "gp_practice_code": generate_gp_practice_code,
+    },
+    row_filter=has_nhs_number_and_lsoa,
+)
+
+VALIDATOR = ItemValidator.for_schema(SCHEMA)
+
+
+def generate_nonprod_population_json(
+    file_path, table_name, id_base=0, resume=True, **options
+):
+    # participant ids are taken from index id_base + row offset, files
+    # loaded together need id_base values at least RECORD_LIMIT apart.
+    # file_path is a csv file, a zip archive holding one, or "archive.zip:member.csv".
+    # Invalid items are logged to a rejects file instead of being written,
+    # a PersonId repeated in the file is written once with its last row.
+    rejects = RejectLog.for_source(file_path, table_name)
+    deduplicator = Deduplicator()
+
+    def validate(pairs):
+        return deduplicator.filter_pairs(VALIDATOR.filter_pairs(pairs, rejects))
+
+    with open_csv_source(file_path) as csvreader:
+        try:
+            result = checkpointed_load(
+                file_path,
+                table_name,
+                islice(csvreader, RECORD_LIMIT),
+                functools.partial(iter_records, table_name=table_name, id_base=id_base),
+                batch_write_to_dynamodb,
+                resume=resume,
+                validate=validate,
+                **options,
+            )
+            rejects.write_rejected(result.rejected)
+            print(deduplicator)
+            return result
+        finally:
+            rejects.close()
+
+
+def format_dynamodb_json(csvreader, table_name, start=0, id_base=0):
+    return list(iter_dynamodb_json(csvreader, table_name, start, id_base))
+
+
+def iter_dynamodb_json(csvreader, table_name, start=0, id_base=0, offsets=False):
+    # format rows in dynamodb json, one row at a time
+    converter = SCHEMA.converter(table_name, offsets=offsets)
+    if offsets:
+        return converter(csvreader, id_base + start, start)
+    return converter(csvreader, id_base + start)
+
+
+def format_records(csvreader, table_name, start=0, id_base=0):
+    return list(iter_records(csvreader, table_name, start, id_base))
+
+
+def iter_records(csvreader, table_name, start=0, id_base=0, offsets=False):
+    # compact records, expanded into dynamodb json as they are written,
+    # paired with their row offsets when offsets is set
+    converter = SCHEMA.converter(table_name, request="Record", offsets=offsets)
+    if offsets:
+        return converter(csvreader, id_base + start, start)
+    return converter(csvreader, id_base + start)
+
+
+def batch_write_to_dynamodb(population_data, **options):
+    result = write_items(population_data, **options)
+    print(f"{result.succeeded} records uploaded, {result.failed} failed")
+    return result
+
+
+def upload_population(male_file, female_file, table_name, processes=1, **options):
+    # the male and female files are uploaded at the same time, sharing
+    # one pool of formatting processes, taking participant ids from
+    # disjoint ranges.
+    executor = new_process_pool(processes) if processes > 1 else None
+    try:
+        with ThreadPoolExecutor(2) as uploads:
+            print("Initiation male and female upload")
+            male_upload = uploads.submit(
+                generate_nonprod_population_json,
+                male_file,
+                table_name,
+                id_base=0,
+                executor=executor,
+                **options,
+            )
+            female_upload = uploads.submit(
+                generate_nonprod_population_json,
+                female_file,
+                table_name,
+                id_base=RECORD_LIMIT,
+                executor=executor,
+                **options,
+            )
+            male_result = male_upload.result()
+            print("Male upload complete")
+            female_result = female_upload.result()
+            print("Female upload complete")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    male_result.merge(female_result)
+    return male_result
 
 
 if __name__ == "__main__":
-    # read in data and generate the json output
-    # Reading in CSV files
-    file_input_path_1 = (
-        "/nonprod-population-data/male_participants_with_LSOA_Invited.csv"
+    parser = add_checkpoint_arguments(build_parser("Seed the Population table"))
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=DEFAULT_PROCESSES,
+        help="number of worker processes formatting rows, 1 formats on the main process",
     )
-    file_input_path_2 = (
-        "/nonprod-population-data/female_participants_with_LSOA_Invited.csv"
+    parser.add_argument(
+        "--male-source",
+        default=os.getcwd() + "/nonprod-population-data/male_participants_with_LSOA_Invited.csv",
+        help="male participants csv file, or zip archive containing it",
     )
-    print("Read in both CSV files")
-
-    male_file = os.getcwd() + file_input_path_1
-    female_file = os.getcwd() + file_input_path_2
+    parser.add_argument(
+        "--female-source",
+        default=os.getcwd() + "/nonprod-population-data/female_participants_with_LSOA_Invited.csv",
+        help="female participants csv file, or zip archive containing it",
+    )
+    args = parser.parse_args()
+    table_name = ENVIRONMENT + "-Population"
+    # both uploads share one rate limiter
+    options = writer_options(args, table_name)
+    options["resume"] = not args.no_resume
 
-    print("Initiation male upload")
-    generate_nonprod_population_json(male_file, ENVIRONMENT + "-Population")
-    print("Male upload complete")
-    print("Initiation female upload")
-    generate_nonprod_population_json(female_file, ENVIRONMENT + "-Population")
-    print("Female upload complete")
+    with reporting(args.metrics_file, args.progress_interval), profiling(args.profile):
+        upload_population(
+            args.male_source, args.female_source, table_name, args.processes, **options
+        )
@@ -1,89 +1,153 @@
-import csv
+import functools
 import os
-import boto3
+from scripts.pipeline.common.bulk_writer import new_client, write_items
+from scripts.pipeline.common.checkpoint import checkpointed_load
+from scripts.pipeline.common.cli import (
+    add_checkpoint_arguments,
+    add_incremental_arguments,
+    build_parser,
+    writer_options,
+)
+from scripts.pipeline.common.dedupe import Deduplicator
+from scripts.pipeline.common.manifest import Manifest, incremental_write
+from scripts.pipeline.common.metrics import METRICS, reporting
+from scripts.pipeline.common.profiling import profiling
+from scripts.pipeline.common.schema import Column, TableSchema
+from scripts.pipeline.common.source import open_csv_source
+from scripts.pipeline.common.validation import POSTCODE, ItemValidator, RejectLog
 
 ENVIRONMENT = os.getenv("environment")
 
-def generate_nonprod_lsoa_json(file_path, table_name):
-    with open(file_path, "r", encoding="utf-8-sig") as file:
-        csvreader = csv.reader(file)
-        dynamodb_json_object = format_dynamodb_json(csvreader, table_name)
-
-    batch_write_to_dynamodb(dynamodb_json_object)
-
-
-def format_dynamodb_json(csvreader, table_name):
-    output = []
-    # extract relevant information from row and format
-    # in dynamodb json
-    for row in csvreader:
-        POSTCODE = str(row[0])
-        POSTCODE_2 = str(row[1])
-        LOCAL_AUT_ORG = str(row[2])
-        NHS_ENG_REGION = str(row[3])
-        SUB_ICB = str(row[4])
-        CANCER_REGISTRY = str(row[5])
-        EASTING_1M = str(row[6])
-        NORTHING_1M = str(row[7])
-        LSOA_2011 = str(row[8])
-        MSOA_2011 = str(row[9])
-        CANCER_ALLIANCE = str(row[10])
-        ICB = str(row[11])
-        OA_2021 = str(row[12])
-        LSOA_2021 = str(row[13])
-        MSOA_2021 = str(row[14])
-        IMD_RANK = str(row[15])
-        IMD_DECILE = str(row[16])
-        LSOA_NAME = str(row[17])
-        AVG_EASTING = str(row[18])
-        AVG_NORTHING = str(row[19])
-        output.append(
-            {
-                "Put": {
-                    "Item": {
-                        "POSTCODE": {"S": f"{POSTCODE_2}"},
-                        "POSTCODE_2": {"S": f"{POSTCODE}"},
-                        "LOCAL_AUT_ORG": {"S": f"{LOCAL_AUT_ORG}"},
-                        "NHS_ENG_REGION": {"S": f"{NHS_ENG_REGION}"},
-                        "SUB_ICB": {"S": f"{SUB_ICB}"},
-                        "CANCER_REGISTRY": {"S": f"{CANCER_REGISTRY}"},
-                        "EASTING_1M": {"N": f"{EASTING_1M}"},
-                        "NORTHING_1M": {"N": f"{NORTHING_1M}"},
-                        "LSOA_2011": {"S": f"{LSOA_2011}"},
-                        "MSOA_2011": {"S": f"{MSOA_2011}"},
-                        "CANCER_ALLIANCE": {"S": f"{CANCER_ALLIANCE}"},
-                        "ICB": {"S": f"{ICB}"},
-                        "OA_2021": {"S": f"{OA_2021}"},
-                        "LSOA_2021": {"S": f"{LSOA_2021}"},
-                        "MSOA_2021": {"S": f"{MSOA_2021}"},
-                        "IMD_RANK": {"N": f"{IMD_RANK}"},
-                        "IMD_DECILE": {"N": f"{IMD_DECILE}"},
-                        "LSOA_NAME": {"S": f"{LSOA_NAME}"},
-                        "AVG_LSOA_EASTING": {"N": f"{AVG_EASTING}"},
-                        "AVG_LSOA_NORTHING": {"N": f"{AVG_NORTHING}"},
-                    },
-                    "TableName": table_name,
-                },
-            }
-        )
-    return output
+# the first two csv columns are swapped into POSTCODE and POSTCODE_2
+SCHEMA = TableSchema(
+    [
+        Column("POSTCODE", "S", index=1),
+        Column("POSTCODE_2", "S", index=0),
+        Column("LOCAL_AUT_ORG", "S", index=2),
+        Column("NHS_ENG_REGION", "S", index=3),
+        Column("SUB_ICB", "S", index=4),
+        Column("CANCER_REGISTRY", "S", index=5),
+        Column("EASTING_1M", "N", index=6),
+        Column("NORTHING_1M", "N", index=7),
+        Column("LSOA_2011", "S", index=8),
+        Column("MSOA_2011", "S", index=9),
+        Column("CANCER_ALLIANCE", "S", index=10),
+        Column("ICB", "S", index=11),
+        Column("OA_2021", "S", index=12),
+        Column("LSOA_2021", "S", index=13),
+        Column("MSOA_2021", "S", index=14),
+        Column("IMD_RANK", "N", index=15),
+        Column("IMD_DECILE", "N", index=16),
+        Column("LSOA_NAME", "S", index=17),
+        Column("AVG_LSOA_EASTING", "N", index=18),
+        Column("AVG_LSOA_NORTHING", "N", index=19),
+    ],
+    key=["POSTCODE"],
+)
+
+VALIDATOR = ItemValidator.for_schema(SCHEMA, formats={"POSTCODE": POSTCODE})
+
+# the full postcode file has about 815k rows. Their keys are held exactly
+# when the machine has the memory for them, in a bloom filter otherwise.
+EXPECTED_ROWS = 1000000
+
+
+def generate_nonprod_lsoa_json(
+    file_path, table_name, resume=True, incremental=False, **options
+):
+    # file_path is a csv file, a zip archive holding one, or "archive.zip:member.csv".
+    # An incremental load only writes the difference from the last one.
+    # Invalid items are logged to a rejects file instead of being written,
+    # a postcode repeated in the file is written once with its last row.
+    rejects = RejectLog.for_source(file_path, table_name)
+    deduplicator = Deduplicator(expected_items=EXPECTED_ROWS)
+
+    def validate(pairs):
+        return deduplicator.filter_pairs(VALIDATOR.filter_pairs(pairs, rejects))
+
+    with open_csv_source(file_path) as csvreader:
+        try:
+            if incremental:
+                result = incremental_write(
+                    Manifest.for_table(
+                        file_path, table_name, SCHEMA.key, options.get("client") or new_client()
+                    ),
+                    deduplicator.filter(
+                        VALIDATOR.filter(
+                            METRICS.timed("format", iter_records(csvreader, table_name)),
+                            rejects,
+                        )
+                    ),
+                    table_name,
+                    batch_write_to_dynamodb,
+                    rejects=rejects,
+                    **options,
+                )
+            else:
+                result = checkpointed_load(
+                    file_path,
+                    table_name,
+                    csvreader,
+                    functools.partial(iter_records, table_name=table_name),
+                    batch_write_to_dynamodb,
+                    resume=resume,
+                    validate=validate,
+                    **options,
+                )
+            rejects.write_rejected(result.rejected)
+            print(deduplicator)
+            return result
+        finally:
+            rejects.close()
+
+
+def format_dynamodb_json(csvreader, table_name, start=0):
+    return list(iter_dynamodb_json(csvreader, table_name, start))
 
 
-def batch_write_to_dynamodb(lsoa_data):
-    # splice array 100 records at a time
-    # format and send these to the batch write function
-    # repeat till no records left
-    dynamodb_client = boto3.client("dynamodb")
-    for i in range(1, 815651, 100):
-        upper_bound_slice = i + 100
-        test_data = lsoa_data[i:upper_bound_slice]
-        dynamodb_client.transact_write_items(TransactItems=test_data)
-    return "Finished"
+def iter_dynamodb_json(csvreader, table_name, start=0, offsets=False):
+    # format rows in dynamodb json, one row at a time
+    converter = SCHEMA.converter(table_name, offsets=offsets)
+    return converter(csvreader, start, start) if offsets else converter(csvreader, start)
+
+
+def format_records(csvreader, table_name, start=0):
+    return list(iter_records(csvreader, table_name, start))
+
+
+def iter_records(csvreader, table_name, start=0, offsets=False):
+    # compact records, expanded into dynamodb json as they are written,
+    # paired with their row offsets when offsets is set
+    converter = SCHEMA.converter(table_name, request="Record", offsets=offsets)
+    return converter(csvreader, start, start) if offsets else converter(csvreader, start)
+
+
+def batch_write_to_dynamodb(lsoa_data, **options):
+    # records are streamed to the bulk writer, which sends them
+    # in batches as they become available
+    result = write_items(lsoa_data, **options)
+    print(f"{result.succeeded} records uploaded, {result.failed} failed")
+    return result
 
 
 if __name__ == "__main__":
+    parser = add_incremental_arguments(
+        add_checkpoint_arguments(build_parser("Seed the Postcode table"))
+    )
+    parser.add_argument(
+        "--source",
+        default=os.getcwd() + "/nonprod-postcode-load/lsoa_with_avg_easting_northing.csv",
+        help="postcode csv file, or zip archive containing it",
+    )
+    args = parser.parse_args()
     # read in data and generate the json output
-    file_input_path = "/nonprod-postcode-load/lsoa_with_avg_easting_northing.csv"
-
-    path_to_file = os.getcwd() + file_input_path
-    generate_nonprod_lsoa_json(path_to_file, ENVIRONMENT + "-Postcode")
+    path_to_file = args.source
+    table_name = ENVIRONMENT + "-Postcode"
+    with reporting(args.metrics_file, args.progress_interval), profiling(args.profile):
+        generate_nonprod_lsoa_json(
+            path_to_file,
+            table_name,
+            resume=not args.no_resume,
+            incremental=args.incremental,
+            **writer_options(args, table_name),
+        )
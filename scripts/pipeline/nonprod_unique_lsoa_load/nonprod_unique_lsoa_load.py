@@ -1,87 +1,110 @@
-import csv
 import os
-import boto3
-from random import randrange
+from scripts.pipeline.common.bulk_writer import new_client, write_items
+from scripts.pipeline.common.cli import (
+    add_incremental_arguments,
+    build_parser,
+    writer_options,
+)
+from scripts.pipeline.common.dedupe import Deduplicator
+from scripts.pipeline.common.manifest import Manifest, incremental_write
+from scripts.pipeline.common.metrics import METRICS, reporting
+from scripts.pipeline.common.profiling import profiling
+from scripts.pipeline.common.schema import Column, TableSchema
+from scripts.pipeline.common.source import open_csv_source
+from scripts.pipeline.common.validation import ItemValidator, RejectLog
 
 ENVIRONMENT = os.getenv("environment")
 
+SCHEMA = TableSchema(
+    [
+        Column("LOCAL_AUT_ORG", "S", index=0),
+        Column("NHS_ENG_REGION", "S", index=1),
+        Column("SUB_ICB", "S", index=2),
+        Column("CANCER_REGISTRY", "S", index=3),
+        Column("LSOA_2011", "S", index=4),
+        Column("MSOA_2011", "S", index=5),
+        Column("CANCER_ALLIANCE", "S", index=6),
+        Column("ICB", "S", index=7),
+        Column("OA_2021", "S", index=8),
+        Column("LSOA_2021", "S", index=9),
+        Column("MSOA_2021", "S", index=10),
+        Column("IMD_RANK", "N", index=11),
+        Column("IMD_DECILE", "N", index=12),
+        Column("LSOA_NAME", "S", index=13),
+        Column("AVG_EASTING", "S", index=14),
+        Column("AVG_NORTHING", "S", index=15),
+        Column("MODERATOR", "S", index=16),
+    ],
+    key=["LSOA_2011", "IMD_RANK"],
+)
 
-def generate_nonprod_lsoa_json(file_path, table_name):
-    with open(file_path, "r", encoding="utf-8-sig") as file:
-        csvreader = csv.reader(file)
-        dynamodb_json_object = format_dynamodb_json(csvreader, table_name)
+VALIDATOR = ItemValidator.for_schema(SCHEMA)
 
-    batch_write_to_dynamodb(dynamodb_json_object)
+
+def generate_nonprod_lsoa_json(file_path, table_name, incremental=False, **options):
+    # file_path is a csv file, a zip archive holding one, or "archive.zip:member.csv".
+    # An incremental load only writes the difference from the last one.
+    # Invalid items are logged to a rejects file instead of being written,
+    # a key repeated in the file is written once with its last row.
+    rejects = RejectLog.for_source(file_path, table_name)
+    deduplicator = Deduplicator()
+    with open_csv_source(file_path) as csvreader:
+        items = deduplicator.filter(
+            VALIDATOR.filter(
+                METRICS.timed("format", SCHEMA.converter(table_name, request="Record")(csvreader)),
+                rejects,
+            )
+        )
+        try:
+            if incremental:
+                result = incremental_write(
+                    Manifest.for_table(
+                        file_path, table_name, SCHEMA.key, options.get("client") or new_client()
+                    ),
+                    items,
+                    table_name,
+                    batch_write_to_dynamodb,
+                    rejects=rejects,
+                    **options,
+                )
+            else:
+                result = batch_write_to_dynamodb(items, **options)
+            rejects.write_rejected(result.rejected)
+            print(deduplicator)
+            return result
+        finally:
+            rejects.close()
 
 
 def format_dynamodb_json(csvreader, table_name):
-    output = []
     # extract relevant information from row and format
     # in dynamodb json
-    for row in csvreader:
-        LOCAL_AUT_ORG = str(row[0])
-        NHS_ENG_REGION = str(row[1])
-        SUB_ICB = str(row[2])
-        CANCER_REGISTRY = str(row[3])
-        LSOA_2011 = str(row[4])
-        MSOA_2011 = str(row[5])
-        CANCER_ALLIANCE = str(row[6])
-        ICB = str(row[7])
-        OA_2021 = str(row[8])
-        LSOA_2021 = str(row[9])
-        MSOA_2021 = str(row[10])
-        IMD_RANK = str(row[11])
-        IMD_DECILE = str(row[12])
-        LSOA_NAME = str(row[13])
-        AVG_EASTING = str(row[14])
-        AVG_NORTHING = str(row[15])
-        MODERATOR = str(row[16])
-        output.append(
-            {
-                "Put": {
-                    "Item": {
-                        "LOCAL_AUT_ORG": {"S": f"{LOCAL_AUT_ORG}"},
-                        "NHS_ENG_REGION": {"S": f"{NHS_ENG_REGION}"},
-                        "SUB_ICB": {"S": f"{SUB_ICB}"},
-                        "CANCER_REGISTRY": {"S": f"{CANCER_REGISTRY}"},
-                        "LSOA_2011": {"S": f"{LSOA_2011}"},
-                        "MSOA_2011": {"S": f"{MSOA_2011}"},
-                        "CANCER_ALLIANCE": {"S": f"{CANCER_ALLIANCE}"},
-                        "ICB": {"S": f"{ICB}"},
-                        "OA_2021": {"S": f"{OA_2021}"},
-                        "LSOA_2021": {"S": f"{LSOA_2021}"},
-                        "MSOA_2021": {"S": f"{MSOA_2021}"},
-                        "IMD_RANK": {"N": f"{IMD_RANK}"},
-                        "IMD_DECILE": {"N": f"{IMD_DECILE}"},
-                        "LSOA_NAME": {"S": f"{LSOA_NAME}"},
-                        "AVG_EASTING": {"S": f"{AVG_EASTING}"},
-                        "AVG_NORTHING": {"S": f"{AVG_NORTHING}"},
-                        "MODERATOR": {"S": f"{MODERATOR}"},
-                    },
-                    "TableName": table_name,
-                },
-            }
-        )
-    return output
+    return list(SCHEMA.converter(table_name)(csvreader))
 
 
-def batch_write_to_dynamodb(lsoa_data):
-    # splice array 100 records at a time
-    # format and send these to the batch write function
-    # repeat till no records left
-    dynamodb_client = boto3.client("dynamodb")
-    for i in range(1, len(lsoa_data), 100):
-        upper_bound_slice = i + 100
-        test_data = lsoa_data[i:upper_bound_slice]
-        dynamodb_client.transact_write_items(TransactItems=test_data)
-    return "Finished"
+def batch_write_to_dynamodb(lsoa_data, **options):
+    result = write_items(lsoa_data, **options)
+    print(f"{result.succeeded} records uploaded, {result.failed} failed")
+    return result
 
 
 if __name__ == "__main__":
+    parser = add_incremental_arguments(build_parser("Seed the UniqueLsoa table"))
+    parser.add_argument(
+        "--source",
+        default=os.getcwd() + "/nonprod-unique-lsoa-data/unique_lsoa_data.csv",
+        help="unique lsoa csv file, or zip archive containing it",
+    )
+    args = parser.parse_args()
     # read in data and generate the json output
-    file_input_path = "/nonprod-unique-lsoa-data/unique_lsoa_data.csv"
-
     print(f"{ENVIRONMENT}-UniqueLsoa")
 
-    path_to_file = os.getcwd() + file_input_path
-    generate_nonprod_lsoa_json(path_to_file, f"{ENVIRONMENT}-UniqueLsoa")
+    path_to_file = args.source
+    table_name = f"{ENVIRONMENT}-UniqueLsoa"
+    with reporting(args.metrics_file, args.progress_interval), profiling(args.profile):
+        generate_nonprod_lsoa_json(
+            path_to_file,
+            table_name,
+            incremental=args.incremental,
+            **writer_options(args, table_name),
+        )
@@ -0,0 +1,257 @@
+import os
+import time
+from scripts.common.dag import FAILED, SKIPPED, run_graph
+from scripts.pipeline.common.bulk_writer import new_client, write_items
+from scripts.pipeline.common.cli import (
+    add_checkpoint_arguments,
+    add_incremental_arguments,
+    build_parser,
+    writer_options,
+)
+from scripts.pipeline.common.metrics import reporting
+from scripts.pipeline.common.parallel import DEFAULT_PROCESSES
+from scripts.pipeline.common.profiling import profiling
+from scripts.pipeline.common.request_files import read_request_file
+from scripts.pipeline.nonprod_phlebotomy_site_load.nonprod_phlebotomy_site_load import (
+    generate_nonprod_data,
+)
+from scripts.pipeline.nonprod_population_load.nonprod_population_load import (
+    upload_population,
+)
+from scripts.pipeline.nonprod_postcode_load.nonprod_postcode_load import (
+    generate_nonprod_lsoa_json as generate_nonprod_postcode_json,
+)
+from scripts.pipeline.nonprod_unique_lsoa_load.nonprod_unique_lsoa_load import (
+    generate_nonprod_lsoa_json,
+)
+
+TEST_DATA = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "test_data",
+)
+FIXTURES = os.path.join(TEST_DATA, "destructible_environments")
+
+# environment types that get curated fixture data on top of the seeds
+DESTRUCTIBLE_ENVIRONMENT_TYPES = ("dev", "nft")
+
+# outcomes of a seed, besides FAILED and SKIPPED
+SEEDED = "seeded"
+POPULATED = "already populated"
+
+
+class Seed:
+    # one table's seed. `prepare` always runs, `load` only runs while the
+    # table holds fewer than `threshold` items, or every time for a seed
+    # that refreshes the table. A seed starts once every seed in depends_on
+    # has finished without failing.
+    def __init__(
+        self, name, table_name, threshold, load, depends_on=(), prepare=None, refresh=False
+    ):
+        self.name = name
+        self.table_name = table_name
+        self.threshold = threshold
+        self.load = load
+        self.depends_on = tuple(depends_on)
+        self.prepare = prepare
+        self.refresh = refresh
+
+
+def count_up_to(client, table_name, limit):
+    # count items until `limit` is reached, rather than scanning the whole
+    # table. DescribeTable's ItemCount is only refreshed every few hours,
+    # so it cannot see a seed that has just run.
+    count = 0
+    options = {"TableName": table_name, "Select": "COUNT"}
+    while count < limit:
+        response = client.scan(Limit=limit - count, **options)
+        count += response["Count"]
+        if "LastEvaluatedKey" not in response:
+            break
+        options["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+    return count
+
+
+def is_populated(client, table_name, threshold):
+    return count_up_to(client, table_name, threshold) >= threshold
+
+
+def read_fixture(path, environment):
+    # batch write request files name their tables ENVIRONMENT-<Table>
+    return read_request_file(path, environment)
+
+
+def write_fixtures(paths, environment, **options):
+    def items():
+        for path in paths:
+            yield from read_fixture(path, environment)
+
+    result = write_items(items(), **options)
+    print(f"{result.succeeded} fixture records uploaded from {len(paths)} files")
+    return result
+
+
+def build_seeds(environment, environment_type, args):
+    # the five seeds, Population rows refer to LSOAs and phlebotomy
+    # sites to participating ICBs, so those are seeded first
+    def options(table_name):
+        options = writer_options(args, table_name)
+        if options["workers"] <= 1:
+            # seeds run on several threads, each needs a client of its own
+            options["client"] = new_client()
+        return options
+
+    def checkpointed(table_name):
+        return dict(options(table_name), resume=not args.no_resume)
+
+    destructible = environment_type in DESTRUCTIBLE_ENVIRONMENT_TYPES
+
+    def fixtures(*names, then=None):
+        # fixture files only go into destructible environments
+        if not destructible:
+            return then
+
+        def prepare():
+            paths = [os.path.join(FIXTURES, name) for name in names]
+            write_fixtures(paths, environment, **options(None))
+            if then is not None:
+                then()
+
+        return prepare
+
+    icb_table = f"{environment}-ParticipatingIcb"
+    lsoa_table = f"{environment}-UniqueLsoa"
+    phlebotomy_table = f"{environment}-PhlebotomySite"
+    postcode_table = f"{environment}-Postcode"
+    population_table = f"{environment}-Population"
+
+    return [
+        Seed(
+            "icb",
+            icb_table,
+            23,
+            lambda: write_fixtures(
+                [os.path.join(TEST_DATA, "participating_icb.json")],
+                environment,
+                **options(icb_table),
+            ),
+        ),
+        Seed(
+            "lsoa",
+            lsoa_table,
+            10,
+            lambda: generate_nonprod_lsoa_json(
+                os.path.join(TEST_DATA, "lsoa", "untrimmed", "unique_lsoa_data.zip"),
+                lsoa_table,
+                **options(lsoa_table),
+            ),
+            # the lambdas need at least 1MB of LSOA data, the trimmed file
+            # pads the curated fixture out to that
+            prepare=fixtures(
+                "lsoa.json",
+                then=lambda: generate_nonprod_lsoa_json(
+                    os.path.join(TEST_DATA, "lsoa", "trimmed", "unique_lsoa_data.zip"),
+                    lsoa_table,
+                    **options(lsoa_table),
+                ),
+            ),
+        ),
+        Seed(
+            "phlebotomy",
+            phlebotomy_table,
+            2,
+            lambda: generate_nonprod_data(phlebotomy_table, **options(phlebotomy_table)),
+            depends_on=["icb"],
+            prepare=fixtures("phlebotomy.json"),
+        ),
+        Seed(
+            "postcode",
+            postcode_table,
+            1,
+            lambda: generate_nonprod_postcode_json(
+                os.path.join(TEST_DATA, "lsoa_with_avg_easting_northing.zip"),
+                postcode_table,
+                incremental=args.incremental,
+                **checkpointed(postcode_table),
+            ),
+            # an incremental load brings a populated table up to date
+            refresh=args.incremental,
+        ),
+        Seed(
+            "population",
+            population_table,
+            100,
+            lambda: upload_population(
+                os.path.join(TEST_DATA, "male_participants_with_LSOA_Invited.zip"),
+                os.path.join(TEST_DATA, "female_participants_with_LSOA_Invited.zip"),
+                population_table,
+                args.processes,
+                **checkpointed(population_table),
+            ),
+            depends_on=["lsoa"],
+            prepare=fixtures(
+                "population1.json",
+                "population2.json",
+                "population3.json",
+                "population4.json",
+            ),
+        ),
+    ]
+
+
+def run_seed(seed, client_factory=new_client):
+    if seed.prepare is not None:
+        seed.prepare()
+    if not seed.refresh and is_populated(client_factory(), seed.table_name, seed.threshold):
+        print(f"{seed.table_name} table already populated")
+        return POPULATED
+    print(f"Initiating upload of {seed.name} data to {seed.table_name}")
+    seed.load()
+    print(f"Successfully uploaded {seed.name} data to {seed.table_name}")
+    return SEEDED
+
+
+def run_seeds(seeds, run=run_seed, max_workers=None):
+    # run every seed as soon as the seeds it depends on have finished,
+    # independent seeds in parallel. A failed seed skips its dependents
+    # without stopping the others. Returns name -> (outcome, seconds).
+    return run_graph(seeds, run, max_workers, kind="seed")
+
+
+def main():
+    parser = add_incremental_arguments(
+        add_checkpoint_arguments(build_parser("Seed every table of an environment"))
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=DEFAULT_PROCESSES,
+        help="number of worker processes formatting population rows",
+    )
+    parser.add_argument(
+        "--only",
+        nargs="+",
+        help="seed only these tables, e.g. --only postcode population",
+    )
+    parser.set_defaults(workers=8)
+    args = parser.parse_args()
+
+    environment = os.environ["environment"]
+    environment_type = os.getenv("environment_type", "")
+    seeds = build_seeds(environment, environment_type, args)
+    if args.only:
+        # dependencies outside the selection are assumed to be seeded already
+        seeds = [seed for seed in seeds if seed.name in args.only]
+        for seed in seeds:
+            seed.depends_on = tuple(name for name in seed.depends_on if name in args.only)
+
+    started = time.perf_counter()
+    with reporting(args.metrics_file, args.progress_interval), profiling(args.profile):
+        outcomes = run_seeds(seeds)
+    for name, (outcome, seconds) in outcomes.items():
+        print(f"{name}: {outcome} in {seconds:0.1f} seconds")
+    print(f"Seeded {environment} in {time.perf_counter() - started:0.1f} seconds")
+    return 1 if any(outcome in (FAILED, SKIPPED) for outcome, _ in outcomes.values()) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
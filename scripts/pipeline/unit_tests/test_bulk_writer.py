@@ -0,0 +1,261 @@
+import pytest
+from botocore.exceptions import ClientError
+
+from scripts.pipeline.common.bulk_writer import (
+    batch_write,
+    concurrent_write,
+    prefetch_chunks,
+    to_write_request,
+    transact_write,
+)
+from scripts.pipeline.common.rate_limiter import AdaptiveRateLimiter
+from scripts.pipeline.common.records import record_type
+
+
+def put_item(key, table_name="Table"):
+    return {"Put": {"Item": {"Id": {"S": str(key)}}, "TableName": table_name}}
+
+
+class FakeDynamoDBClient:
+    # leaves the first item of every request unprocessed until
+    # it has been resubmitted `unprocessed_rounds` times
+    def __init__(self, unprocessed_rounds=0):
+        self.unprocessed_rounds = unprocessed_rounds
+        self.requests = []
+        self.written = []
+
+    def batch_write_item(self, RequestItems, **options):
+        self.requests.append(RequestItems)
+        unprocessed = {}
+        for table_name, requests in RequestItems.items():
+            if self.unprocessed_rounds and requests:
+                unprocessed[table_name] = requests[:1]
+                requests = requests[1:]
+            self.written.extend(requests)
+        if unprocessed:
+            self.unprocessed_rounds -= 1
+        return {"UnprocessedItems": unprocessed}
+
+    def transact_write_items(self, TransactItems, **options):
+        self.requests.append(TransactItems)
+        self.written.extend(TransactItems)
+
+
+def test_prefetch_chunks():
+    chunks = list(prefetch_chunks(range(250), chunk_size=100, queue_depth=1))
+    assert [len(chunk) for chunk in chunks] == [100, 100, 50]
+    assert [item for chunk in chunks for item in chunk] == list(range(250))
+
+
+def test_prefetch_chunks_raises_producer_error():
+    def failing_rows():
+        yield 1
+        raise ValueError("bad row")
+
+    with pytest.raises(ValueError):
+        list(prefetch_chunks(failing_rows(), chunk_size=1))
+
+
+def test_to_write_request():
+    assert to_write_request(put_item(1)) == (
+        "Table",
+        {"PutRequest": {"Item": {"Id": {"S": "1"}}}},
+    )
+    delete = {"Delete": {"Key": {"Id": {"S": "1"}}, "TableName": "Table"}}
+    assert to_write_request(delete) == (
+        "Table",
+        {"DeleteRequest": {"Key": {"Id": {"S": "1"}}}},
+    )
+
+
+def test_records_are_expanded_as_they_are_sent():
+    record = record_type("Table", ["Id", "Count"], ["S", "N"], ["Id"])
+    records = [record((str(i), "1")) for i in range(3)]
+    client = FakeDynamoDBClient()
+    batch_write(client, records)
+    assert client.written[0] == {"PutRequest": {"Item": {"Id": {"S": "0"}, "Count": {"N": "1"}}}}
+    client = FakeDynamoDBClient()
+    transact_write(client, records)
+    assert client.written == [record.to_item() for record in records]
+
+
+def test_batch_write_uses_25_item_requests():
+    client = FakeDynamoDBClient()
+    result = batch_write(client, (put_item(i) for i in range(60)))
+    assert [len(request["Table"]) for request in client.requests] == [25, 25, 10]
+    assert result.succeeded == 60
+    assert result.failed == 0
+
+
+def test_batch_write_retries_unprocessed_items():
+    client = FakeDynamoDBClient(unprocessed_rounds=2)
+    delays = []
+    result = batch_write(client, [put_item(i) for i in range(3)], sleep=delays.append)
+    assert result.succeeded == 3
+    assert len(client.written) == 3
+    assert len(delays) == 2
+
+
+def test_batch_write_reports_items_left_after_retries():
+    client = FakeDynamoDBClient(unprocessed_rounds=5)
+    result = batch_write(
+        client, [put_item(i) for i in range(3)], max_retries=1, sleep=lambda delay: None
+    )
+    assert result.succeeded == 2
+    assert result.failed == 1
+    assert len(result.unprocessed) == 1
+
+
+def test_transact_write_uses_100_item_requests():
+    client = FakeDynamoDBClient()
+    result = transact_write(client, [put_item(i) for i in range(150)])
+    assert [len(request) for request in client.requests] == [100, 50]
+    assert result.succeeded == 150
+
+
+def test_concurrent_write_gives_each_worker_its_own_client():
+    clients = []
+
+    def client_factory():
+        clients.append(FakeDynamoDBClient())
+        return clients[-1]
+
+    result = concurrent_write(
+        (put_item(i) for i in range(1000)), workers=4, client_factory=client_factory
+    )
+    assert result.succeeded == 1000
+    assert len(clients) == 4
+    written = [request["PutRequest"]["Item"]["Id"]["S"] for client in clients for request in client.written]
+    assert sorted(written, key=int) == [str(i) for i in range(1000)]
+
+
+def test_concurrent_write_stops_when_a_worker_fails():
+    class FailingClient(FakeDynamoDBClient):
+        def batch_write_item(self, RequestItems, **options):
+            raise RuntimeError("write failed")
+
+    consumed = []
+
+    def items():
+        for i in range(100000):
+            consumed.append(i)
+            yield put_item(i)
+
+    with pytest.raises(RuntimeError):
+        concurrent_write(items(), workers=2, client_factory=FailingClient)
+    assert len(consumed) < 100000
+
+
+class RefusingDynamoDBClient(FakeDynamoDBClient):
+    # refuses every request containing one of the `bad` ids, batches with
+    # a ValidationException and transactions with a cancellation naming them
+    def __init__(self, bad):
+        super().__init__()
+        self.bad = set(str(key) for key in bad)
+
+    def batch_write_item(self, RequestItems, **options):
+        ids = [
+            request["PutRequest"]["Item"]["Id"]["S"]
+            for requests in RequestItems.values()
+            for request in requests
+        ]
+        if self.bad.intersection(ids):
+            self.requests.append(RequestItems)
+            raise ClientError(
+                {"Error": {"Code": "ValidationException", "Message": "bad number"}},
+                "BatchWriteItem",
+            )
+        return super().batch_write_item(RequestItems)
+
+    def transact_write_items(self, TransactItems, **options):
+        ids = [item["Put"]["Item"]["Id"]["S"] for item in TransactItems]
+        if self.bad.intersection(ids):
+            self.requests.append(TransactItems)
+            error = ClientError(
+                {"Error": {"Code": "TransactionCanceledException", "Message": "cancelled"}},
+                "TransactWriteItems",
+            )
+            error.response["CancellationReasons"] = [
+                {"Code": "ValidationError", "Message": "bad number"}
+                if key in self.bad
+                else {"Code": "None"}
+                for key in ids
+            ]
+            raise error
+        return super().transact_write_items(TransactItems)
+
+
+def test_refused_batch_is_bisected_down_to_the_bad_item():
+    client = RefusingDynamoDBClient(bad=[13])
+    written = []
+    result = batch_write(
+        client,
+        [put_item(i) for i in range(25)],
+        on_batch_written=lambda sequence, size: written.append(sequence),
+    )
+    assert result.succeeded == 24
+    assert result.failed == 1
+    assert result.rejected == [(put_item(13), "ValidationException: bad number")]
+    assert len(client.written) == 24
+    # one refused request, then two requests per halving
+    assert len(client.requests) <= 1 + 2 * 5
+    # the batch counts as done, the bad item is recorded instead
+    assert written == [0]
+
+
+def test_cancelled_transaction_leaves_out_the_items_it_names():
+    client = RefusingDynamoDBClient(bad=[3, 70])
+    result = transact_write(client, [put_item(i) for i in range(100)])
+    assert result.succeeded == 98
+    assert [item for item, _ in result.rejected] == [put_item(3), put_item(70)]
+    assert result.rejected[0][1] == "ValidationError: bad number"
+    assert [len(request) for request in client.requests] == [100, 98]
+
+
+def test_other_errors_are_not_bisected():
+    class FailingClient(FakeDynamoDBClient):
+        def batch_write_item(self, RequestItems, **options):
+            raise ClientError({"Error": {"Code": "AccessDeniedException"}}, "BatchWriteItem")
+
+    with pytest.raises(ClientError):
+        batch_write(FailingClient(), [put_item(i) for i in range(25)])
+
+
+class ThrottledTransactionClient(FakeDynamoDBClient):
+    # cancels the first `throttles` transactions for capacity, as dynamodb
+    # does when a transaction is throttled
+    def __init__(self, throttles, code="ThrottlingError"):
+        super().__init__()
+        self.throttles = throttles
+        self.code = code
+
+    def transact_write_items(self, TransactItems, **options):
+        if self.throttles:
+            self.throttles -= 1
+            self.requests.append(TransactItems)
+            error = ClientError(
+                {"Error": {"Code": "TransactionCanceledException", "Message": "cancelled"}},
+                "TransactWriteItems",
+            )
+            error.response["CancellationReasons"] = [{"Code": self.code}] + [
+                {"Code": "None"} for _ in TransactItems[1:]
+            ]
+            raise error
+        return super().transact_write_items(TransactItems)
+
+
+@pytest.mark.parametrize("code", ["ThrottlingError", "ProvisionedThroughputExceeded"])
+def test_throttled_transaction_is_retried_not_rejected(code):
+    client = ThrottledTransactionClient(throttles=2, code=code)
+    limiter = AdaptiveRateLimiter(rate=1000, sleep=lambda delay: None)
+    result = transact_write(
+        client,
+        [put_item(i) for i in range(100)],
+        sleep=lambda delay: None,
+        rate_limiter=limiter,
+    )
+    assert result.rejected == []
+    assert result.succeeded == 100
+    assert [len(request) for request in client.requests] == [100, 100, 100]
+    assert len(client.written) == 100
+    assert limiter.throttles == 2
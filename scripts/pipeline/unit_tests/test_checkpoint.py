@@ -0,0 +1,98 @@
+import os
+
+import pytest
+
+from scripts.pipeline.common.checkpoint import CheckpointJournal
+from scripts.pipeline.common.parallel import format_with_offsets
+from scripts.pipeline.nonprod_postcode_load.nonprod_postcode_load import (
+    generate_nonprod_lsoa_json,
+)
+
+
+class FlakyDynamoDBClient:
+    # fails every request after the first `fail_after` ones
+    def __init__(self, fail_after=None):
+        self.fail_after = fail_after
+        self.written = []
+
+    def batch_write_item(self, RequestItems, **options):
+        if self.fail_after is not None and self.fail_after == 0:
+            raise RuntimeError("connection lost")
+        if self.fail_after is not None:
+            self.fail_after -= 1
+        for requests in RequestItems.values():
+            self.written.extend(
+                request["PutRequest"]["Item"]["POSTCODE"]["S"] for request in requests
+            )
+        return {"UnprocessedItems": {}}
+
+
+def postcode(i):
+    # a distinct, validly formatted postcode for every i below 1000
+    return f"AB{i % 100} {i // 100}CD"
+
+
+def write_postcode_csv(path, rows):
+    with open(path, "w") as file:
+        file.write(",".join(f"COLUMN_{i}" for i in range(20)) + "\n")
+        for i in range(rows):
+            file.write(f"A{i},{postcode(i)}," + ",".join("1" for _ in range(18)) + "\n")
+
+
+def test_journal_only_advances_over_contiguous_batches(tmp_path):
+    journal = CheckpointJournal(str(tmp_path / "journal.json"), "hash", "Table")
+    rows = [[i] for i in range(6)]
+
+    def format_rows(rows, start=0, offsets=True):
+        return ((offset, row[0]) for offset, row in enumerate(rows, start + 1))
+
+    items = list(journal.track(format_with_offsets(rows, format_rows)))
+    assert items == list(range(6))
+    journal.commit(1, 2)
+    assert journal.row_offset == 0
+    journal.commit(0, 2)
+    assert journal.row_offset == 4
+    assert journal.batch_sequence == 2
+    journal.save()
+
+    reloaded = CheckpointJournal(str(tmp_path / "journal.json"), "hash", "Table")
+    assert reloaded.row_offset == 4
+    formatted = format_with_offsets(reloaded.skip(rows), format_rows, start=reloaded.row_offset)
+    assert list(reloaded.track(formatted)) == [4, 5]
+    assert CheckpointJournal(str(tmp_path / "journal.json"), "changed", "Table").row_offset == 0
+    assert CheckpointJournal(str(tmp_path / "journal.json"), "hash", "Other").row_offset == 0
+
+
+def test_postcode_load_resumes_after_failure(tmp_path):
+    csv_path = str(tmp_path / "postcodes.csv")
+    write_postcode_csv(csv_path, 100)
+
+    failing = FlakyDynamoDBClient(fail_after=2)
+    with pytest.raises(RuntimeError):
+        generate_nonprod_lsoa_json(csv_path, "Table", client=failing)
+    assert failing.written == [postcode(i) for i in range(50)]
+    assert os.path.exists(csv_path + ".Table.checkpoint.json")
+
+    client = FlakyDynamoDBClient()
+    result = generate_nonprod_lsoa_json(csv_path, "Table", client=client)
+    assert client.written == [postcode(i) for i in range(50, 100)]
+    assert result.succeeded == 50
+    assert not os.path.exists(csv_path + ".Table.checkpoint.json")
+
+
+def test_failed_load_does_not_resume_a_load_into_another_table(tmp_path):
+    csv_path = str(tmp_path / "postcodes.csv")
+    write_postcode_csv(csv_path, 100)
+
+    failing = FlakyDynamoDBClient(fail_after=2)
+    with pytest.raises(RuntimeError):
+        generate_nonprod_lsoa_json(csv_path, "dev-Postcode", client=failing)
+
+    other = FlakyDynamoDBClient()
+    generate_nonprod_lsoa_json(csv_path, "test-Postcode", client=other)
+    assert other.written == [postcode(i) for i in range(100)]
+    assert not os.path.exists(csv_path + ".test-Postcode.checkpoint.json")
+
+    client = FlakyDynamoDBClient()
+    generate_nonprod_lsoa_json(csv_path, "dev-Postcode", client=client)
+    assert client.written == [postcode(i) for i in range(50, 100)]
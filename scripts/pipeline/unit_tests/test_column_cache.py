@@ -0,0 +1,72 @@
+import os
+
+from scripts.pipeline.common.column_cache import ColumnCache, open_cache, write_cache
+from scripts.pipeline.common.source import cache_path, open_csv_source
+
+
+def test_round_trip_keeps_values_and_row_lengths(tmp_path):
+    path = str(tmp_path / "rows.columns")
+    rows = [["E01", "1", "é"], ["E02", "1"], [], ["E03", "", "é", "extra"]] * 3
+    write_cache(path, "key", ["LSOA", "RANK", "NAME"], iter(rows))
+
+    with open_cache(path, "key") as cache:
+        assert cache.header == ["LSOA", "RANK", "NAME"]
+        assert len(cache) == 12
+        assert list(cache.rows(chunk_size=5)) == rows
+        assert list(cache.rows(start=10)) == rows[10:]
+
+
+def test_small_dictionaries_use_small_codes(tmp_path):
+    path = str(tmp_path / "rows.columns")
+    write_cache(path, "key", ["A", "B"], ([str(i), "x"] for i in range(300)))
+    with ColumnCache(path) as cache:
+        [block] = cache.metadata["blocks"]
+        assert [typecode for _, _, _, typecode in block["columns"]] == ["H", "B"]
+
+
+def test_rows_are_written_in_blocks_and_distinct_columns_stop_being_encoded(tmp_path):
+    path = str(tmp_path / "rows.columns")
+    # the first column is unique, the second has two values, the third
+    # only appears part way through
+    rows = [[f"id{i}", str(i % 2)] + (["late"] if i >= 25 else []) for i in range(40)]
+    rows[33] = []
+    write_cache(path, "key", [], iter(rows), block_rows=10)
+
+    with open_cache(path, "key") as cache:
+        blocks = cache.metadata["blocks"]
+        assert [block["rows"] for block in blocks] == [10, 10, 10, 10]
+        assert [[kind for kind, _, _, _ in block["columns"]] for block in blocks] == [
+            ["codes", "codes"],
+            ["values", "codes"],
+            ["values", "codes", "codes"],
+            ["values", "codes", "codes"],
+        ]
+        assert list(cache.rows(chunk_size=3)) == rows
+        assert list(cache.rows(start=27)) == rows[27:]
+
+
+def test_empty_rows_are_kept(tmp_path):
+    path = str(tmp_path / "rows.columns")
+    write_cache(path, "key", [], iter([[], []]))
+    with open_cache(path, "key") as cache:
+        assert list(cache.rows()) == [[], []]
+
+
+def test_cache_for_another_source_is_ignored(tmp_path):
+    path = str(tmp_path / "rows.columns")
+    write_cache(path, "key", [], [["a"]])
+    assert open_cache(path, "other key") is None
+    (tmp_path / "empty.columns").write_bytes(b"")
+    assert open_cache(str(tmp_path / "empty.columns"), "key") is None
+
+
+def test_source_is_cached_and_rebuilt_when_it_changes(tmp_path):
+    source = tmp_path / "rows.csv"
+    source.write_text("HEADER\na\nb\n")
+    with open_csv_source(str(source), cache=True) as rows:
+        assert list(rows) == [["a"], ["b"]]
+    assert os.path.exists(cache_path(str(source)))
+
+    source.write_text("HEADER\nc\n")
+    with open_csv_source(str(source), cache=True, skip_header=False) as rows:
+        assert list(rows) == [["HEADER"], ["c"]]
@@ -0,0 +1,29 @@
+import pytest
+
+from scripts.common.dag import FAILED, SKIPPED, dependency_order, run_graph
+
+
+class Task:
+    def __init__(self, name, depends_on=()):
+        self.name = name
+        self.depends_on = tuple(depends_on)
+
+
+def test_tasks_are_ordered_after_their_dependencies():
+    tasks = [Task("c", ["b"]), Task("b", ["a"]), Task("a")]
+    assert [task.name for task in dependency_order(tasks)] == ["a", "b", "c"]
+    with pytest.raises(ValueError, match="unknown seed d"):
+        dependency_order([Task("c", ["d"])], kind="seed")
+    with pytest.raises(ValueError, match="Seeds depend on each other"):
+        dependency_order([Task("a", ["b"]), Task("b", ["a"])], kind="seed")
+
+
+def test_skipped_tasks_skip_their_dependents_too():
+    def run(task):
+        if task.name == "a":
+            raise RuntimeError("broken")
+        return task.name
+
+    tasks = [Task("a"), Task("b", ["a"]), Task("c", ["b"]), Task("d")]
+    outcomes = {name: outcome for name, (outcome, _) in run_graph(tasks, run).items()}
+    assert outcomes == {"a": FAILED, "b": SKIPPED, "c": SKIPPED, "d": "d"}
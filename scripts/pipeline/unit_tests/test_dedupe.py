@@ -0,0 +1,168 @@
+import threading
+import time
+
+import pytest
+
+from scripts.pipeline.common.bulk_writer import concurrent_write
+from scripts.pipeline.common.dedupe import (
+    KEEP_FIRST,
+    BloomFilter,
+    Deduplicator,
+    SpilledKeys,
+    item_key,
+)
+from scripts.pipeline.common.records import record_type
+from scripts.pipeline.nonprod_postcode_load.nonprod_postcode_load import (
+    generate_nonprod_lsoa_json,
+)
+from scripts.pipeline.unit_tests.test_manifest import write_rows
+
+RECORD = record_type("Table", ["Id", "Value"], ["S", "N"], ["Id"])
+
+
+def pairs(*keys):
+    # (row_offset, record) pairs, the value is the row number
+    return [(row, RECORD((key, str(row)))) for row, key in enumerate(keys, 1)]
+
+
+def test_last_item_of_a_key_wins():
+    deduplicator = Deduplicator()
+    output = list(deduplicator.filter_pairs(pairs("a", "b", "a", "c", "b")))
+    assert [tuple(item) for _, item in output] == [("a", "3"), ("c", "4"), ("b", "5")]
+    # merged items move to the later row, offsets still only go up
+    assert [row for row, _ in output] == [3, 4, 5]
+    assert deduplicator.duplicates == 2
+
+
+def test_first_item_of_a_key_can_win_instead():
+    deduplicator = Deduplicator(policy=KEEP_FIRST)
+    output = list(deduplicator.filter_pairs(pairs("a", "b", "a", "c", "b")))
+    assert [tuple(item) for _, item in output] == [("a", "1"), ("b", "2"), ("c", "4")]
+    assert deduplicator.duplicates == 2
+
+
+def test_keys_beyond_the_window_are_remembered():
+    keys = ["a", "b", "c", "a"]
+    last = Deduplicator(window=2)
+    assert [item[0] for item in last.filter(item for _, item in pairs(*keys))] == keys
+    assert (last.duplicates, last.rewritten) == (0, 1)
+
+    first = Deduplicator(policy=KEEP_FIRST, window=2)
+    assert [item[0] for item in first.filter(item for _, item in pairs(*keys))] == keys[:3]
+    assert first.duplicates == 1
+
+    # a bloom filter cannot tell a repeated key from a false positive,
+    # under KEEP_LAST the keys it lets through are logged
+    logged = []
+    bloom = Deduplicator(window=2, expected_items=10**6, memory_budget=0, log=logged.append)
+    assert [item[0] for item in bloom.filter(item for _, item in pairs(*keys))] == keys
+    assert bloom.unverified == 1
+    assert logged == ["Table key ('a',) may repeat an earlier item, written unverified"]
+
+    # under KEEP_FIRST they are looked up in the keys spilled to disk
+    logged = []
+    bloom = Deduplicator(
+        policy=KEEP_FIRST, window=2, expected_items=10**6, memory_budget=0, log=logged.append
+    )
+    assert [item[0] for item in bloom.filter(item for _, item in pairs(*keys))] == keys[:3]
+    assert (bloom.duplicates, bloom.unverified, logged) == (1, 0, [])
+
+
+def test_false_positives_are_still_written_under_keep_first():
+    # a filter sized for one key claims nearly every key it is given
+    keys = [str(i) for i in range(200)] + ["5"]
+    deduplicator = Deduplicator(policy=KEEP_FIRST, window=1, expected_items=1, memory_budget=0)
+    output = deduplicator.filter(item for _, item in pairs(*keys))
+    assert [item[0] for item in output] == keys[:200]
+    assert deduplicator.duplicates == 1
+
+
+def test_spilled_keys_are_found_before_and_after_they_are_inserted():
+    spilled = SpilledKeys(batch_size=3)
+    keys = [("Table", (str(i),)) for i in range(10)]
+    for key in keys:
+        spilled.add(key)
+    assert all(key in spilled for key in keys)
+    assert ("Table", ("10",)) not in spilled
+    assert ("Other", ("1",)) not in spilled
+
+
+def test_rewritten_keys_land_after_their_earlier_write():
+    # the first write of "a" is slow, without waiting for it the rewrite
+    # sent by the other worker would land first and be overwritten
+    written = {}
+    lock = threading.Lock()
+
+    class SlowClient:
+        def batch_write_item(self, RequestItems, **options):
+            for requests in RequestItems.values():
+                for request in requests:
+                    item = request["PutRequest"]["Item"]
+                    if item["Id"]["S"] == "a" and item["Value"]["N"] == "1":
+                        time.sleep(0.2)
+                    with lock:
+                        written[item["Id"]["S"]] = item["Value"]["N"]
+            return {"UnprocessedItems": {}}
+
+    deduplicator = Deduplicator(window=2)
+    items = deduplicator.filter(item for _, item in pairs("a", "b", "c", "d", "a"))
+    result = concurrent_write(items, workers=2, batch_size=1, client_factory=SlowClient)
+    assert result.succeeded == 5
+    assert deduplicator.rewritten == 1
+    assert written == {"a": "5", "b": "2", "c": "3", "d": "4"}
+
+
+def test_expected_items_are_held_exactly_when_they_fit_in_memory():
+    assert isinstance(Deduplicator(expected_items=10**6, memory_budget=2**30).seen, set)
+    assert isinstance(Deduplicator(expected_items=10**6, memory_budget=2**20).seen, BloomFilter)
+
+
+def test_no_window_of_output_repeats_a_key():
+    keys = [str(i % 37) for i in range(1000)]
+    items = (item for _, item in pairs(*keys))
+    output = [item[0] for item in Deduplicator(window=100).filter(items)]
+    for start in range(len(output) - 100):
+        assert len(set(output[start : start + 100])) == 100
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(10000, false_positive_rate=0.01)
+    for i in range(10000):
+        bloom.add(("Table", (str(i),)))
+    assert all(("Table", (str(i),)) in bloom for i in range(10000))
+    false_positives = sum(("Table", (str(i),)) in bloom for i in range(10000, 20000))
+    assert false_positives < 300
+    assert len(bloom.bits) < 10000 * 10 // 8 + 8
+
+
+def test_item_key_reads_dynamodb_json():
+    put = {"Put": {"Item": {"A": {"S": "x"}, "B": {"N": "1"}}, "TableName": "T"}}
+    delete = {"Delete": {"Key": {"A": {"S": "x"}, "B": {"N": "1"}}, "TableName": "T"}}
+    assert item_key(put, ["A", "B"]) == item_key(delete, ["A", "B"]) == ("T", ("x", "1"))
+    assert item_key(RECORD(("x", "1"))) == ("Table", ("x",))
+    with pytest.raises(ValueError):
+        Deduplicator(policy="middle")
+
+
+class StrictDynamoDBClient:
+    # refuses requests holding a key twice, as dynamodb does
+    def __init__(self):
+        self.written = {}
+
+    def batch_write_item(self, RequestItems, **options):
+        for requests in RequestItems.values():
+            keys = [request["PutRequest"]["Item"]["POSTCODE"]["S"] for request in requests]
+            assert len(set(keys)) == len(keys), "Provided list of item keys contains duplicates"
+            for request in requests:
+                item = request["PutRequest"]["Item"]
+                self.written[item["POSTCODE"]["S"]] = item["EASTING_1M"]["N"]
+        return {"UnprocessedItems": {}}
+
+
+def test_postcode_load_writes_a_repeated_postcode_once(tmp_path):
+    csv_path = tmp_path / "postcodes.csv"
+    write_rows(csv_path, [("AB1 1CD", "1"), ("AB2 2CD", "1"), ("AB1 1CD", "2")])
+    client = StrictDynamoDBClient()
+    result = generate_nonprod_lsoa_json(str(csv_path), "dev-Postcode", client=client)
+    assert result.succeeded == 2
+    assert client.written == {"AB1 1CD": "2", "AB2 2CD": "1"}
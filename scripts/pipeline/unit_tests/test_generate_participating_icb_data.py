@@ -1,4 +1,9 @@
-from scripts.pipeline.data_cleanse.generate_participating_icb_data import format_dynamodb_json
+from scripts.pipeline.common.request_files import iter_request_files, read_request_file
+from scripts.pipeline.data_cleanse.generate_participating_icb_data import (
+    format_dynamodb_json,
+    generate_participating_icb_json,
+    generate_participating_icb_requests,
+)
 
 test_csv_data = [
     [1, 'AAA', 'NHS test board'],
@@ -42,3 +47,18 @@ expected_output_data = [
 def test_format_dynamodb_json():
     assert format_dynamodb_json(test_csv_data) == expected_output_data
 
+
+def test_json_and_request_files_hold_the_same_icbs(tmp_path, monkeypatch):
+    source = tmp_path / "Participating_ICBs.csv"
+    source.write_text("Id,IcbCode,Board\n1,AAA,NHS test board\n2,BBB,NHS test board 1\n")
+    # the json file is written to test-data under the working directory
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "test-data").mkdir()
+    generate_participating_icb_json(str(source), "dev-ParticipatingIcb")
+    generate_participating_icb_requests(
+        str(source), str(tmp_path / "requests"), "dev-ParticipatingIcb"
+    )
+
+    from_json = list(read_request_file(str(tmp_path / "test-data" / "participating_icb.json")))
+    assert from_json == list(iter_request_files(str(tmp_path / "requests")))
+    assert [item["Put"]["Item"]["IcbCode"]["S"] for item in from_json] == ["AAA", "BBB"]
@@ -0,0 +1,54 @@
+import re
+
+import pytest
+
+from scripts.pipeline.common.id_generator import (
+    CLINIC_ID_TEMPLATE,
+    NHS_LETTERS,
+    ODS_CODE_TEMPLATE,
+    PARTICIPANT_ID_TEMPLATE,
+    IdGenerator,
+)
+
+
+@pytest.mark.parametrize(
+    "template, letters, pattern",
+    [
+        (PARTICIPANT_ID_TEMPLATE, NHS_LETTERS, r"NHS-[A-HJ-NP-Z]{2}[0-9]{2}-[A-HJ-NP-Z]{2}[0-9]{2}"),
+        (CLINIC_ID_TEMPLATE, None, r"[A-Z]{2}[0-9]{2}[A-Z][0-9]{3}"),
+        (ODS_CODE_TEMPLATE, None, r"[A-Z][0-9]{5}"),
+    ],
+)
+def test_ids_match_format_and_are_unique(template, letters, pattern):
+    options = {"letters": letters} if letters else {}
+    generator = IdGenerator(template, seed=1, **options)
+    ids = generator.generate(0, 50000)
+    assert all(re.fullmatch(pattern, id) for id in ids)
+    assert len(set(ids)) == len(ids)
+    assert ids[1234] == generator.id_at(1234)
+
+
+def test_whole_id_space_is_a_permutation():
+    generator = IdGenerator("A9", letters="ABC", seed=3)
+    ids = generator.generate(0, generator.size)
+    assert generator.size == 30
+    assert sorted(ids) == sorted(f"{letter}{digit}" for letter in "ABC" for digit in range(10))
+
+
+def test_seed_makes_ids_reproducible():
+    assert IdGenerator(CLINIC_ID_TEMPLATE, seed=7).generate(0, 10) == IdGenerator(CLINIC_ID_TEMPLATE, seed=7).generate(0, 10)
+    assert IdGenerator(CLINIC_ID_TEMPLATE, seed=7).generate(0, 10) != IdGenerator(CLINIC_ID_TEMPLATE, seed=8).generate(0, 10)
+
+
+def test_partitions_are_disjoint():
+    generator = IdGenerator(ODS_CODE_TEMPLATE, seed=1)
+    ranges = generator.partition(1000, 3)
+    assert ranges == [(0, 334), (334, 333), (667, 333)]
+    ids = [id for start, count in ranges for id in generator.generate(start, count)]
+    assert len(set(ids)) == 1000
+
+
+def test_index_outside_id_space():
+    generator = IdGenerator(ODS_CODE_TEMPLATE, seed=1)
+    with pytest.raises(IndexError):
+        generator.id_at(generator.size)
@@ -0,0 +1,163 @@
+import gzip
+import io
+
+from botocore.exceptions import ClientError
+
+from scripts.pipeline.common.manifest import FileStore, Manifest, ManifestChanges, S3Store
+from scripts.pipeline.nonprod_postcode_load.nonprod_postcode_load import (
+    generate_nonprod_lsoa_json,
+)
+from scripts.pipeline.unit_tests.test_checkpoint import postcode
+
+
+class FakeS3Client:
+    def __init__(self):
+        self.objects = {}
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        return {"Body": io.BytesIO(self.objects[Bucket, Key])}
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[Bucket, Key] = Body
+
+
+class RecordingDynamoDBClient:
+    def __init__(self, unprocessed=False, created="2024-01-01 00:00:00+00:00"):
+        self.unprocessed = unprocessed
+        self.created = created
+        self.puts = []
+        self.deletes = []
+
+    def describe_table(self, TableName):
+        return {
+            "Table": {
+                "TableArn": f"arn:aws:dynamodb:eu-west-2:123456789012:table/{TableName}",
+                "CreationDateTime": self.created,
+            }
+        }
+
+    def batch_write_item(self, RequestItems, **options):
+        if self.unprocessed:
+            return {"UnprocessedItems": RequestItems}
+        for requests in RequestItems.values():
+            for request in requests:
+                if "PutRequest" in request:
+                    self.puts.append(request["PutRequest"]["Item"]["POSTCODE"]["S"])
+                else:
+                    self.deletes.append(request["DeleteRequest"]["Key"]["POSTCODE"]["S"])
+        return {"UnprocessedItems": {}}
+
+
+def write_rows(path, rows):
+    with open(path, "w") as file:
+        file.write(",".join(f"COLUMN_{i}" for i in range(20)) + "\n")
+        for postcode, value in rows:
+            file.write(f"A,{postcode}," + ",".join(value for _ in range(18)) + "\n")
+
+
+def test_key_round_trip(tmp_path):
+    manifest = Manifest(FileStore(str(tmp_path / "manifest.gz")), ["LSOA_2011", "IMD_RANK"])
+    key = {"LSOA_2011": {"S": "E01015698"}, "IMD_RANK": {"N": "4875"}}
+    assert manifest.decode_key(manifest.encode_key(key)) == key
+
+
+def test_changes_are_only_committed_when_asked(tmp_path):
+    store = FileStore(str(tmp_path / "manifest.gz"))
+    manifest = Manifest(store, ["POSTCODE"])
+    items = [
+        {"Put": {"Item": {"POSTCODE": {"S": f"P{i}"}}, "TableName": "dev-Postcode"}}
+        for i in range(3)
+    ]
+    changes = ManifestChanges(manifest, items, "dev-Postcode")
+    assert list(changes) == items
+    assert Manifest(store, ["POSTCODE"]).hashes == {}
+    changes.commit()
+    assert len(Manifest(store, ["POSTCODE"]).hashes) == 3
+    # a manifest for a different key or table is not trusted
+    assert Manifest(store, ["LSOA_2011"]).hashes == {}
+    assert Manifest(store, ["POSTCODE"], {"TableArn": "other"}).hashes == {}
+
+
+def test_manifest_is_kept_in_s3():
+    client = FakeS3Client()
+    store = S3Store(client, "seed-state", "seed-manifests/dev-Postcode.manifest.gz")
+    assert store.read() is None
+    manifest = Manifest(store, ["POSTCODE"], {"TableArn": "arn"})
+    manifest.save({"SAB1 1CD": bytes(8)})
+    stored = client.objects["seed-state", "seed-manifests/dev-Postcode.manifest.gz"]
+    assert gzip.decompress(stored).decode().endswith("SAB1 1CD\t0000000000000000\n")
+    assert Manifest(store, ["POSTCODE"], {"TableArn": "arn"}).hashes == {"SAB1 1CD": bytes(8)}
+
+
+def test_incremental_postcode_load_writes_only_the_difference(tmp_path):
+    csv_path = tmp_path / "postcodes.csv"
+    write_rows(csv_path, [(postcode(i), "1") for i in range(100)])
+    client = RecordingDynamoDBClient()
+    generate_nonprod_lsoa_json(str(csv_path), "dev-Postcode", incremental=True, client=client)
+    assert len(client.puts) == 100
+
+    # the first postcode changes, the second is removed, a new one is added
+    rows = [(postcode(0), "2")] + [(postcode(i), "1") for i in range(2, 101)]
+    write_rows(csv_path, rows)
+    client = RecordingDynamoDBClient()
+    result = generate_nonprod_lsoa_json(
+        str(csv_path), "dev-Postcode", incremental=True, client=client
+    )
+    assert sorted(client.puts) == [postcode(0), postcode(100)]
+    assert client.deletes == [postcode(1)]
+    assert result.succeeded == 3
+
+    # nothing changed, nothing is written
+    client = RecordingDynamoDBClient()
+    generate_nonprod_lsoa_json(str(csv_path), "dev-Postcode", incremental=True, client=client)
+    assert client.puts == client.deletes == []
+
+
+def test_rejected_rows_keep_their_item_and_manifest_entry(tmp_path):
+    csv_path = tmp_path / "postcodes.csv"
+    write_rows(csv_path, [(postcode(i), "1") for i in range(3)])
+    generate_nonprod_lsoa_json(
+        str(csv_path), "dev-Postcode", incremental=True, client=RecordingDynamoDBClient()
+    )
+
+    # the second row fails validation, its item in the table is left alone
+    write_rows(csv_path, [(postcode(0), "1"), (postcode(1), "x"), (postcode(2), "1")])
+    client = RecordingDynamoDBClient()
+    generate_nonprod_lsoa_json(str(csv_path), "dev-Postcode", incremental=True, client=client)
+    assert client.puts == client.deletes == []
+
+    # and it is still known once the row is fixed
+    write_rows(csv_path, [(postcode(i), "1") for i in range(3)])
+    client = RecordingDynamoDBClient()
+    generate_nonprod_lsoa_json(str(csv_path), "dev-Postcode", incremental=True, client=client)
+    assert client.puts == client.deletes == []
+
+
+def test_failed_incremental_load_keeps_the_old_manifest(tmp_path):
+    csv_path = tmp_path / "postcodes.csv"
+    write_rows(csv_path, [(postcode(0), "1")])
+    client = RecordingDynamoDBClient(unprocessed=True)
+    result = generate_nonprod_lsoa_json(
+        str(csv_path), "dev-Postcode", incremental=True, client=client, max_retries=0
+    )
+    assert result.failed == 1
+
+    client = RecordingDynamoDBClient()
+    generate_nonprod_lsoa_json(str(csv_path), "dev-Postcode", incremental=True, client=client)
+    assert client.puts == [postcode(0)]
+
+
+def test_recreated_table_gets_a_full_load(tmp_path):
+    csv_path = tmp_path / "postcodes.csv"
+    write_rows(csv_path, [(postcode(i), "1") for i in range(10)])
+    client = RecordingDynamoDBClient()
+    generate_nonprod_lsoa_json(str(csv_path), "dev-Postcode", incremental=True, client=client)
+
+    # the table was dropped and created again, it is empty whatever the manifest says
+    write_rows(csv_path, [(postcode(i), "1") for i in range(1, 10)])
+    client = RecordingDynamoDBClient(created="2024-06-01 00:00:00+00:00")
+    generate_nonprod_lsoa_json(str(csv_path), "dev-Postcode", incremental=True, client=client)
+    assert sorted(client.puts) == sorted(postcode(i) for i in range(1, 10))
+    assert client.deletes == []
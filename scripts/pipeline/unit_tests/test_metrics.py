@@ -0,0 +1,75 @@
+import json
+
+from scripts.pipeline.common.bulk_writer import batch_write
+from scripts.pipeline.common.metrics import METRICS, Metrics, Progress, percentile
+from scripts.pipeline.unit_tests.test_bulk_writer import FakeDynamoDBClient, put_item
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_stage_times_are_exclusive():
+    clock = FakeClock()
+    metrics = Metrics(clock=clock)
+
+    def rows():
+        for row in range(3):
+            clock.now += 1.0  # reading a row takes a second
+            yield row
+
+    def formatted(rows):
+        for row in rows:
+            clock.now += 2.0  # formatting it two more
+            yield row
+
+    assert list(metrics.timed("format", formatted(metrics.timed("read", rows())))) == [0, 1, 2]
+    stages = metrics.stages
+    assert stages[("read", "")] == [3.0, 4]
+    assert stages[("format", "")] == [6.0, 4]
+
+
+def test_percentiles_and_reports():
+    metrics = Metrics()
+    for latency in range(1, 101):
+        metrics.observe("batch_write_item", latency / 1000, "dev-Postcode")
+    metrics.count("items_written", 2500, "dev-Postcode")
+    metrics.consumed({"ConsumedCapacity": [{"TableName": "dev-Postcode", "CapacityUnits": 25.0}]})
+    report = json.loads(metrics.to_json())
+    (latency,) = report["latencies"]
+    assert (latency["p50"], latency["p95"], latency["p99"]) == (0.05, 0.095, 0.099)
+    prometheus = metrics.to_prometheus()
+    assert 'seed_items_written{table="dev-Postcode"} 2500.0' in prometheus
+    assert 'seed_consumed_capacity_units{table="dev-Postcode"} 25.0' in prometheus
+    assert (
+        'seed_request_seconds{operation="batch_write_item",table="dev-Postcode",quantile="0.99"} 0.099'
+        in prometheus
+    )
+    assert percentile([], 50) is None
+
+
+def test_writer_records_requests_and_retries():
+    METRICS.reset()
+    client = FakeDynamoDBClient(unprocessed_rounds=1)
+    batch_write(client, [put_item(i) for i in range(30)], sleep=lambda delay: None)
+    counters = {counter["name"]: counter["value"] for counter in METRICS.report()["counters"]}
+    assert counters["items_written"] == 30
+    assert counters["retries"] == 1
+    assert counters["unprocessed_items"] == 1
+    (latency,) = METRICS.report()["latencies"]
+    assert latency["count"] == 3
+
+
+def test_progress_line_has_rate_and_eta():
+    clock = FakeClock()
+    metrics = Metrics()
+    progress = Progress(metrics, clock=clock)
+    metrics.count("rows_expected", 1000)
+    metrics.add_time("decode", 0.1, calls=500)
+    metrics.count("items_written", 500)
+    clock.now = 10.0
+    assert progress.line() == "500 items written, 50 items/s, ETA 00:00:10"
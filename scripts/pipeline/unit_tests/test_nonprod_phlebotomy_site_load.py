@@ -0,0 +1,30 @@
+from scripts.pipeline.nonprod_phlebotomy_site_load.nonprod_phlebotomy_site_load import (
+    ICB_POSTCODES,
+    create_data_set,
+    iter_data_set,
+    load_words,
+)
+
+
+def test_create_data_set_size_and_unique_ids():
+    data = create_data_set("Table", site_count=2000, seed=1)
+    items = [item["Put"]["Item"] for item in data]
+    assert len(items) == 2000
+    assert len({item["ClinicId"]["S"] for item in items}) == 2000
+    assert len({item["ODSCode"]["S"] for item in items}) == 2000
+    assert all(item["Postcode"]["S"] in ICB_POSTCODES[item["ICBCode"]["S"]] for item in items)
+    assert {item["Put"]["TableName"] for item in data} == {"Table"}
+
+
+def test_data_set_is_reproducible_for_a_seed():
+    assert create_data_set("Table", site_count=10, seed=5) == create_data_set("Table", site_count=10, seed=5)
+
+
+def test_data_set_is_streamed():
+    sites = iter_data_set("Table", site_count=10**6)
+    assert next(sites)["Put"]["Item"]["ClinicName"] == {"S": "Phlebotomy clinic 1"}
+
+
+def test_words_are_loaded_once():
+    assert load_words() is load_words()
+    assert len(load_words()) > 100
@@ -1,4 +1,7 @@
-from scripts.pipeline.nonprod_postcode_load.nonprod_postcode_load import format_dynamodb_json
+from scripts.pipeline.nonprod_postcode_load.nonprod_postcode_load import (
+    format_dynamodb_json,
+    iter_dynamodb_json,
+)
 
 test_csv_data = [
     [2, 1, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15,
@@ -78,3 +81,10 @@ expected_output_data = [
 
 def test_format_dynamodb_json():
     assert format_dynamodb_json(test_csv_data, 'Table') == expected_output_data
+
+
+def test_iter_dynamodb_json_is_lazy():
+    rows = iter(test_csv_data)
+    items = iter_dynamodb_json(rows, 'Table')
+    assert next(items) == expected_output_data[0]
+    assert next(items, None) is None
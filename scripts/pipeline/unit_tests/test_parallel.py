@@ -0,0 +1,57 @@
+import functools
+
+from scripts.pipeline.common.parallel import (
+    format_in_parallel,
+    format_with_offsets,
+    new_process_pool,
+)
+from scripts.pipeline.nonprod_population_load.nonprod_population_load import (
+    iter_dynamodb_json,
+    iter_records,
+)
+
+
+def population_rows(count):
+    # every third row has no nhs number and is dropped by the formatter
+    for i in range(count):
+        nhs_number = "" if i % 3 == 0 else str(9000000000 + i)
+        yield [nhs_number] + ["x"] * 24 + [f"E0{i}"]
+
+
+def test_format_in_parallel_matches_serial_order():
+    format_rows = functools.partial(iter_dynamodb_json, table_name="Table")
+    with new_process_pool(2) as executor:
+        parallel = list(
+            format_in_parallel(population_rows(500), format_rows, executor, start=10, chunk_size=64)
+        )
+    serial = list(format_with_offsets(population_rows(500), format_rows, start=10))
+
+    assert [offset for offset, _ in parallel] == [offset for offset, _ in serial]
+    assert [item["Put"]["Item"]["LsoaCode"] for _, item in parallel] == [
+        item["Put"]["Item"]["LsoaCode"] for _, item in serial
+    ]
+    assert parallel[0][0] == 12
+    assert parallel[-1][0] == 510
+
+
+def test_records_formatted_in_parallel_keep_their_record_type():
+    format_rows = functools.partial(iter_records, table_name="Table")
+    with new_process_pool(2) as executor:
+        parallel = [
+            item for _, item in format_in_parallel(population_rows(100), format_rows, executor)
+        ]
+    serial = [item for _, item in format_with_offsets(population_rows(100), format_rows)]
+    # gp practice codes are random, participant ids are not
+    assert [item[0] for item in parallel] == [item[0] for item in serial]
+    assert {type(item) for item in parallel} == {type(serial[0])}
+
+
+
+def test_offsets_count_rows_the_filter_drops():
+    # the first of every three rows has no nhs number and is dropped
+    rows = list(population_rows(7))
+    offsets = [offset for offset, _ in iter_records(rows, "Table", start=5, offsets=True)]
+    assert offsets == [7, 8, 10, 11]
+    assert [item[0] for _, item in iter_records(rows, "Table", start=5, offsets=True)] == [
+        item[0] for item in iter_records(rows, "Table", start=5)
+    ]
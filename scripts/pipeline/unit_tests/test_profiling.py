@@ -0,0 +1,49 @@
+import os
+import pstats
+import threading
+import time
+
+from scripts.pipeline.common.metrics import Metrics
+from scripts.pipeline.common.profiling import (
+    ALLOCATIONS_FILE,
+    COLLAPSED_STACKS_FILE,
+    PSTATS_FILE,
+    profiling,
+)
+
+
+def format_rows(sampler, metrics):
+    # busy inside the format stage until the sampler has seen it a few times
+    deadline = time.monotonic() + 5
+    rows = []
+    with metrics.timer("format"):
+        while sampler.samples < 5 and time.monotonic() < deadline:
+            rows.append([str(i) for i in range(100)])
+    return rows
+
+
+def test_profiling_writes_artifacts(tmp_path):
+    metrics = Metrics()
+    directory = str(tmp_path / "profile")
+    with profiling(directory, interval=0.001, metrics=metrics) as sampler:
+        worker = threading.Thread(target=format_rows, args=(sampler, metrics))
+        worker.start()
+        worker.join()
+
+    stats = pstats.Stats(os.path.join(directory, PSTATS_FILE))
+    assert any(function == "format_rows" for _, _, function in stats.stats)
+
+    with open(os.path.join(directory, COLLAPSED_STACKS_FILE)) as file:
+        stacks = [line.rsplit(" ", 1) for line in file]
+    assert any(stack.startswith("format;") and "format_rows" in stack for stack, _ in stacks)
+    assert all(int(count) > 0 for _, count in stacks)
+
+    with open(os.path.join(directory, ALLOCATIONS_FILE)) as file:
+        allocations = file.read()
+    assert allocations.startswith("traced memory:")
+    assert "test_profiling.py" in allocations
+
+
+def test_profiling_without_a_directory_does_nothing(tmp_path):
+    with profiling(None) as sampler:
+        assert sampler is None
@@ -0,0 +1,133 @@
+from botocore.exceptions import ClientError
+
+from scripts.pipeline.common.bulk_writer import batch_write
+from scripts.pipeline.common.rate_limiter import (
+    AdaptiveRateLimiter,
+    is_throttling_error,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class ThrottlingDynamoDBClient:
+    # accepts `capacity` items per second of fake time and throttles
+    # any request that would go over it
+    def __init__(self, clock, capacity):
+        self.clock = clock
+        self.capacity = capacity
+        self.window = None
+        self.used = 0
+        self.throttled = 0
+        self.written = 0
+
+    def batch_write_item(self, RequestItems, **options):
+        window = int(self.clock())
+        if window != self.window:
+            self.window, self.used = window, 0
+        items = sum(len(requests) for requests in RequestItems.values())
+        if self.used + items > self.capacity:
+            self.throttled += 1
+            raise ClientError(
+                {"Error": {"Code": "ProvisionedThroughputExceededException"}},
+                "BatchWriteItem",
+            )
+        self.used += items
+        self.written += items
+        return {"UnprocessedItems": {}}
+
+    def describe_table(self, TableName):
+        return {"Table": {"ProvisionedThroughput": {"WriteCapacityUnits": 40}}}
+
+
+def put_item(key):
+    return {"Put": {"Item": {"Id": {"S": str(key)}}, "TableName": "Table"}}
+
+
+def test_is_throttling_error():
+    throttled = ClientError({"Error": {"Code": "ThrottlingException"}}, "BatchWriteItem")
+    invalid = ClientError({"Error": {"Code": "ValidationException"}}, "BatchWriteItem")
+    assert is_throttling_error(throttled)
+    assert not is_throttling_error(invalid)
+    assert not is_throttling_error(ValueError())
+
+
+def cancelled(*codes):
+    error = ClientError({"Error": {"Code": "TransactionCanceledException"}}, "TransactWriteItems")
+    error.response["CancellationReasons"] = [{"Code": code} for code in codes]
+    return error
+
+
+def test_transactions_cancelled_for_capacity_are_throttled():
+    assert is_throttling_error(cancelled("None", "ThrottlingError"))
+    assert is_throttling_error(cancelled("ProvisionedThroughputExceeded", "None"))
+    # a bad item has to be left out, retrying the whole transaction cannot help
+    assert not is_throttling_error(cancelled("ValidationError", "ThrottlingError"))
+    assert not is_throttling_error(cancelled("ConditionalCheckFailed", "None"))
+
+
+def test_rate_follows_aimd():
+    clock = FakeClock()
+    limiter = AdaptiveRateLimiter(rate=100, increase=10, max_rate=150, clock=clock)
+    limiter.on_throttle()
+    assert limiter.rate == 50
+    clock.sleep(1)
+    limiter.on_success()
+    assert limiter.rate == 60
+    for _ in range(20):
+        clock.sleep(1)
+        limiter.on_success()
+    assert limiter.rate == 150
+
+
+def test_rate_increases_with_time_not_with_the_number_of_callers():
+    clock = FakeClock()
+    one = AdaptiveRateLimiter(rate=100, increase=10, clock=clock)
+    eight = AdaptiveRateLimiter(rate=100, increase=10, clock=clock)
+    for _ in range(10):
+        clock.sleep(0.5)
+        one.on_success()
+        for _ in range(8):
+            eight.on_success()
+    assert one.rate == eight.rate == 150
+    # a long quiet spell counts for no more than one second
+    clock.sleep(60)
+    one.on_success()
+    assert one.rate == 160
+
+
+def test_acquire_waits_for_tokens():
+    clock = FakeClock()
+    limiter = AdaptiveRateLimiter(rate=10, clock=clock, sleep=clock.sleep)
+    limiter.acquire(10)
+    assert clock.now == 0
+    limiter.acquire(5)
+    assert clock.now == 0.5
+
+
+def test_from_table_uses_provisioned_capacity():
+    limiter = AdaptiveRateLimiter.from_table(ThrottlingDynamoDBClient(FakeClock(), 40), "Table")
+    assert limiter.rate == 40
+    assert limiter.max_rate == 80
+
+
+def test_batch_write_backs_off_when_throttled():
+    clock = FakeClock()
+    client = ThrottlingDynamoDBClient(clock, capacity=50)
+    limiter = AdaptiveRateLimiter(rate=200, clock=clock, sleep=clock.sleep)
+    result = batch_write(
+        client, [put_item(i) for i in range(1000)], sleep=clock.sleep, rate_limiter=limiter
+    )
+    assert result.succeeded == 1000
+    assert client.written == 1000
+    assert limiter.throttles == client.throttled > 0
+    # the limiter settles near the capacity instead of throttling every request
+    assert client.throttled < len(range(0, 1000, 25)) / 2
@@ -0,0 +1,100 @@
+import json
+import os
+import threading
+
+import pytest
+
+from scripts.pipeline.common.request_files import (
+    MANIFEST_FILE,
+    iter_request_files,
+    read_manifest,
+    upload_request_files,
+    write_request_files,
+)
+from scripts.pipeline.data_cleanse.generate_participating_icb_data import (
+    generate_participating_icb_requests,
+)
+from scripts.pipeline.unit_tests.test_bulk_writer import FakeDynamoDBClient
+
+
+def put_request(key):
+    return {"PutRequest": {"Item": {"IcbCode": {"S": f"Q{key:02d}"}}}}
+
+
+def test_requests_are_split_into_compact_files(tmp_path):
+    directory = str(tmp_path / "requests")
+    manifest = write_request_files(
+        (put_request(i) for i in range(60)), directory, "ENVIRONMENT-ParticipatingIcb"
+    )
+    assert [entry["items"] for entry in manifest["files"]] == [25, 25, 10]
+    assert manifest["items"] == 60
+    assert read_manifest(directory) == manifest
+
+    with open(os.path.join(directory, manifest["files"][2]["name"])) as file:
+        text = file.read()
+    assert "\n" not in text and ", " not in text
+    assert json.loads(text) == {
+        "ENVIRONMENT-ParticipatingIcb": [put_request(i) for i in range(50, 60)]
+    }
+
+    items = list(iter_request_files(directory, environment="dev-1"))
+    assert items[0] == {
+        "Put": {"Item": {"IcbCode": {"S": "Q00"}}, "TableName": "dev-1-ParticipatingIcb"}
+    }
+    assert len(items) == 60
+
+
+def test_rewriting_a_directory_removes_old_files(tmp_path):
+    directory = str(tmp_path)
+    write_request_files((put_request(i) for i in range(60)), directory, "Table")
+    write_request_files((put_request(i) for i in range(5)), directory, "Table")
+    assert sorted(os.listdir(directory)) == [MANIFEST_FILE, "requests-00001.json"]
+
+
+def test_unfinished_directories_are_not_uploaded(tmp_path):
+    with pytest.raises(ValueError):
+        upload_request_files(str(tmp_path), client_factory=FakeDynamoDBClient)
+
+
+def test_upload_sends_files_in_parallel_and_retries(tmp_path):
+    directory = str(tmp_path)
+    write_request_files((put_request(i) for i in range(100)), directory, "ENVIRONMENT-Icb")
+    clients = []
+    lock = threading.Lock()
+
+    def client_factory():
+        with lock:
+            clients.append(FakeDynamoDBClient(unprocessed_rounds=1))
+            return clients[-1]
+
+    result = upload_request_files(
+        directory,
+        environment="dev",
+        workers=3,
+        client_factory=client_factory,
+        sleep=lambda delay: None,
+    )
+    assert result.succeeded == 100
+    assert len(clients) == 3
+    written = [request for client in clients for request in client.written]
+    assert sorted(request["PutRequest"]["Item"]["IcbCode"]["S"] for request in written) == [
+        f"Q{i:02d}" for i in range(100)
+    ]
+    assert {table for client in clients for request in client.requests for table in request} == {
+        "dev-Icb"
+    }
+
+
+def test_icb_generator_writes_request_files(tmp_path):
+    csv_path = tmp_path / "icbs.csv"
+    rows = "".join(f"{i},Q{i:02d},Board {i}\n" for i in range(30))
+    csv_path.write_text("Id,IcbCode,Board\n" + rows)
+    directory = str(tmp_path / "requests")
+    manifest = generate_participating_icb_requests(str(csv_path), directory, "dev-ParticipatingIcb")
+    assert [entry["items"] for entry in manifest["files"]] == [25, 5]
+    (item, *_) = iter_request_files(directory)
+    assert item["Put"]["Item"] == {
+        "Id": {"N": "0"},
+        "IcbCode": {"S": "Q00"},
+        "Board": {"S": "Board 0"},
+    }
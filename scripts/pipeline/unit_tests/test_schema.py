@@ -0,0 +1,98 @@
+import pickle
+
+import pytest
+
+from scripts.pipeline.common.records import Record
+from scripts.pipeline.common.schema import Column, TableSchema
+
+SCHEMA = TableSchema(
+    [
+        Column("Id", "S", derived="id"),
+        Column("Name", "S", index=1),
+        Column("Count", "N", index=0, coerce=lambda value: str(int(value))),
+        Column("Version", "N", value="0"),
+        Column("Active", "BOOL", value=False),
+    ],
+    key=["Id"],
+    derived={"id": lambda row, index: f"ID-{row[1]}{index}"},
+    row_filter=lambda row: bool(row[1]),
+)
+
+
+def test_converter_builds_put_items():
+    rows = [["007", "a"], ["1", ""], [2, "b"]]
+    assert list(SCHEMA.converter("Table")(rows)) == [
+        {
+            "Put": {
+                "Item": {
+                    "Id": {"S": "ID-a0"},
+                    "Name": {"S": "a"},
+                    "Count": {"N": "7"},
+                    "Version": {"N": "0"},
+                    "Active": {"BOOL": False},
+                },
+                "TableName": "Table",
+            }
+        },
+        {
+            "Put": {
+                "Item": {
+                    "Id": {"S": "ID-b2"},
+                    "Name": {"S": "b"},
+                    "Count": {"N": "2"},
+                    "Version": {"N": "0"},
+                    "Active": {"BOOL": False},
+                },
+                "TableName": "Table",
+            }
+        },
+    ]
+
+
+def test_converter_passes_row_index_to_derived_values():
+    items = list(SCHEMA.converter("Table")([["1", "a"], ["2", "b"]], start=10))
+    assert [item["Put"]["Item"]["Id"]["S"] for item in items] == ["ID-a10", "ID-b11"]
+
+
+def test_converter_builds_put_requests():
+    items = list(SCHEMA.converter(request="PutRequest")([["1", "a"]]))
+    assert list(items[0]) == ["PutRequest"]
+    assert items[0]["PutRequest"]["Item"]["Id"] == {"S": "ID-a0"}
+
+
+def test_converter_builds_records_expanded_into_put_items():
+    rows = [["007", "a"], ["1", ""], [2, "b"]]
+    records = list(SCHEMA.converter("Table", request="Record")(rows))
+    assert records == [("ID-a0", "a", "7", "0", False), ("ID-b2", "b", "2", "0", False)]
+    assert [record.to_item() for record in records] == list(SCHEMA.converter("Table")(rows))
+    assert records[0].table_name == "Table"
+    assert records[0].key == ("Id",)
+
+
+def test_compiled_attributes_match_the_generic_ones():
+    (record,) = SCHEMA.converter("Table", request="Record")([["1", "a"]])
+    assert record.attributes() == Record.attributes(record)
+    assert list(record.attributes()) == list(record.attribute_names)
+
+
+def test_records_pickle_as_their_record_type():
+    (record,) = SCHEMA.converter("Table", request="Record")([["1", "a"]])
+    copy = pickle.loads(pickle.dumps(record))
+    assert type(copy) is type(record)
+    assert copy == record
+    assert type(record) is SCHEMA.record_type("Table")
+    assert type(record) is not SCHEMA.record_type("Other")
+
+
+def test_converter_is_compiled_once_per_table():
+    assert SCHEMA.converter("Table") is SCHEMA.converter("Table")
+    assert SCHEMA.converter("Table") is not SCHEMA.converter("Other")
+
+
+def test_column_needs_one_source():
+    with pytest.raises(ValueError):
+        Column("Id", "S")
+    with pytest.raises(ValueError):
+        Column("Id", "S", index=0, value="1")
+    with pytest.raises(ValueError):
+        Column("Id", "L", index=0)
@@ -0,0 +1,120 @@
+import json
+import threading
+
+import pytest
+
+from scripts.pipeline.seed_orchestrator.seed_orchestrator import (
+    FAILED,
+    POPULATED,
+    SEEDED,
+    SKIPPED,
+    Seed,
+    count_up_to,
+    read_fixture,
+    run_seed,
+    run_seeds,
+)
+
+
+class CountingDynamoDBClient:
+    # a table of `items` items, scanned at most `page_size` at a time
+    def __init__(self, items, page_size=1000):
+        self.items = items
+        self.page_size = page_size
+        self.scanned = 0
+
+    def scan(self, TableName, Select, Limit, ExclusiveStartKey=None):
+        start = ExclusiveStartKey["n"] if ExclusiveStartKey else 0
+        count = min(Limit, self.page_size, self.items - start)
+        self.scanned += count
+        response = {"Count": count}
+        if start + count < self.items:
+            response["LastEvaluatedKey"] = {"n": start + count}
+        return response
+
+
+def test_count_stops_at_the_limit():
+    client = CountingDynamoDBClient(815000)
+    assert count_up_to(client, "dev-Postcode", 100) == 100
+    assert client.scanned == 100
+
+    client = CountingDynamoDBClient(50, page_size=20)
+    assert count_up_to(client, "dev-Population", 100) == 50
+
+
+def test_run_seed_skips_populated_tables():
+    loaded = []
+    seed = Seed("icb", "dev-ParticipatingIcb", 23, lambda: loaded.append("icb"))
+    assert run_seed(seed, lambda: CountingDynamoDBClient(23)) == POPULATED
+    assert run_seed(seed, lambda: CountingDynamoDBClient(22)) == SEEDED
+    assert loaded == ["icb"]
+
+
+def test_refreshing_seed_loads_a_populated_table():
+    loaded = []
+    seed = Seed("postcode", "dev-Postcode", 1, lambda: loaded.append("postcode"), refresh=True)
+    assert run_seed(seed, lambda: CountingDynamoDBClient(1)) == SEEDED
+    assert loaded == ["postcode"]
+
+
+def test_independent_seeds_run_in_parallel_after_their_dependencies():
+    # lsoa and postcode can only both finish if they run at the same time
+    barrier = threading.Barrier(2, timeout=5)
+    order = []
+
+    def run(seed):
+        if seed.name in ("lsoa", "postcode"):
+            barrier.wait()
+        order.append(seed.name)
+        return SEEDED
+
+    seeds = [
+        Seed("population", "dev-Population", 100, None, depends_on=["lsoa"]),
+        Seed("lsoa", "dev-UniqueLsoa", 10, None),
+        Seed("postcode", "dev-Postcode", 1, None),
+    ]
+    outcomes = run_seeds(seeds, run)
+    assert {name: outcome for name, (outcome, _) in outcomes.items()} == {
+        "lsoa": SEEDED,
+        "postcode": SEEDED,
+        "population": SEEDED,
+    }
+    assert order.index("lsoa") < order.index("population")
+
+
+def test_failed_seed_skips_its_dependents_only():
+    def run(seed):
+        if seed.name == "icb":
+            raise RuntimeError("table missing")
+        return SEEDED
+
+    seeds = [
+        Seed("icb", "dev-ParticipatingIcb", 23, None),
+        Seed("phlebotomy", "dev-PhlebotomySite", 2, None, depends_on=["icb"]),
+        Seed("postcode", "dev-Postcode", 1, None),
+    ]
+    outcomes = run_seeds(seeds, run)
+    assert outcomes["icb"][0] == FAILED
+    assert outcomes["phlebotomy"][0] == SKIPPED
+    assert outcomes["postcode"][0] == SEEDED
+
+
+def test_dependency_cycles_are_rejected():
+    seeds = [
+        Seed("a", "dev-A", 1, None, depends_on=["b"]),
+        Seed("b", "dev-B", 1, None, depends_on=["a"]),
+    ]
+    with pytest.raises(ValueError):
+        run_seeds(seeds, lambda seed: SEEDED)
+
+
+def test_fixture_environment_is_replaced_in_memory(tmp_path):
+    path = tmp_path / "fixture.json"
+    text = json.dumps(
+        {"ENVIRONMENT-UniqueLsoa": [{"PutRequest": {"Item": {"LSOA_2011": {"S": "E01"}}}}]}
+    )
+    path.write_text(text)
+    assert list(read_fixture(str(path), "dev-1")) == [
+        {"Put": {"Item": {"LSOA_2011": {"S": "E01"}}, "TableName": "dev-1-UniqueLsoa"}}
+    ]
+    assert path.read_text() == text
@@ -0,0 +1,66 @@
+import zipfile
+
+import pytest
+
+from scripts.pipeline.common.source import open_csv_source, split_source
+from scripts.pipeline.nonprod_postcode_load.nonprod_postcode_load import (
+    generate_nonprod_lsoa_json,
+)
+from scripts.pipeline.unit_tests.test_checkpoint import (
+    FlakyDynamoDBClient,
+    postcode,
+    write_postcode_csv,
+)
+
+
+def write_zip(path, members):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, text in members.items():
+            archive.writestr(name, text)
+
+
+def test_split_source():
+    assert split_source("data/postcodes.zip:postcodes.csv") == (
+        "data/postcodes.zip",
+        "postcodes.csv",
+    )
+    assert split_source("data/postcodes.csv") == ("data/postcodes.csv", None)
+
+
+@pytest.mark.parametrize("cache", [False, True])
+def test_reads_csv_file_and_zip_member_alike(tmp_path, cache):
+    text = "﻿HEADER_1,HEADER_2\r\na,\"b,c\"\r\nd,e\r\n"
+    (tmp_path / "rows.csv").write_text(text, encoding="utf-8")
+    write_zip(tmp_path / "rows.zip", {"readme.txt": "ignored", "rows.csv": text})
+
+    expected = [["a", "b,c"], ["d", "e"]]
+    for path in ["rows.csv", "rows.zip", "rows.zip:rows.csv"]:
+        with open_csv_source(str(tmp_path / path), cache=cache) as rows:
+            assert list(rows) == expected
+
+
+def test_zip_with_several_csv_members_needs_a_member_name(tmp_path):
+    write_zip(tmp_path / "rows.zip", {"a.csv": "h\n1\n", "b.csv": "h\n2\n"})
+    with pytest.raises(ValueError):
+        with open_csv_source(str(tmp_path / "rows.zip"), cache=False):
+            pass
+    with open_csv_source(str(tmp_path / "rows.zip:b.csv")) as rows:
+        assert list(rows) == [["2"]]
+
+
+def test_closing_early_stops_the_reader(tmp_path):
+    write_zip(tmp_path / "rows.zip", {"rows.csv": "h\n" + "1\n" * 50000})
+    with open_csv_source(str(tmp_path / "rows.zip"), cache=False) as rows:
+        assert next(rows) == ["1"]
+
+
+def test_postcode_load_from_zip(tmp_path):
+    csv_path = tmp_path / "postcodes.csv"
+    write_postcode_csv(csv_path, 60)
+    zip_path = tmp_path / "postcodes.zip"
+    write_zip(zip_path, {"postcodes.csv": csv_path.read_text()})
+
+    client = FlakyDynamoDBClient()
+    result = generate_nonprod_lsoa_json(str(zip_path), "dev-Postcode", client=client)
+    assert result.succeeded == 60
+    assert client.written == [postcode(i) for i in range(60)]
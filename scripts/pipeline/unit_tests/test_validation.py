@@ -0,0 +1,79 @@
+import json
+
+from scripts.pipeline.common.validation import ItemValidator, RejectLog
+from scripts.pipeline.nonprod_postcode_load.nonprod_postcode_load import (
+    VALIDATOR,
+    generate_nonprod_lsoa_json,
+    iter_dynamodb_json,
+    iter_records,
+)
+from scripts.pipeline.unit_tests.test_checkpoint import (
+    FlakyDynamoDBClient,
+    postcode,
+    write_postcode_csv,
+)
+
+
+def postcode_row(code="AB1 2CD", easting="1", imd_rank="1"):
+    row = ["A", code] + ["1"] * 18
+    row[6] = easting
+    row[15] = imd_rank
+    return row
+
+
+def test_schema_validator_checks_keys_numbers_and_postcodes():
+    rows = [
+        postcode_row(),
+        postcode_row(code=""),
+        postcode_row(code="not a postcode"),
+        postcode_row(easting="12a"),
+        postcode_row(imd_rank="-1.5e3"),
+    ]
+    reasons = VALIDATOR.check(list(iter_dynamodb_json(rows, "dev-Postcode")))
+    assert reasons[0] == []
+    assert "key POSTCODE is missing or empty" in reasons[1]
+    assert reasons[2] == ["POSTCODE does not match " + VALIDATOR.formats["POSTCODE"].pattern]
+    assert reasons[3] == ["EASTING_1M is not a number"]
+    assert reasons[4] == []
+
+
+def test_records_are_checked_like_their_dynamodb_json():
+    rows = [postcode_row(), postcode_row(code=""), postcode_row(easting="1,5")]
+    records = list(iter_records(rows, "dev-Postcode"))
+    assert VALIDATOR.check(records) == VALIDATOR.check(list(iter_dynamodb_json(rows, "dev-Postcode")))
+
+
+def test_oversized_items_are_rejected():
+    validator = ItemValidator(key=["POSTCODE"], max_item_size=100)
+    items = [
+        {"Put": {"Item": {"POSTCODE": {"S": "AB1 2CD"}, "NAME": {"S": "x" * size}}}}
+        for size in (10, 100)
+    ]
+    assert validator.check(items) == [[], ["item is larger than 100 bytes"]]
+
+
+def test_rejects_are_logged_and_kept_out_of_batches(tmp_path):
+    rejects = RejectLog(str(tmp_path / "rejects.jsonl"))
+    pairs = [
+        (1, next(iter_dynamodb_json([postcode_row()], "dev-Postcode"))),
+        (2, next(iter_dynamodb_json([postcode_row(easting="")], "dev-Postcode"))),
+    ]
+    assert [offset for offset, _ in VALIDATOR.filter_pairs(pairs, rejects)] == [1]
+    rejects.close()
+    (record,) = [json.loads(line) for line in open(rejects.path)]
+    assert record["row"] == 2
+    assert record["reasons"] == ["EASTING_1M is not a number"]
+
+
+def test_postcode_load_skips_bad_rows(tmp_path):
+    csv_path = tmp_path / "postcodes.csv"
+    write_postcode_csv(csv_path, 30)
+    with open(csv_path, "a") as file:
+        file.write(",".join(postcode_row(easting="n/a")) + "\n")
+        file.write(",".join(postcode_row(code="")) + "\n")
+    client = FlakyDynamoDBClient()
+    result = generate_nonprod_lsoa_json(str(csv_path), "dev-Postcode", client=client)
+    assert result.succeeded == 30
+    assert client.written == [postcode(i) for i in range(30)]
+    rejects = tmp_path / "postcodes.csv.dev-Postcode.rejects.jsonl"
+    assert [json.loads(line)["row"] for line in open(rejects)] == [31, 32]